@@ -1,7 +1,5 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
-from django.dispatch import receiver
 
 
 class UserProfile(models.Model):
@@ -21,12 +19,13 @@ class UserProfile(models.Model):
         return f"{self.user.username}'s Profile"
 
 
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        UserProfile.objects.create(user=instance)
-
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+def get_profile(user):
+    """
+    The user's profile, or an unsaved blank one if they have never edited it.
+    Rows are written only when a profile is first saved, never as a side
+    effect of saving the user (which Django does on every login).
+    """
+    try:
+        return user.profile
+    except UserProfile.DoesNotExist:
+        return UserProfile(user=user)
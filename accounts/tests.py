@@ -1,7 +1,11 @@
+import re
+from collections import Counter
+
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
+from django.db import connection
 from django.urls import reverse
-from .models import UserProfile
+from .models import UserProfile, get_profile
 from .forms import CustomUserCreationForm, UserProfileForm
 
 
@@ -14,13 +18,16 @@ class UserProfileModelTest(TestCase):
         )
     
     def test_user_profile_creation(self):
-        # Profile should be created automatically via signal
-        self.assertTrue(hasattr(self.user, 'profile'))
-        self.assertIsInstance(self.user.profile, UserProfile)
+        # Profiles are created lazily, the first time one is saved
+        profile = get_profile(self.user)
+        self.assertIsInstance(profile, UserProfile)
+        self.assertIsNone(profile.pk)
+        profile.save()
+        self.assertEqual(get_profile(User.objects.get(pk=self.user.pk)), profile)
     
     def test_user_profile_str_method(self):
         expected_str = f"{self.user.username}'s Profile"
-        self.assertEqual(str(self.user.profile), expected_str)
+        self.assertEqual(str(get_profile(self.user)), expected_str)
 
 
 class CustomUserCreationFormTest(TestCase):
@@ -77,7 +84,7 @@ class UserProfileFormTest(TestCase):
             'postal_code': '12345',
             'country': 'US'
         }
-        form = UserProfileForm(data=form_data, instance=self.user.profile)
+        form = UserProfileForm(data=form_data, instance=get_profile(self.user))
         self.assertTrue(form.is_valid())
 
 
@@ -179,15 +186,120 @@ class AuthenticationViewsTest(TestCase):
         self.assertEqual(response.status_code, 302)  # Redirect to login
 
 
+class WriteCounter:
+    """Counts INSERT/UPDATE/DELETE statements per table while active."""
+    pattern = re.compile(r'^\s*(INSERT INTO|UPDATE|DELETE FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+    def __init__(self):
+        self.writes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        match = self.pattern.match(sql)
+        if match:
+            self.writes[(match.group(1).split()[0].upper(), match.group(2))] += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wrapper.__exit__(*exc_info)
+
+    def to(self, table):
+        return sum(count for (_, name), count in self.writes.items() if name == table)
+
+
+class ProfileWriteCountTest(TestCase):
+    profile_data = {
+        'first_name': 'Test',
+        'last_name': 'User',
+        'email': 'test@example.com',
+        'phone': '+1234567890',
+        'city': 'Test City',
+        'country': 'US',
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            first_name='Test',
+            last_name='User'
+        )
+
+    def test_login_writes_only_last_login(self):
+        with WriteCounter() as counter:
+            response = self.client.post(reverse('accounts:login'), {
+                'username': 'testuser',
+                'password': 'testpass123'
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(counter.writes[('UPDATE', 'auth_user')], 1)
+        self.assertEqual(counter.to('auth_user'), 1)
+        self.assertEqual(counter.to('accounts_userprofile'), 0)
+
+    def test_registration_creates_no_profile(self):
+        with WriteCounter() as counter:
+            response = self.client.post(reverse('accounts:register'), {
+                'username': 'newuser',
+                'first_name': 'New',
+                'last_name': 'User',
+                'email': 'newuser@example.com',
+                'password1': 'complexpassword123',
+                'password2': 'complexpassword123'
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(counter.writes[('INSERT', 'auth_user')], 1)
+        self.assertEqual(counter.to('accounts_userprofile'), 0)
+
+    def test_viewing_profile_does_not_create_it(self):
+        self.client.login(username='testuser', password='testpass123')
+        with WriteCounter() as counter:
+            self.client.get(reverse('accounts:profile'))
+            self.client.get(reverse('accounts:edit_profile'))
+        self.assertEqual(counter.to('accounts_userprofile'), 0)
+        self.assertEqual(counter.to('auth_user'), 0)
+        self.assertFalse(UserProfile.objects.filter(user=self.user).exists())
+
+    def test_profile_created_once_on_first_edit(self):
+        self.client.login(username='testuser', password='testpass123')
+        with WriteCounter() as counter:
+            response = self.client.post(reverse('accounts:edit_profile'), self.profile_data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(counter.writes[('INSERT', 'accounts_userprofile')], 1)
+        self.assertEqual(counter.to('accounts_userprofile'), 1)
+        # Name and email were unchanged, so the user row is not rewritten
+        self.assertEqual(counter.to('auth_user'), 0)
+        self.assertEqual(UserProfile.objects.get(user=self.user).city, 'Test City')
+
+        with WriteCounter() as counter:
+            self.client.post(reverse('accounts:edit_profile'), self.profile_data)
+        self.assertEqual(counter.to('accounts_userprofile'), 0)
+        self.assertEqual(counter.to('auth_user'), 0)
+
+    def test_user_save_does_not_touch_profile(self):
+        get_profile(self.user).save()
+        user = User.objects.get(pk=self.user.pk)
+        self.assertIsNotNone(user.profile)
+        with WriteCounter() as counter:
+            user.first_name = 'Updated'
+            user.save()
+        self.assertEqual(counter.to('auth_user'), 1)
+        self.assertEqual(counter.to('accounts_userprofile'), 0)
+
+
 class UserProfileSignalTest(TestCase):
-    def test_profile_created_on_user_creation(self):
+    def test_profile_not_created_on_user_creation(self):
         user = User.objects.create_user(
             username='signaltest',
             email='signal@example.com',
             password='testpass123'
         )
-        # Profile should be created automatically
-        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        # Profiles are created lazily, not when the user is
+        self.assertFalse(UserProfile.objects.filter(user=user).exists())
     
     def test_profile_saved_on_user_save(self):
         user = User.objects.create_user(
@@ -196,9 +308,11 @@ class UserProfileSignalTest(TestCase):
             password='testpass123'
         )
         
+        get_profile(user).save()
+        
         # Update user
         user.first_name = 'Updated'
         user.save()
         
-        # Profile should still exist
-        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        # Profile should still exist, exactly once
+        self.assertEqual(UserProfile.objects.filter(user=user).count(), 1)
@@ -6,8 +6,8 @@ from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import reverse_lazy
 from django.views.generic import CreateView
 from .forms import CustomUserCreationForm, CustomAuthenticationForm, UserProfileForm, UserUpdateForm
-from .models import UserProfile
-from store.models import Order
+from .models import get_profile
+from store.archive import orders_for_user
 
 
 class CustomLoginView(LoginView):
@@ -37,12 +37,9 @@ class RegisterView(CreateView):
 
 @login_required
 def profile_view(request):
-    try:
-        profile = request.user.profile
-    except UserProfile.DoesNotExist:
-        profile = UserProfile.objects.create(user=request.user)
-    
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')[:5]
+    profile = get_profile(request.user)
+
+    orders = orders_for_user(request.user, limit=5)
     
     context = {
         'profile': profile,
@@ -53,18 +50,19 @@ def profile_view(request):
 
 @login_required
 def edit_profile_view(request):
-    try:
-        profile = request.user.profile
-    except UserProfile.DoesNotExist:
-        profile = UserProfile.objects.create(user=request.user)
+    profile = get_profile(request.user)
 
     if request.method == 'POST':
         user_form = UserUpdateForm(request.POST, instance=request.user)
         profile_form = UserProfileForm(request.POST, instance=profile)
         
         if user_form.is_valid() and profile_form.is_valid():
-            user_form.save()
-            profile_form.save()
+            # Only write what was actually edited; the first profile save
+            # creates the row.
+            if user_form.has_changed():
+                user_form.save()
+            if profile_form.has_changed():
+                profile_form.save()
             messages.success(request, 'Your profile has been updated successfully!')
             return redirect('accounts:profile')
     else:
@@ -80,7 +78,7 @@ def edit_profile_view(request):
 
 @login_required
 def order_history_view(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = orders_for_user(request.user)
     context = {
         'orders': orders,
     }
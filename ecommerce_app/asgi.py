@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_app.settings')
 
 application = get_asgi_application()
+
+if settings.WARMUP_ON_STARTUP:
+    # Database connections are per thread; ASGI serves sync code from a
+    # thread pool, so there is no connection worth opening here.
+    from store.warmup import warm_up
+
+    warm_up(connect=False)
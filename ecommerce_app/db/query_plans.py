@@ -0,0 +1,93 @@
+"""
+Query plan checks for SQLite.
+
+``capture_plans()`` records the SELECT, UPDATE and DELETE statements run
+inside it and, on exit, SQLite's ``EXPLAIN QUERY PLAN`` for each.
+``plan_problems()`` then flags full scans of the tables in ``LARGE_TABLES``
+and sorts that need a temporary B-tree. Tests run every view through these
+so a query that stops using an index fails before the tables are big enough
+for anyone to notice.
+
+Walking a whole index (``SCAN t USING INDEX i``) is accepted for paginated
+queries and counts: the first stops after ``LIMIT`` rows already in order,
+the second is the cheapest way to count and bounded by the listing itself.
+Callers can also accept temporary sorts for queries whose rows are bounded
+by something small, such as one category subtree.
+"""
+import re
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Tables that grow with traffic or the catalog. Lookup tables such as
+# categories stay small enough that scanning them is fine.
+LARGE_TABLES = {
+    'auth_user',
+    'accounts_userprofile',
+    'store_product',
+    'store_productimage',
+    'store_cart',
+    'store_cartitem',
+    'store_order',
+    'store_orderitem',
+    'store_archivedorder',
+    'store_archivedorderitem',
+    'store_task',
+    'store_catalogchange',
+    'django_session',
+}
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+SCAN = re.compile(r'^SCAN (\w+)( USING (?:COVERING )?INDEX)?')
+BOUNDED = re.compile(r'\bLIMIT\b|\bCOUNT\(', re.IGNORECASE)
+TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|RIGHT PART OF ORDER BY|LAST TERM OF ORDER BY)')
+ALIAS = re.compile(r'\b(?:FROM|JOIN|UPDATE)\s+"?(\w+)"?\s+(?:AS\s+)?"?([A-Z]\d+)"?\b', re.IGNORECASE)
+
+
+class QueryPlan:
+    def __init__(self, sql, params, steps):
+        self.sql = sql
+        self.params = params
+        self.steps = steps
+
+    def __str__(self):
+        return '\n'.join([self.sql] + [f'  {step}' for step in self.steps])
+
+
+class PlanCapture(list):
+    """Collects ``(sql, params)`` through ``connection.execute_wrapper``."""
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().split(None, 1)[0].upper() in EXPLAINED:
+            self.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def capture_plans(using=DEFAULT_DB_ALIAS):
+    """Yield a list that is filled with a ``QueryPlan`` per statement once the block exits."""
+    connection = connections[using]
+    captured = PlanCapture()
+    plans = []
+    with connection.execute_wrapper(captured):
+        yield plans
+    with connection.cursor() as cursor:
+        for sql, params in captured:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plans.append(QueryPlan(sql, params, [row[-1] for row in cursor.fetchall()]))
+
+
+def plan_problems(plan, large_tables=LARGE_TABLES, allowed_scans=(), allow_sort=False):
+    """Describe each full scan of a large table and each temporary sort in ``plan``."""
+    # Subqueries name their tables by alias (U0, T3...), so map those back.
+    aliases = {alias: table for table, alias in ALIAS.findall(plan.sql)}
+    bounded = BOUNDED.search(plan.sql) is not None
+    problems = []
+    for step in plan.steps:
+        scan = SCAN.match(step)
+        if scan and not (scan.group(2) and bounded):
+            table = aliases.get(scan.group(1), scan.group(1))
+            if table in large_tables and table not in allowed_scans:
+                problems.append(f'full scan of {table}: {step}')
+        if TEMP_SORT.search(step) and not allow_sort:
+            problems.append(f'temporary sort: {step}')
+    return problems
@@ -0,0 +1,97 @@
+"""
+Primary/replica database routing.
+
+Catalog reads (products, categories and product images) are spread over the
+databases listed in ``DATABASE_REPLICA_ALIASES``; everything else, and every
+write, goes to the primary. A request that writes, and the client's requests
+for ``REPLICA_PIN_SECONDS`` afterwards, read from the primary too so users
+see their own changes immediately.
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+CATALOG_MODELS = {'store.product', 'store.category', 'store.productimage'}
+PIN_COOKIE_NAME = 'pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_pinned = ContextVar('pinned_to_primary', default=False)
+_wrote = ContextVar('wrote_to_primary', default=False)
+
+
+def pin_to_primary():
+    _pinned.set(True)
+    _wrote.set(True)
+
+
+def is_pinned_to_primary():
+    return _pinned.get()
+
+
+def get_replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICA_ALIASES', [])
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = get_replica_aliases()
+        if not replicas or is_pinned_to_primary():
+            return DEFAULT_DB_ALIAS
+        if model._meta.label_lower not in CATALOG_MODELS:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Reads later in the same request must see this write.
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *get_replica_aliases()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and are never migrated directly.
+        if db in get_replica_aliases():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Pins unsafe requests, and the client's next few requests, to the primary."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        unsafe = request.method not in SAFE_METHODS
+        pinned = unsafe or _cookie_still_valid(request.COOKIES.get(PIN_COOKIE_NAME, ''))
+        pinned_token = _pinned.set(pinned)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if get_replica_aliases() and (unsafe or _wrote.get()):
+                pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+                response.set_cookie(
+                    PIN_COOKIE_NAME,
+                    str(int(time.time()) + pin_seconds),
+                    max_age=pin_seconds,
+                    httponly=True,
+                    samesite='Lax',
+                )
+            return response
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+
+
+def _cookie_still_valid(value):
+    try:
+        return int(value) > time.time()
+    except ValueError:
+        return False
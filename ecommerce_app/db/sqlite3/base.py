@@ -0,0 +1,53 @@
+"""
+SQLite backend tuned for concurrent web workers.
+
+Adds two keys to ``OPTIONS`` on top of Django's sqlite3 backend:
+
+* ``pragmas``: PRAGMA settings applied to every new connection, merged over
+  ``DEFAULT_PRAGMAS`` (WAL journal, busy timeout, mmap, relaxed fsync);
+* ``transaction_mode``: how ``atomic()`` opens a transaction. ``IMMEDIATE``
+  takes the write lock up front, so a transaction that reads and then writes
+  waits for ``busy_timeout`` instead of failing with "database is locked"
+  when it tries to upgrade its lock. It also serializes read-only
+  transactions, so the project leaves this at ``DEFERRED`` and opens only
+  its write transactions IMMEDIATE, with ``write_transaction()`` (see
+  ``ecommerce_app.db.writes``), which sets ``begin_mode`` for one ``BEGIN``.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'synchronous': 'NORMAL',
+}
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Overrides transaction_mode for the next BEGIN when set.
+        self.begin_mode = None
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        mode = params.pop('transaction_mode', 'DEFERRED')
+        if mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}, not {mode!r}."
+            )
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = {**DEFAULT_PRAGMAS, **self.settings_dict['OPTIONS'].get('pragmas', {})}
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.begin_mode or self.settings_dict['OPTIONS'].get('transaction_mode', 'DEFERRED').upper()
+        self.cursor().execute(f'BEGIN {mode}')
@@ -0,0 +1,110 @@
+"""
+Serialized write queue for SQLite.
+
+SQLite allows a single writer at a time. Instead of letting every thread of a
+worker race for the database lock, write transactions queue up in FIFO order
+on a process-wide lock and only the head of the queue talks to the database.
+When the queue is too long or a write cannot get the lock in time,
+``DatabaseBusy`` is raised so views can answer with a "try again" message
+rather than a server error.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+
+class DatabaseBusy(Exception):
+    pass
+
+
+class WriteQueue:
+    """A fair (first come, first served) lock with a bounded number of waiters."""
+
+    def __init__(self, max_depth=64):
+        self.max_depth = max_depth
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set()
+
+    @property
+    def depth(self):
+        return self._next_ticket - self._serving
+
+    def acquire(self, timeout=None):
+        with self._condition:
+            if self.depth >= self.max_depth:
+                return False
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._serving != ticket:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._abandoned.add(ticket)
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def release(self):
+        with self._condition:
+            self._serving += 1
+            while self._serving in self._abandoned:
+                self._abandoned.remove(self._serving)
+                self._serving += 1
+            self._condition.notify_all()
+
+
+queue = WriteQueue(max_depth=getattr(settings, 'SQLITE_WRITE_QUEUE_DEPTH', 64))
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    ``atomic()`` for a block that writes. On SQLite the transaction opens with
+    BEGIN IMMEDIATE, taking the write lock up front, so a block that reads
+    before it writes waits for ``busy_timeout`` instead of failing when it
+    upgrades its lock. Plain ``atomic()`` stays DEFERRED for readers.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    immediate = hasattr(connection, 'begin_mode') and not connection.in_atomic_block
+    if immediate:
+        connection.begin_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            if immediate:
+                connection.begin_mode = None
+            yield
+    finally:
+        if immediate:
+            connection.begin_mode = None
+
+
+@contextmanager
+def serialized_write(using=None):
+    """
+    Run the block in a transaction, queued behind this process's other writes
+    when the database is SQLite.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with write_transaction(using=using):
+            yield
+        return
+
+    if not queue.acquire(timeout=getattr(settings, 'SQLITE_WRITE_QUEUE_TIMEOUT', 10)):
+        raise DatabaseBusy('Write queue is full or timed out')
+    try:
+        with write_transaction(using=using):
+            yield
+    except OperationalError as exc:
+        if 'locked' in str(exc) or 'busy' in str(exc):
+            raise DatabaseBusy(str(exc)) from exc
+        raise
+    finally:
+        queue.release()
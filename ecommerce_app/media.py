@@ -0,0 +1,147 @@
+"""
+Production serving of user-uploaded media.
+
+Upload names are not fingerprinted: the storage only avoids overwriting a
+file that still exists, so a name freed by a delete can come back with other
+content. Responses are therefore cached for a bounded ``MEDIA_CACHE_MAX_AGE``
+and then revalidated against their ETag and Last-Modified. Whole files are returned with
+``FileResponse`` so the WSGI server can use ``sendfile``; with
+``MEDIA_ACCEL_REDIRECT_PREFIX`` set the body is left to the front-end proxy
+(nginx ``X-Accel-Redirect``) entirely. Single byte ranges are supported,
+and precompressed ``.br``/``.gz`` siblings written by ``build_assets`` are
+used when the client accepts them.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _etag(stat_result, encoding=None):
+    suffix = f'-{encoding}' if encoding else ''
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}{suffix}"'
+
+
+def _accepted_encodings(header):
+    """Codings the ``Accept-Encoding`` header allows (q > 0); ``*`` stands for any other."""
+    accepted, refused = set(), set()
+    for part in header.split(','):
+        coding, *params = [token.strip() for token in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        (accepted if quality > 0 else refused).add(coding.lower())
+    if '*' in accepted:
+        accepted.update(name for name, _ in ENCODINGS if name not in refused)
+    return accepted
+
+
+def _etag_matches(etag, header):
+    """Weak comparison of ``etag`` against an ``If-None-Match`` list."""
+    etags = parse_etags(header)
+    return '*' in etags or etag in {tag.removeprefix('W/') for tag in etags}
+
+
+def _parse_range(header, size):
+    """Return ``(start, end)`` inclusive for a single satisfiable range, else None."""
+    match = RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _set_cache_headers(response, stat_result, encoding=None):
+    max_age = getattr(settings, 'MEDIA_CACHE_MAX_AGE', 24 * 60 * 60)
+    response['Cache-Control'] = f'public, max-age={max_age}'
+    response['ETag'] = _etag(stat_result, encoding)
+    response['Last-Modified'] = http_date(stat_result.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Media file not found')
+    if not os.path.isfile(full_path) or full_path.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+        raise Http404('Media file not found')
+
+    stat_result = os.stat(full_path)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    size = stat_result.st_size
+
+    range_header = request.headers.get('Range')
+    if range_header and request.headers.get('If-Range', _etag(stat_result)) == _etag(stat_result):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return _set_cache_headers(response, stat_result)
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_read_range(full_path, start, length), status=206, content_type=content_type)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return _set_cache_headers(response, stat_result)
+
+    accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(full_path + suffix):
+            encoding = name
+            full_path += suffix
+            break
+
+    if _etag_matches(_etag(stat_result, encoding), request.headers.get('If-None-Match', '')):
+        return _set_cache_headers(HttpResponseNotModified(), stat_result, encoding)
+
+    accel_prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '')
+    if accel_prefix:
+        response = HttpResponse(content_type=content_type)
+        relative = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + relative
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _set_cache_headers(response, stat_result, encoding)
@@ -0,0 +1,285 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries a valid ``X-Profile`` header (a signed,
+expiring token shown on the captures page, for use with curl against any
+URL) or, for a logged-in staff user, a ``_profile`` query parameter. Two
+profilers are available:
+
+- ``cprofile`` (the default) is deterministic and writes ``profile.pstats``
+  for ``python -m pstats``, snakeviz and similar tools.
+- ``sample`` (``_profile=sample`` or ``X-Profile-Mode: sample``) reads the
+  request thread's stack every ``PROFILING_SAMPLE_INTERVAL`` seconds and
+  writes ``stacks.folded`` for flamegraph.pl or speedscope. It adds far less
+  overhead to the request.
+
+Every capture also records the request's SQL timeline, and its directory
+under ``PROFILING_ROOT`` is listed at ``/admin/profiles/``. Requests that do
+not ask for profiling only pay for the header and query string lookups.
+"""
+import cProfile
+import json
+import os
+import pstats
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
+from django.db import connections
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.utils import timezone
+
+HEADER = 'X-Profile'
+MODE_HEADER = 'X-Profile-Mode'
+QUERY_PARAM = '_profile'
+TOKEN_SALT = 'ecommerce_app.profiling'
+MODES = ('cprofile', 'sample')
+ARTIFACTS = ('summary.json', 'profile.pstats', 'stacks.folded')
+TOP_FUNCTIONS = 40
+
+# One capture at a time per process; a second request asking for a profile
+# while one is running is served normally.
+_capture_lock = threading.Lock()
+
+
+def profiling_root():
+    return str(getattr(settings, 'PROFILING_ROOT', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def token_is_valid(token):
+    max_age = getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600)
+    try:
+        return signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=max_age) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def requested_mode(request):
+    """The profiler mode the request asks for and is allowed to use, else None."""
+    token = request.headers.get(HEADER)
+    if token is not None:
+        if not token_is_valid(token):
+            return None
+        mode = request.headers.get(MODE_HEADER, 'cprofile')
+    elif QUERY_PARAM in request.GET:
+        user = getattr(request, 'user', None)
+        if not (user and user.is_active and user.is_staff):
+            return None
+        mode = request.GET[QUERY_PARAM] or 'cprofile'
+    else:
+        return None
+    return mode if mode in MODES else 'cprofile'
+
+
+class SQLTimeline(list):
+    """Execute wrapper recording when each statement started and how long it took."""
+
+    def __init__(self, started):
+        super().__init__()
+        self.started = started
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.append({
+                'alias': context['connection'].alias,
+                'start_ms': round((start - self.started) * 1000, 3),
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                'sql': sql,
+                'many': many,
+            })
+
+
+def frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def top(self, limit=TOP_FUNCTIONS):
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return [{'function': name, 'samples': count} for name, count in leaves.most_common(limit)]
+
+
+def cprofile_top(profiler, limit=TOP_FUNCTIONS):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, total, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{name} ({os.path.basename(filename)}:{line})',
+            'calls': calls,
+            'total_ms': round(total * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+
+def capture(request, get_response, mode):
+    """Run ``get_response`` under the profiler and write the capture to disk."""
+    capture_id = f"{timezone.now():%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:6]}"
+    started = time.perf_counter()
+    timeline = SQLTimeline(started)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timeline))
+        if mode == 'sample':
+            interval = getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.001)
+            profiler = stack.enter_context(StackSampler(threading.get_ident(), interval))
+            response = get_response(request)
+        else:
+            profiler = cProfile.Profile()
+            response = profiler.runcall(get_response, request)
+    duration = time.perf_counter() - started
+
+    directory = os.path.join(profiling_root(), capture_id)
+    os.makedirs(directory)
+    if mode == 'sample':
+        with open(os.path.join(directory, 'stacks.folded'), 'w', encoding='utf-8') as f:
+            f.write(profiler.folded())
+        top = profiler.top()
+    else:
+        profiler.dump_stats(os.path.join(directory, 'profile.pstats'))
+        top = cprofile_top(profiler)
+    user = getattr(request, 'user', None)
+    summary = {
+        'id': capture_id,
+        'mode': mode,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'user': user.get_username() if user is not None and user.is_authenticated else None,
+        'captured_at': timezone.now().isoformat(),
+        'duration_ms': round(duration * 1000, 3),
+        'sql_count': len(timeline),
+        'sql_ms': round(sum(query['duration_ms'] for query in timeline), 3),
+        'sql': timeline,
+        'top': top,
+    }
+    with open(os.path.join(directory, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=1)
+    prune()
+    response[f'{HEADER}-Id'] = capture_id
+    return response
+
+
+def prune():
+    keep = getattr(settings, 'PROFILING_KEEP', 50)
+    for capture_id in capture_ids()[keep:]:
+        shutil.rmtree(os.path.join(profiling_root(), capture_id), ignore_errors=True)
+
+
+def capture_ids():
+    """Capture ids, newest first (ids start with their timestamp)."""
+    try:
+        names = os.listdir(profiling_root())
+    except FileNotFoundError:
+        return []
+    return sorted((name for name in names if not name.startswith('.')), reverse=True)
+
+
+def load_summary(capture_id):
+    if capture_id not in capture_ids():
+        raise Http404('No such capture.')
+    with open(os.path.join(profiling_root(), capture_id, 'summary.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ProfilingMiddleware:
+    """Profiles requests that ask for it; must come after ``AuthenticationMiddleware``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'PROFILING_ENABLED', True):
+            return self.get_response(request)
+        mode = requested_mode(request)
+        if mode is None or not _capture_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return capture(request, self.get_response, mode)
+        finally:
+            _capture_lock.release()
+
+
+@staff_member_required
+def capture_list_view(request):
+    captures = []
+    for capture_id in capture_ids():
+        try:
+            captures.append(load_summary(capture_id))
+        except (OSError, ValueError, Http404):
+            continue
+    context = {
+        'title': 'Request profiles',
+        'captures': captures,
+        'token': make_token(),
+        'header': HEADER,
+        'mode_header': MODE_HEADER,
+    }
+    return render(request, 'profiling/capture_list.html', context)
+
+
+@staff_member_required
+def capture_detail_view(request, capture_id):
+    summary = load_summary(capture_id)
+    artifacts = [name for name in ARTIFACTS if os.path.exists(os.path.join(profiling_root(), capture_id, name))]
+    context = {'title': f"Profile of {summary['method']} {summary['path']}", 'capture': summary, 'artifacts': artifacts}
+    return render(request, 'profiling/capture_detail.html', context)
+
+
+@staff_member_required
+def capture_download_view(request, capture_id, name):
+    if name not in ARTIFACTS:
+        raise Http404('No such file.')
+    load_summary(capture_id)
+    path = os.path.join(profiling_root(), capture_id, name)
+    if not os.path.exists(path):
+        raise Http404('No such file.')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{capture_id}-{name}')
@@ -3,8 +3,9 @@ Django settings for ecommerce_app project.
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,6 +39,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ecommerce_app.db.routers.ReplicaPinningMiddleware',
+    'ecommerce_app.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -64,13 +67,101 @@ TEMPLATES = [
 WSGI_APPLICATION = 'ecommerce_app.wsgi.application'
 
 # Database
+# The project's SQLite backend applies the PRAGMAs below on connect. Plain
+# atomic() blocks open with BEGIN DEFERRED so read-only transactions never take
+# the write lock; writes go through ecommerce_app.db.writes, which opens them
+# with BEGIN IMMEDIATE so concurrent writers wait instead of failing.
+SQLITE_OPTIONS = {
+    'transaction_mode': 'DEFERRED',
+    'pragmas': {
+        'journal_mode': 'WAL',
+        'busy_timeout': config('SQLITE_BUSY_TIMEOUT_MS', default=5000, cast=int),
+        'mmap_size': config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+        'synchronous': 'NORMAL',
+    },
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': 'ecommerce_app.db.sqlite3',
+        'NAME': BASE_DIR / config('DATABASE_NAME', default='db.sqlite3'),
+        'OPTIONS': SQLITE_OPTIONS,
+        # Keep one connection per worker thread instead of reconnecting per request
+        'CONN_MAX_AGE': config('CONN_MAX_AGE', default=600, cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Writes from cart and checkout queue per process; beyond this depth or wait
+# they are turned away with a "try again" message instead of an error.
+SQLITE_WRITE_QUEUE_DEPTH = config('SQLITE_WRITE_QUEUE_DEPTH', default=64, cast=int)
+SQLITE_WRITE_QUEUE_TIMEOUT = config('SQLITE_WRITE_QUEUE_TIMEOUT', default=10, cast=float)
+
+# Caches. In production the rate-limit cache defaults to files under the temp
+# directory so every worker on the host shares the same buckets.
+RATELIMIT_CACHE_BACKEND = config(
+    'RATELIMIT_CACHE_BACKEND',
+    default='django.core.cache.backends.locmem.LocMemCache' if DEBUG
+    else 'django.core.cache.backends.filebased.FileBasedCache',
+)
+# Django's file and memory caches count their entries on every set() (the file
+# cache by listing its directory) and, past MAX_ENTRIES (300 by default), drop a
+# random third of them, which would hand throttled clients fresh buckets. A
+# bucket expires once it has refilled (about a minute at the default rates), so
+# the cache holds roughly one entry per user and IP active in the last minute:
+# this bound is that many clients, and each set() lists at most this many files.
+# Reaching it clears the whole cache at once (CULL_FREQUENCY 0) rather than
+# culling at random. Beyond that, point RATELIMIT_CACHE_BACKEND at a shared
+# cache server (Redis, Memcached) instead.
+RATELIMIT_CACHE_MAX_ENTRIES = config('RATELIMIT_CACHE_MAX_ENTRIES', default=20000, cast=int)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ratelimit': {
+        'BACKEND': RATELIMIT_CACHE_BACKEND,
+        'LOCATION': config('RATELIMIT_CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'ecommerce-ratelimit')),
+        'OPTIONS': {'MAX_ENTRIES': RATELIMIT_CACHE_MAX_ENTRIES, 'CULL_FREQUENCY': 0} if RATELIMIT_CACHE_BACKEND in (
+            'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.filebased.FileBasedCache',
+        ) else {},
+    },
+}
+
+# Token buckets per user and per client IP for cart and checkout writes ('count/s|m|h')
+RATELIMIT_ENABLED = config('RATELIMIT_ENABLED', default=True, cast=bool)
+RATELIMIT_CACHE_ALIAS = 'ratelimit'
+RATE_LIMITS = {
+    'cart': {'user': config('RATELIMIT_CART_USER', default='60/m'), 'ip': config('RATELIMIT_CART_IP', default='120/m')},
+    'checkout': {'user': config('RATELIMIT_CHECKOUT_USER', default='5/m'), 'ip': config('RATELIMIT_CHECKOUT_IP', default='20/m')},
+}
+
+# Checkouts run at most this many at a time in each worker process (so the
+# host-wide cap is this times the number of workers); a bounded number wait up
+# to the timeout for a slot and the rest get a 503 straight away. Writes across
+# workers are bounded by SQLite's single write lock and its busy timeout.
+CHECKOUT_CONCURRENCY_PER_WORKER = config('CHECKOUT_CONCURRENCY_PER_WORKER', default=4, cast=int)
+CHECKOUT_QUEUE_DEPTH_PER_WORKER = config('CHECKOUT_QUEUE_DEPTH_PER_WORKER', default=32, cast=int)
+CHECKOUT_QUEUE_TIMEOUT = config('CHECKOUT_QUEUE_TIMEOUT', default=5, cast=float)
+
+# Read replicas for catalog queries, e.g. DATABASE_REPLICAS=replica1.sqlite3,replica2.sqlite3
+# (refresh local SQLite copies with `manage.py sync_replicas`)
+DATABASE_REPLICA_ALIASES = []
+for index, replica_name in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv()), start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'ecommerce_app.db.sqlite3',
+        'NAME': BASE_DIR / replica_name,
+        'OPTIONS': SQLITE_OPTIONS,
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICA_ALIASES.append(alias)
+
+DATABASE_ROUTERS = ['ecommerce_app.db.routers.PrimaryReplicaRouter']
+
+# Seconds a client keeps reading from the primary after it writes
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -97,12 +188,40 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [
-    BASE_DIR / 'static',
+    BASE_DIR / 'staticc',
 ]
 
+# `manage.py build_assets` fingerprints and gzip/brotli-compresses static files;
+# WhiteNoise then serves the hashed names with far-future immutable headers.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# A deleted upload's name can be reused, so media is cached for a bounded time
+# and then revalidated by ETag rather than marked immutable
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=24 * 60 * 60, cast=int)
+# e.g. '/protected-media/' to hand media bodies to nginx via X-Accel-Redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = config('MEDIA_ACCEL_REDIRECT_PREFIX', default='')
+# Product image placeholders (dominant colour + tiny data URI), built after upload
+PLACEHOLDER_SIZE = 20
+PLACEHOLDER_BACKGROUND = config('PLACEHOLDER_BACKGROUND', default=True, cast=bool)
+
+# Public origin for absolute URLs in sitemaps, e.g. 'https://shop.example.com'
+SITE_URL = config('SITE_URL', default='http://localhost:8000')
+# Written by `manage.py build_sitemaps` (run it from cron) and served at /sitemap.xml
+SITEMAP_ROOT = config('SITEMAP_ROOT', default=str(BASE_DIR / 'sitemaps'))
+SITEMAP_CHUNK_SIZE = config('SITEMAP_CHUNK_SIZE', default=50000, cast=int)
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -111,6 +230,60 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "tailwind"
 CRISPY_TEMPLATE_PACK = "tailwind"
 
+# Order numbers are reserved from the database in blocks of this size per worker
+ORDER_NUMBER_BLOCK_SIZE = config('ORDER_NUMBER_BLOCK_SIZE', default=20, cast=int)
+
+# Answer product listing filters and sorting from an in-process NumPy index
+# (requires numpy); the database then only loads the products on the page.
+CATALOG_INDEX_ENABLED = config('CATALOG_INDEX_ENABLED', default=False, cast=bool)
+CATALOG_INDEX_REFRESH_INTERVAL = config('CATALOG_INDEX_REFRESH_INTERVAL', default=5, cast=float)
+
+# Search-box autocomplete: in-process prefix index over product and category names.
+# Other workers' edits are picked up every REFRESH seconds; popularity every REBUILD seconds.
+AUTOCOMPLETE_REFRESH_INTERVAL = config('AUTOCOMPLETE_REFRESH_INTERVAL', default=30, cast=float)
+AUTOCOMPLETE_REBUILD_INTERVAL = config('AUTOCOMPLETE_REBUILD_INTERVAL', default=3600, cast=float)
+
+# Seconds between each worker's checks for promotions changed by other workers
+PROMOTION_REFRESH_INTERVAL = config('PROMOTION_REFRESH_INTERVAL', default=5, cast=float)
+
+# Seconds the bulk stock endpoint (/stock/) caches each product's stock level
+STOCK_CACHE_TTL = config('STOCK_CACHE_TTL', default=2, cast=int)
+
+# Products per query (and per streamed chunk) in the /api/products/ read API
+API_CHUNK_SIZE = config('API_CHUNK_SIZE', default=500, cast=int)
+
+# On-demand request profiling: staff add ?_profile=1 (or =sample), anyone with a token
+# from /admin/profiles/ sends the X-Profile header. Captures are kept in PROFILING_ROOT.
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=True, cast=bool)
+PROFILING_ROOT = config('PROFILING_ROOT', default=str(BASE_DIR / 'profiles'))
+PROFILING_KEEP = config('PROFILING_KEEP', default=50, cast=int)
+PROFILING_TOKEN_MAX_AGE = config('PROFILING_TOKEN_MAX_AGE', default=3600, cast=int)
+PROFILING_SAMPLE_INTERVAL = config('PROFILING_SAMPLE_INTERVAL', default=0.001, cast=float)
+
+# Pre-compile templates and prime URL/model caches when a worker boots
+# (see `manage.py warmup --import-report` for boot-time tracking)
+WARMUP_ON_STARTUP = config('WARMUP_ON_STARTUP', default=not DEBUG, cast=bool)
+
+# Background tasks (run with `manage.py run_tasks`)
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BASE_DELAY = 10  # seconds, doubled per attempt
+TASK_RETRY_MAX_DELAY = 60 * 60
+TASK_LEASE_SECONDS = 300  # a claimed task is retried if its worker goes quiet this long
+TASK_RETENTION_DAYS = 7
+LOW_STOCK_THRESHOLD = config('LOW_STOCK_THRESHOLD', default=5, cast=int)
+
+# Delivered/cancelled orders older than this move to the archive tables
+# (`manage.py archive_orders`, e.g. nightly)
+ORDER_ARCHIVE_AFTER_DAYS = config('ORDER_ARCHIVE_AFTER_DAYS', default=365, cast=int)
+
+# Carts untouched for this long, and expired sessions, are deleted by
+# `manage.py purge_stale_data` (batched, safe to run at any hour)
+CART_ABANDONED_AFTER_DAYS = config('CART_ABANDONED_AFTER_DAYS', default=30, cast=int)
+
+# Email
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='orders@example.com')
+
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 1 day
 SESSION_SAVE_EVERY_REQUEST = True
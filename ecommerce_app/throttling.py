@@ -0,0 +1,185 @@
+"""
+Admission control for the cart and checkout endpoints.
+
+``rate_limit(scope)`` gives every user and every client IP a token bucket per
+scope (rates in ``RATE_LIMITS``), kept in the ``RATELIMIT_CACHE_ALIAS`` cache
+so all workers on the host share it; over-limit requests get a 429 JSON
+response with ``Retry-After``. ``limit_concurrency`` caps how many checkouts
+each worker process runs at once (``CHECKOUT_CONCURRENCY_PER_WORKER``; it is
+not a host-wide cap): up to ``CHECKOUT_QUEUE_DEPTH_PER_WORKER`` more wait for
+a slot for at most ``CHECKOUT_QUEUE_TIMEOUT`` seconds, the rest are shed
+immediately with a 503. Together they keep bursts from pushing the database
+into lock contention instead of letting it degrade for everyone.
+
+Only JSON and XHR clients get those status codes. A rejected form post gets
+an error message and a redirect, like the views' own busy handling: back to
+``redirect_to`` if given, else to the same URL.
+"""
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.shortcuts import redirect
+
+RATE_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60}
+RATE_LIMITED_MESSAGE = 'Too many requests. Please wait a moment and try again.'
+OVERLOADED_MESSAGE = 'Checkout is very busy right now. Please try again in a moment.'
+
+
+def parse_rate(rate):
+    """``'30/m'`` -> ``(30, 60)``: a bucket of 30 tokens refilled over 60 seconds."""
+    count, _, unit = rate.partition('/')
+    return int(count), RATE_UNITS[unit]
+
+
+class TokenBucket:
+    def __init__(self, capacity, period, cache_alias='default'):
+        self.capacity = capacity
+        self.refill_per_second = capacity / period
+        self.cache_alias = cache_alias
+        # Shared caches have no compare-and-set, so the read-modify-write is
+        # only atomic within a process; across workers a burst can slip a
+        # few extra requests through, which is fine for shedding load.
+        self._lock = threading.Lock()
+
+    def consume(self, key, now=None):
+        """Take a token; returns ``(allowed, seconds until one is available)``."""
+        cache = caches[self.cache_alias]
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = cache.get(key) or (self.capacity, now)
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # Expire once the bucket would be full again anyway.
+            timeout = math.ceil((self.capacity - tokens) / self.refill_per_second) + 1
+            cache.set(key, (tokens, now), timeout)
+        return allowed, 0 if allowed else (1 - tokens) / self.refill_per_second
+
+
+_buckets = {}
+
+
+def get_bucket(scope, kind):
+    rate = settings.RATE_LIMITS.get(scope, {}).get(kind)
+    if not rate:
+        return None
+    alias = getattr(settings, 'RATELIMIT_CACHE_ALIAS', 'default')
+    bucket = _buckets.get((scope, kind, rate, alias))
+    if bucket is None:
+        bucket = _buckets[scope, kind, rate, alias] = TokenBucket(*parse_rate(rate), cache_alias=alias)
+    return bucket
+
+
+def client_ip(request):
+    # Behind a reverse proxy REMOTE_ADDR must be set from the proxy's
+    # forwarded header before it reaches Django.
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def check_rate(request, scope):
+    """Return the seconds to wait if any of ``scope``'s buckets is empty, else 0."""
+    identities = [('ip', client_ip(request))]
+    if request.user.is_authenticated:
+        identities.append(('user', request.user.pk))
+    retry_after = 0
+    for kind, identity in identities:
+        bucket = get_bucket(scope, kind)
+        if bucket is None:
+            continue
+        allowed, wait = bucket.consume(f'ratelimit:{scope}:{kind}:{identity}')
+        if not allowed:
+            retry_after = max(retry_after, wait)
+    return retry_after
+
+
+def wants_json(request):
+    return (
+        request.content_type == 'application/json'
+        or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        or 'application/json' in request.headers.get('Accept', '')
+    )
+
+
+def rejection(request, status, message, retry_after, redirect_to=None):
+    if not wants_json(request):
+        messages.error(request, message)
+        return redirect(redirect_to or request.path)
+    retry_after = max(1, math.ceil(retry_after))
+    response = JsonResponse({'success': False, 'message': message, 'retry_after': retry_after}, status=status)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limit(scope, methods=('POST',), redirect_to=None):
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            if request.method in methods and getattr(settings, 'RATELIMIT_ENABLED', True):
+                retry_after = check_rate(request, scope)
+                if retry_after:
+                    return rejection(request, 429, RATE_LIMITED_MESSAGE, retry_after, redirect_to)
+            return view_func(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+class ConcurrencyLimiter:
+    """At most ``limit`` holders; at most ``max_waiting`` more may queue for a slot."""
+
+    def __init__(self, limit, max_waiting):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+
+    def acquire(self, timeout):
+        with self._condition:
+            if self._active < self.limit:
+                self._active += 1
+                return True
+            if self._waiting >= self.max_waiting:
+                return False
+            self._waiting += 1
+            try:
+                if not self._condition.wait_for(lambda: self._active < self.limit, timeout):
+                    return False
+                self._active += 1
+                return True
+            finally:
+                self._waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+
+checkout_limiter = ConcurrencyLimiter(
+    limit=getattr(settings, 'CHECKOUT_CONCURRENCY_PER_WORKER', 4),
+    max_waiting=getattr(settings, 'CHECKOUT_QUEUE_DEPTH_PER_WORKER', 32),
+)
+
+
+def limit_concurrency(limiter, methods=('POST',), redirect_to=None):
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in methods:
+                return view_func(request, *args, **kwargs)
+            timeout = getattr(settings, 'CHECKOUT_QUEUE_TIMEOUT', 5)
+            if not limiter.acquire(timeout):
+                return rejection(request, 503, OVERLOADED_MESSAGE, timeout, redirect_to)
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                limiter.release()
+        return wrapped
+    return decorator
@@ -1,12 +1,19 @@
 """
 URL configuration for ecommerce_app project.
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from . import profiling
+from .media import serve_media
 
 urlpatterns = [
+    path('admin/profiles/', profiling.capture_list_view, name='profiling_captures'),
+    path('admin/profiles/<str:capture_id>/', profiling.capture_detail_view, name='profiling_capture'),
+    path('admin/profiles/<str:capture_id>/<str:name>', profiling.capture_download_view, name='profiling_download'),
     path('admin/', admin.site.urls),
     path('', include('store.urls')),
     path('accounts/', include('accounts.urls')),
@@ -16,3 +23,8 @@ urlpatterns = [
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+else:
+    # Static files are served by WhiteNoise; media gets cacheable, range-aware responses
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+    ]
@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_app.settings')
 
 application = get_wsgi_application()
+
+if settings.WARMUP_ON_STARTUP:
+    # No database connection here: a preloading server (gunicorn --preload)
+    # imports this module before forking, and SQLite connections must not
+    # be shared across processes. Each worker connects on its first request.
+    from store.warmup import warm_up
+
+    warm_up(connect=False)
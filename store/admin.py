@@ -1,15 +1,24 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.html import format_html
-from .models import Category, Product, ProductImage, Order, OrderItem, Cart, CartItem
+from django.utils import timezone
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, CatalogChange, Category, Product, ProductImage, Order, OrderItem, Cart, CartItem,
+    Promotion, Task,
+)
+from .fulfillment import transition_orders
+from .order_numbers import generate_order_number
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'is_active', 'product_count', 'created_at']
-    list_filter = ['is_active', 'created_at']
+    list_display = ['name', 'parent', 'slug', 'is_active', 'product_count', 'created_at']
+    list_filter = ['is_active', 'depth', 'created_at']
+    list_select_related = ['parent']
+    # Path order lists each category right after its parent.
+    ordering = ['path']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['path', 'depth', 'created_at', 'updated_at']
 
     def product_count(self, obj):
         return obj.products.count()
@@ -49,18 +58,64 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'user', 'status', 'total_amount', 'is_paid', 'created_at']
     list_filter = ['status', 'is_paid', 'created_at']
-    search_fields = ['order_number', 'user__username', 'user__email', 'email']
-    readonly_fields = ['order_number', 'created_at', 'updated_at']
+    search_fields = ['order_number', 'user__username', 'user__email', 'email', 'coupon_code']
+    readonly_fields = ['order_number', 'discount_amount', 'coupon_code', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
-    list_editable = ['status', 'is_paid']
+    # Status changes go through the bulk actions below, which check
+    # ALLOWED_TRANSITIONS and update whole selections in one statement.
+    list_editable = ['is_paid']
+    actions = ['mark_processing', 'mark_shipped', 'mark_delivered', 'mark_cancelled']
 
     def save_model(self, request, obj, form, change):
         if not obj.order_number:
-            # Generate order number if not exists
-            import uuid
-            obj.order_number = f"ORD-{uuid.uuid4().hex[:8].upper()}"
+            obj.order_number = generate_order_number()
         super().save_model(request, obj, form, change)
 
+    def transition(self, request, queryset, target):
+        result = transition_orders(queryset.values_list('pk', flat=True), target)
+        message = f'{result.updated} order(s) marked as {target}.'
+        if result.skipped:
+            details = ', '.join(f'{count} {status}' for status, count in sorted(result.skipped.items()))
+            message += f' Skipped {result.skipped_count} that cannot move to {target} ({details}).'
+        self.message_user(request, message, messages.SUCCESS if not result.skipped else messages.WARNING)
+
+    def mark_processing(self, request, queryset):
+        self.transition(request, queryset, 'processing')
+    mark_processing.short_description = 'Mark selected orders as processing'
+
+    def mark_shipped(self, request, queryset):
+        self.transition(request, queryset, 'shipped')
+    mark_shipped.short_description = 'Mark selected orders as shipped'
+
+    def mark_delivered(self, request, queryset):
+        self.transition(request, queryset, 'delivered')
+    mark_delivered.short_description = 'Mark selected orders as delivered'
+
+    def mark_cancelled(self, request, queryset):
+        self.transition(request, queryset, 'cancelled')
+    mark_cancelled.short_description = 'Cancel selected orders'
+
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+    can_delete = False
+    readonly_fields = ['product', 'quantity', 'price', 'total_price']
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['order_number', 'user', 'status', 'total_amount', 'created_at', 'archived_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['order_number', 'user__username', 'user__email', 'email']
+    inlines = [ArchivedOrderItemInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
@@ -70,12 +125,22 @@ class CartItemInline(admin.TabularInline):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['user', 'total_items', 'total_price', 'created_at']
+    list_display = ['user', 'total_items', 'total_price', 'coupon_code', 'created_at']
     search_fields = ['user__username', 'user__email']
     readonly_fields = ['created_at', 'updated_at', 'total_items', 'total_price']
     inlines = [CartItemInline]
 
 
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'kind', 'value', 'code', 'starts_at', 'ends_at', 'is_active']
+    list_filter = ['kind', 'is_active', 'starts_at', 'ends_at']
+    search_fields = ['name', 'code']
+    # Products and categories empty means the promotion covers the whole cart.
+    filter_horizontal = ['products', 'categories']
+    readonly_fields = ['created_at', 'updated_at']
+
+
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
     list_display = ['product', 'alt_text', 'is_primary', 'image_preview', 'created_at']
@@ -90,6 +155,37 @@ class ProductImageAdmin(admin.ModelAdmin):
     image_preview.short_description = 'Preview'
 
 
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'max_attempts', 'run_at', 'updated_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['name', 'args', 'kwargs', 'attempts', 'locked_by', 'locked_until', 'last_error', 'created_at', 'updated_at']
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status='running').update(
+            status='pending', run_at=timezone.now(), attempts=0, locked_until=None, updated_at=timezone.now(),
+        )
+        self.message_user(request, f'{updated} task(s) queued to run again.')
+    retry_now.short_description = 'Retry selected tasks now'
+
+
+@admin.register(CatalogChange)
+class CatalogChangeAdmin(admin.ModelAdmin):
+    list_display = ['id', 'model', 'object_id', 'action', 'created_at']
+    list_filter = ['model', 'action']
+    search_fields = ['=object_id']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # Customize admin site header
 admin.site.site_header = "E-commerce Admin"
 admin.site.site_title = "E-commerce Admin Portal"
@@ -0,0 +1,209 @@
+"""
+Read-only JSON product API for the mobile app and partner integrations.
+
+``GET /api/products/`` selects products either by ``ids``/``slugs`` (at most
+``MAX_LOOKUP``) or with the storefront listing's filters (``search``,
+``category``, ``min_price``, ``max_price``, ``sort`` plus ``offset``/``limit``)
+and returns only the requested ``fields``. Rows are read with ``.values()``
+over just the columns those fields need and streamed out in chunks of
+``API_CHUNK_SIZE``; each chunk costs one query for its categories (only
+those not already sent) and one for its gallery images when asked for,
+however many products it holds. orjson encodes the output when installed.
+"""
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+from .changes import MAX_PAGE, as_dict, changes_after
+from .listing import filter_products
+from .models import CatalogChange, Category, Product, ProductImage
+from .stock import MAX_LOOKUP, parse_ids
+
+# orjson is imported on first use and is optional; json is the fallback.
+orjson = None
+
+# Product columns each public field needs.
+FIELDS = {
+    'id': ('id',),
+    'name': ('name',),
+    'slug': ('slug',),
+    'url': ('slug',),
+    'description': ('description',),
+    'price': ('price',),
+    'stock': ('stock',),
+    'is_in_stock': ('stock',),
+    'is_featured': ('is_featured',),
+    'image': ('image',),
+    'placeholder_color': ('placeholder_color',),
+    'category': ('category_id',),
+    'images': (),
+    'created_at': ('created_at',),
+    'updated_at': ('updated_at',),
+}
+DEFAULT_FIELDS = ('id', 'name', 'slug', 'url', 'price', 'is_in_stock', 'image', 'category')
+
+
+class BadRequest(Exception):
+    pass
+
+
+def dumps(value):
+    global orjson
+    if orjson is None:
+        try:
+            import orjson as module
+        except ImportError:
+            module = False
+        orjson = module
+    if orjson:
+        return orjson.dumps(value)
+    return json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def media_url(name):
+    return default_storage.url(name) if name else None
+
+
+def parse_list(params, name):
+    return list(dict.fromkeys(v.strip() for param in params.getlist(name) for v in param.split(',') if v.strip()))
+
+
+def parse_fields(params):
+    fields = parse_list(params, 'fields') or list(DEFAULT_FIELDS)
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise BadRequest(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def select_products(params):
+    """The queryset to stream and, for id/slug lookups, the requested ``(ids, slugs)``."""
+    ids, slugs = parse_list(params, 'ids'), parse_list(params, 'slugs')
+    if ids or slugs:
+        ids = parse_ids(ids)
+        if ids is None:
+            raise BadRequest('ids must be integers')
+        if len(ids) + len(slugs) > MAX_LOOKUP:
+            raise BadRequest(f'At most {MAX_LOOKUP} products per request')
+        products = Product.objects.filter(Q(pk__in=ids) | Q(slug__in=slugs), is_active=True)
+        # At most MAX_LOOKUP rows in no particular order, so skip the sort.
+        return products.order_by(), (ids, slugs)
+
+    try:
+        offset = int(params.get('offset', 0))
+        limit = int(params['limit']) if params.get('limit') else None
+    except ValueError:
+        raise BadRequest('offset and limit must be integers')
+    if offset < 0 or (limit is not None and limit < 0):
+        raise BadRequest('offset and limit must not be negative')
+    try:
+        products = filter_products(params)
+    except ValidationError:
+        raise BadRequest('min_price and max_price must be numbers')
+    return products[offset:offset + limit if limit is not None else None], None
+
+
+def serialize(row, fields, categories, images):
+    item = {}
+    for name in fields:
+        if name == 'price':
+            item[name] = str(row['price'])
+        elif name == 'is_in_stock':
+            item[name] = row['stock'] > 0
+        elif name == 'url':
+            item[name] = reverse('store:product_detail', kwargs={'slug': row['slug']})
+        elif name == 'image':
+            item[name] = media_url(row['image'])
+        elif name == 'category':
+            item[name] = categories.get(row['category_id'])
+        elif name == 'images':
+            item[name] = images.get(row['id'], [])
+        else:
+            item[name] = row[name]
+    return item
+
+
+def stream_products(queryset, fields, requested=None):
+    columns = {'id'} | {column for name in fields for column in FIELDS[name]}
+    if requested is not None:
+        columns.add('slug')
+    chunk_size = getattr(settings, 'API_CHUNK_SIZE', 500)
+    rows = queryset.values(*columns).iterator(chunk_size=chunk_size)
+    categories = {}
+    seen_ids, seen_slugs = set(), set()
+
+    yield b'{"products":['
+    first = True
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        if 'category' in fields:
+            new = {row['category_id'] for row in chunk} - categories.keys()
+            if new:
+                for category in Category.objects.filter(pk__in=new).order_by().values('id', 'name', 'slug'):
+                    categories[category['id']] = category
+        images = {}
+        if 'images' in fields:
+            gallery = ProductImage.objects.filter(product_id__in=[row['id'] for row in chunk])
+            # Matches the (product, -is_primary, created_at) index, so no sort.
+            gallery = gallery.order_by('product_id', '-is_primary', 'created_at')
+            for image in gallery.values('product_id', 'image', 'alt_text', 'is_primary'):
+                images.setdefault(image['product_id'], []).append({
+                    'url': media_url(image['image']), 'alt_text': image['alt_text'], 'is_primary': image['is_primary'],
+                })
+        if requested is not None:
+            seen_ids.update(row['id'] for row in chunk)
+            seen_slugs.update(row['slug'] for row in chunk)
+        # Encode the chunk as one array and splice its contents in.
+        encoded = dumps([serialize(row, fields, categories, images) for row in chunk])[1:-1]
+        yield encoded if first else b',' + encoded
+        first = False
+    yield b']'
+    if requested is not None:
+        ids, slugs = requested
+        missing = [str(pk) for pk in ids if pk not in seen_ids] + [slug for slug in slugs if slug not in seen_slugs]
+        yield b',"missing":' + dumps(missing)
+    yield b'}'
+
+
+@require_GET
+def products_api_view(request):
+    try:
+        fields = parse_fields(request.GET)
+        queryset, requested = select_products(request.GET)
+    except BadRequest as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return StreamingHttpResponse(stream_products(queryset, fields, requested), content_type='application/json')
+
+
+@require_GET
+def changes_api_view(request):
+    """Catalog changes after the ``after`` cursor, oldest first; pass back ``next`` to continue."""
+    try:
+        cursor = int(request.GET.get('after', 0))
+        limit = min(int(request.GET.get('limit', 100)), MAX_PAGE)
+    except ValueError:
+        return JsonResponse({'error': 'after and limit must be integers'}, status=400)
+    models = parse_list(request.GET, 'model')
+    unknown = set(models) - {name for name, _ in CatalogChange.MODEL_CHOICES}
+    if unknown or limit < 1:
+        return JsonResponse({'error': 'Unknown model or bad limit'}, status=400)
+
+    changes = changes_after(cursor, limit + 1, models)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    payload = {
+        'changes': [as_dict(change) for change in changes],
+        'next': changes[-1].pk if changes else cursor,
+        'has_more': has_more,
+    }
+    return HttpResponse(dumps(payload), content_type='application/json')
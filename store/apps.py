@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        # Connect the signal receivers that keep in-process caches and the
+        # catalog change log current.
+        from . import autocomplete, catalog_index, changes, placeholders, pricing, promotions, stock  # noqa: F401
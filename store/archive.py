@@ -0,0 +1,68 @@
+"""
+Hot/cold order storage.
+
+Finished orders older than ``ORDER_ARCHIVE_AFTER_DAYS`` are moved, with their
+items, into ``ArchivedOrder``/``ArchivedOrderItem`` by ``archive_orders``, one
+batch per transaction, keeping their ids, order numbers and timestamps. The
+live ``Order`` tables (and their indexes) then only hold recent and
+in-progress orders. Customer-facing lookups go through the helpers below,
+which check the live table first and fall back to the archive.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.http import Http404
+from django.utils import timezone
+
+from ecommerce_app.db.writes import write_transaction
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderBase, OrderItem, OrderItemBase
+
+# Orders still moving through fulfillment are never archived.
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+ORDER_FIELDS = ['id', 'user_id', 'created_at', 'updated_at'] + [
+    f.attname for f in OrderBase._meta.get_fields() if f.concrete
+]
+ITEM_FIELDS = ['id', 'order_id', 'product_id'] + [f.attname for f in OrderItemBase._meta.get_fields() if f.concrete]
+
+
+def archive_cutoff():
+    return timezone.now() - timedelta(days=getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 365))
+
+
+def archive_batch(cutoff, batch_size=500):
+    """Move up to ``batch_size`` archivable orders; returns ``(orders, items)`` moved."""
+    with write_transaction():
+        order_ids = list(
+            Order.objects.filter(created_at__lt=cutoff, status__in=ARCHIVABLE_STATUSES)
+            .order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0, 0
+        orders = Order.objects.filter(pk__in=order_ids).values(*ORDER_FIELDS)
+        items = OrderItem.objects.filter(order_id__in=order_ids).values(*ITEM_FIELDS)
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**row) for row in orders])
+        archived_items = ArchivedOrderItem.objects.bulk_create([ArchivedOrderItem(**row) for row in items])
+        # OrderItem has no signals, so the cascade is a single DELETE as well.
+        Order.objects.filter(pk__in=order_ids).delete()
+    return len(order_ids), len(archived_items)
+
+
+def get_order_for_user(user, order_number):
+    """The live or archived order with ``order_number`` belonging to ``user``, else 404."""
+    order = Order.objects.filter(order_number=order_number, user=user).first()
+    if order is None:
+        order = ArchivedOrder.objects.filter(order_number=order_number, user=user).first()
+    if order is None:
+        raise Http404('No order matches the given query.')
+    return order
+
+
+def orders_for_user(user, limit=None):
+    """The user's live and archived orders, newest first."""
+    orders = []
+    for model in (Order, ArchivedOrder):
+        queryset = model.objects.filter(user=user).order_by('-created_at').prefetch_related('items__product__category')
+        orders += list(queryset[:limit] if limit else queryset)
+    orders.sort(key=lambda order: order.created_at, reverse=True)
+    return orders[:limit] if limit else orders
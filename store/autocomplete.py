@@ -0,0 +1,324 @@
+"""
+In-process prefix autocomplete over product and category names.
+
+Names are normalised (case-folded, whitespace collapsed) and stored as a
+sorted array of keys, one per word start (so "phone" finds "Smart Phone"),
+with a parallel array of popularity scores. A prefix maps to a contiguous
+slice found with two binary searches; small slices are ranked on the fly
+and the top results of large slices (short prefixes) are precomputed at
+build time and memoised afterwards, so a lookup never scans more than
+``RANK_SCAN_LIMIT`` entries.
+
+Product and category saves/deletes in this process update the arrays in
+place, and only when the name, slug or active flag actually changed (a sale
+or a price change touches ``updated_at`` but not the index). Precomputed top
+results are patched rather than dropped, so short prefixes never fall back
+to ranking their whole slice. Changes made by other workers are picked up
+from an ``(updated_at, id)`` watermark every
+``AUTOCOMPLETE_REFRESH_INTERVAL`` seconds, and the whole
+index (including popularity, the number of units sold) is rebuilt every
+``AUTOCOMPLETE_REBUILD_INTERVAL`` seconds. Rebuilds read the whole catalog,
+so they run in a background thread: requests keep answering from the
+current arrays (no results before the first build) until the new ones are
+swapped in.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 20
+RANK_SCAN_LIMIT = 256
+MAX_WORDS = 4
+TOP_SIZE = MAX_RESULTS * MAX_WORDS
+SEPARATOR = '\x00'
+PREFIX_END = '\U0010ffff'
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+def entry_keys(kind, pk, label):
+    """One sort key per word start; the suffix keeps keys unique and sorts after the name."""
+    words = normalize(label).split(' ')
+    return [
+        f"{' '.join(words[start:])}{SEPARATOR}{kind}{pk}"
+        for start in range(min(len(words), MAX_WORDS))
+        if words[start]
+    ]
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._keys = []
+        self._scores = []
+        self._entries = {}
+        self._top = {}
+        self._built = False
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        self._watermarks = {}
+
+    @property
+    def is_built(self):
+        return self._built
+
+    def build(self, entries):
+        """Replace the index with ``(kind, pk, label, slug, score)`` tuples."""
+        key_scores = {}
+        by_item = {}
+        for kind, pk, label, slug, score in entries:
+            by_item[kind, pk] = (label, slug, score)
+            for key in entry_keys(kind, pk, label):
+                key_scores[key] = score
+        keys = sorted(key_scores)
+        scores = [key_scores[key] for key in keys]
+        top = _precompute_top(keys, scores)
+        with self._lock:
+            self._keys, self._scores, self._entries, self._top = keys, scores, by_item, top
+            self._built = True
+
+    def search(self, prefix, limit=8):
+        prefix = normalize(prefix)
+        limit = max(1, min(limit, MAX_RESULTS))
+        if not prefix:
+            return []
+        with self._lock:
+            keys, scores = self._keys, self._scores
+            lo = bisect_left(keys, prefix)
+            hi = bisect_left(keys, prefix + PREFIX_END, lo)
+            top = self._top.get(prefix)
+            if top is None and hi - lo > RANK_SCAN_LIMIT:
+                # Only reached after an in-place update invalidated the entry.
+                top = self._top[prefix] = [keys[i] for i in _rank(scores, lo, hi, TOP_SIZE)]
+            elif top is None:
+                # Every item has at most MAX_WORDS keys, so this many keys
+                # always hold ``limit`` distinct items.
+                top = [keys[i] for i in _rank(scores, lo, hi, limit * MAX_WORDS)]
+            entries = self._entries
+
+            results = []
+            seen = set()
+            for key in top:
+                item = _parse_item(key)
+                if item in seen or item not in entries:
+                    continue
+                seen.add(item)
+                label, slug, score = entries[item]
+                results.append({'type': item[0], 'id': item[1], 'name': label, 'slug': slug})
+                if len(results) == limit:
+                    break
+        return results
+
+    def upsert(self, kind, pk, label, slug, score=None):
+        with self._lock:
+            previous = self._entries.get((kind, pk))
+            if score is None:
+                score = previous[2] if previous else 0
+            if previous == (label, slug, score):
+                # Inserting into the key arrays is O(n); skip no-op saves.
+                return
+            if previous:
+                self._remove_keys(kind, pk, previous[0])
+            self._entries[kind, pk] = (label, slug, score)
+            for key in entry_keys(kind, pk, label):
+                position = bisect_left(self._keys, key)
+                self._keys.insert(position, key)
+                self._scores.insert(position, score)
+                self._add_to_top(key, score)
+
+    def remove(self, kind, pk):
+        with self._lock:
+            previous = self._entries.pop((kind, pk), None)
+            if previous:
+                self._remove_keys(kind, pk, previous[0])
+
+    def _remove_keys(self, kind, pk, label):
+        for key in entry_keys(kind, pk, label):
+            position = bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                del self._keys[position]
+                del self._scores[position]
+            self._remove_from_top(key)
+
+    # A stored top list is always the true top of its prefix's slice, only
+    # possibly shorter than TOP_SIZE: dropping a key keeps that true, and a
+    # key is only inserted where it outranks a listed one.
+    def _remove_from_top(self, key):
+        for prefix in _prefixes(key):
+            top = self._top.get(prefix)
+            if top is not None and key in top:
+                top.remove(key)
+                if len(top) < TOP_SIZE // 2:
+                    # Too few left to fill a page of distinct items; the next
+                    # search ranks the slice again.
+                    del self._top[prefix]
+
+    def _add_to_top(self, key, score):
+        for prefix in _prefixes(key):
+            top = self._top.get(prefix)
+            if top is None:
+                continue
+            for position, other in enumerate(top):
+                other_score = self._entries[_parse_item(other)][2]
+                if score > other_score or (score == other_score and key < other):
+                    top.insert(position, key)
+                    del top[TOP_SIZE:]
+                    break
+
+    def ensure_current(self):
+        # Requests never wait: they answer from the current arrays while one
+        # thread refreshes them or a background thread rebuilds them.
+        rebuild, refresh = self._is_due()
+        if not (rebuild or refresh) or not self._refresh_lock.acquire(blocking=False):
+            return
+        # Another thread may have done the work before this one got the lock.
+        rebuild, refresh = self._is_due()
+        if rebuild:
+            # The background thread releases the lock when it is done.
+            threading.Thread(target=self._rebuild_in_background, name='autocomplete-rebuild', daemon=True).start()
+            return
+        try:
+            if refresh:
+                self.refresh_from_database()
+        finally:
+            self._refresh_lock.release()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild_from_database()
+        except Exception:
+            logger.exception('Rebuilding the autocomplete index failed')
+        finally:
+            connection.close()
+            self._refresh_lock.release()
+
+    def _is_due(self):
+        now = time.monotonic()
+        rebuild_interval = getattr(settings, 'AUTOCOMPLETE_REBUILD_INTERVAL', 3600)
+        refresh_interval = getattr(settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', 30)
+        rebuild = not self._built or now - self._built_at >= rebuild_interval
+        return rebuild, not rebuild and now - self._refreshed_at >= refresh_interval
+
+    def rebuild_from_database(self):
+        popularity = dict(
+            OrderItem.objects.values('product_id').annotate(sold=Sum('quantity')).values_list('product_id', 'sold')
+        )
+        category_popularity = {}
+        entries = []
+        watermarks = {}
+        for model, kind in ((Product, 'product'), (Category, 'category')):
+            watermarks[kind] = model.objects.order_by('-updated_at', '-pk').values_list('updated_at', 'pk').first()
+        for pk, name, slug, category_id in Product.objects.filter(is_active=True).values_list(
+            'pk', 'name', 'slug', 'category_id'
+        ).iterator(chunk_size=10000):
+            score = popularity.get(pk, 0)
+            category_popularity[category_id] = category_popularity.get(category_id, 0) + score
+            entries.append(('product', pk, name, slug, score))
+        for pk, name, slug in Category.objects.filter(is_active=True).values_list('pk', 'name', 'slug'):
+            entries.append(('category', pk, name, slug, category_popularity.get(pk, 0)))
+        self.build(entries)
+        self._watermarks = watermarks
+        self._built_at = self._refreshed_at = time.monotonic()
+
+    def refresh_from_database(self):
+        """Apply product/category rows changed since the last look (e.g. by other workers)."""
+        self._refreshed_at = time.monotonic()
+        for model, kind in ((Product, 'product'), (Category, 'category')):
+            rows = model.objects.order_by('updated_at', 'pk')
+            watermark = self._watermarks.get(kind)
+            if watermark is not None:
+                # The id breaks ties between rows written in the same clock tick.
+                updated_at, pk = watermark
+                rows = rows.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, pk__gt=pk))
+            for obj in rows.only('pk', 'name', 'slug', 'is_active', 'updated_at'):
+                index_instance(obj)
+                self._watermarks[kind] = (obj.updated_at, obj.pk)
+
+
+def _rank(scores, lo, hi, count):
+    """Positions of the ``count`` highest scores in ``[lo, hi)``, ties in name order."""
+    # (score, -position) tuples compare in C, which matters for short prefixes.
+    best = heapq.nlargest(count, zip(scores[lo:hi], range(-lo, -hi, -1)))
+    return [-negated for _, negated in best]
+
+
+def _precompute_top(keys, scores):
+    """Top results for every prefix whose slice is too large to rank per request."""
+    top = {}
+    groups = [(0, len(keys))]
+    depth = 0
+    while groups:
+        depth += 1
+        larger = []
+        for lo, hi in groups:
+            start = lo
+            while start < hi:
+                key = keys[start]
+                if len(key) < depth or key[depth - 1] == SEPARATOR:
+                    start += 1
+                    continue
+                prefix = key[:depth]
+                end = bisect_left(keys, prefix + PREFIX_END, start, hi)
+                if end - start > RANK_SCAN_LIMIT:
+                    top[prefix] = [keys[i] for i in _rank(scores, start, end, TOP_SIZE)]
+                    larger.append((start, end))
+                start = end
+        groups = larger
+    return top
+
+
+def _prefixes(key):
+    name = key.split(SEPARATOR, 1)[0]
+    return (name[:end] for end in range(1, len(name) + 1))
+
+
+def _parse_item(key):
+    suffix = key.rsplit(SEPARATOR, 1)[1]
+    if suffix.startswith('product'):
+        return 'product', int(suffix[len('product'):])
+    return 'category', int(suffix[len('category'):])
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+def get_autocomplete_index():
+    autocomplete_index.ensure_current()
+    return autocomplete_index
+
+
+def index_instance(instance):
+    kind = 'product' if isinstance(instance, Product) else 'category'
+    if instance.is_active:
+        autocomplete_index.upsert(kind, instance.pk, instance.name, instance.slug)
+    else:
+        autocomplete_index.remove(kind, instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def update_autocomplete(sender, instance, **kwargs):
+    if autocomplete_index._built:
+        index_instance(instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    if autocomplete_index._built:
+        autocomplete_index.remove('product' if sender is Product else 'category', instance.pk)
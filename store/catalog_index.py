@@ -0,0 +1,205 @@
+"""
+In-process columnar index of the catalog for the product listing.
+
+When ``CATALOG_INDEX_ENABLED`` is set and NumPy is installed, each worker keeps
+product ids, prices (in cents), category ids, stock and sort keys in NumPy
+arrays. Listing requests without a text search are answered by filtering and
+sorting those arrays, so the database only has to load the rows on the
+visible page. The arrays are refreshed from an ``updated_at`` watermark at
+most every ``CATALOG_INDEX_REFRESH_INTERVAL`` seconds; deletions trigger a
+full rebuild.
+"""
+import threading
+import time
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Category, Product
+
+# NumPy is imported on first use so workers that never enable the index do
+# not pay for it at boot.
+np = None
+
+FIELDS = ('id', 'price', 'category_id', 'stock', 'is_active', 'is_featured', 'created_at', 'name', 'updated_at')
+
+
+class CatalogIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (columns, {category slug: subtree ids}), replaced in one assignment
+        # so query() never pairs new columns with a half-built category map.
+        self._snapshot = (None, {})
+        self._positions = {}
+        self._watermark = None
+        self._category_watermark = None
+        self._refreshed_at = 0.0
+        self._stale = True
+
+    def mark_stale(self):
+        self._stale = True
+
+    def refresh(self, force=False):
+        _load_numpy()
+        interval = getattr(settings, 'CATALOG_INDEX_REFRESH_INTERVAL', 5)
+        if not force and not self._stale and time.monotonic() - self._refreshed_at < interval:
+            return
+        with self._lock:
+            columns, category_ids = self._snapshot
+            if self._stale or columns is None or self._watermark is None:
+                columns, category_ids = self._rebuild(), {}
+            else:
+                columns = self._apply_changes(columns)
+            self._snapshot = (columns, self._refresh_categories(category_ids))
+            self._refreshed_at = time.monotonic()
+
+    def _rebuild(self):
+        self._stale = False
+        rows = list(Product.objects.order_by('id').values_list(*FIELDS))
+        self._positions = {row[0]: position for position, row in enumerate(rows)}
+        self._watermark = max((row[-1] for row in rows), default=None)
+        self._category_watermark = None
+        return _build_columns(rows)
+
+    def _apply_changes(self, columns):
+        # >= rather than > so rows written in the same clock tick as the
+        # watermark are never missed; re-applying them is harmless.
+        rows = list(Product.objects.filter(updated_at__gte=self._watermark).values_list(*FIELDS))
+        if not rows:
+            return columns
+        changed = _build_columns(rows)
+        existing = np.array([row[0] in self._positions for row in rows], dtype=bool)
+        columns = {name: column.copy() for name, column in columns.items()}
+        if existing.any():
+            positions = np.array([self._positions[row[0]] for row in rows if row[0] in self._positions])
+            for name, column in columns.items():
+                column[positions] = changed[name][existing]
+        if not existing.all():
+            for row in rows:
+                if row[0] not in self._positions:
+                    self._positions[row[0]] = len(self._positions)
+            for name in columns:
+                columns[name] = np.concatenate([columns[name], changed[name][~existing]])
+        columns['name_rank'] = _rank(columns['name'])
+        self._watermark = max(self._watermark, max(row[-1] for row in rows))
+        return columns
+
+    def _refresh_categories(self, category_ids):
+        changed = Category.objects.all()
+        if self._category_watermark is not None:
+            changed = changed.filter(updated_at__gte=self._category_watermark)
+        watermark = changed.aggregate(latest=Max('updated_at'))['latest']
+        if watermark is not None and watermark != self._category_watermark:
+            category_ids = _subtree_ids(Category.objects.order_by('path').values_list('slug', 'id', 'path'))
+            self._category_watermark = watermark
+        return category_ids
+
+    def query(self, category_slug='', min_price='', max_price='', sort_by='name'):
+        """
+        Return the ids of matching active products in listing order, or None
+        if the filters cannot be answered from the index.
+        """
+        try:
+            min_cents = _to_cents(min_price, ROUND_CEILING) if min_price else None
+            max_cents = _to_cents(max_price, ROUND_FLOOR) if max_price else None
+        except (InvalidOperation, ValueError, OverflowError):
+            return None
+
+        self.refresh()
+        columns, subtrees = self._snapshot
+        mask = columns['is_active'].copy()
+        if category_slug:
+            category_ids = subtrees.get(category_slug)
+            if category_ids is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= np.isin(columns['category_id'], category_ids)
+        if min_cents is not None:
+            mask &= columns['price'] >= min_cents
+        if max_cents is not None:
+            mask &= columns['price'] <= max_cents
+
+        selected = np.flatnonzero(mask)
+        ids = columns['id'][selected]
+        # np.lexsort sorts by the last key first; the id is the final tie-breaker.
+        if sort_by == 'price_low':
+            keys = (ids, columns['price'][selected])
+        elif sort_by == 'price_high':
+            keys = (ids, -columns['price'][selected])
+        elif sort_by == 'newest':
+            keys = (ids, -columns['created_at'][selected])
+        elif sort_by == 'featured':
+            keys = (ids, columns['name_rank'][selected], ~columns['is_featured'][selected])
+        else:
+            keys = (ids, columns['name_rank'][selected])
+        return ids[np.lexsort(keys)]
+
+
+def _build_columns(rows):
+    ids, prices, category_ids, stock, is_active, is_featured, created_at, names, _ = (
+        zip(*rows) if rows else ((),) * len(FIELDS)
+    )
+    names = np.array(names, dtype=object)
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'price': np.array([int(price * 100) for price in prices], dtype=np.int64),
+        'category_id': np.array(category_ids, dtype=np.int64),
+        'stock': np.array(stock, dtype=np.int64),
+        'is_active': np.array(is_active, dtype=bool),
+        'is_featured': np.array(is_featured, dtype=bool),
+        'created_at': np.array([value.timestamp() for value in created_at], dtype=np.float64),
+        'name': names,
+        'name_rank': _rank(names),
+    }
+
+
+def _subtree_ids(rows):
+    """``{slug: ids of the category and its subcategories}`` from ``(slug, id, path)`` rows in path order."""
+    rows = list(rows)
+    subtrees = {}
+    for start, (slug, _, path) in enumerate(rows):
+        end = start + 1
+        # Descendants follow their ancestor directly in path order.
+        while path and end < len(rows) and rows[end][2].startswith(path):
+            end += 1
+        subtrees[slug] = np.array([row[1] for row in rows[start:end]], dtype=np.int64)
+    return subtrees
+
+
+def _rank(names):
+    """Position of each name in sorted order (matches SQLite's binary collation)."""
+    order = np.argsort(names, kind='stable')
+    ranks = np.empty(len(names), dtype=np.int64)
+    ranks[order] = np.arange(len(names))
+    return ranks
+
+
+def _to_cents(value, rounding):
+    return int((Decimal(value) * 100).to_integral_value(rounding=rounding))
+
+
+catalog_index = CatalogIndex()
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+def get_catalog_index():
+    if not getattr(settings, 'CATALOG_INDEX_ENABLED', False) or _load_numpy() is None:
+        return None
+    return catalog_index
+
+
+@receiver(post_delete, sender=Product)
+def mark_catalog_index_stale(sender, instance, **kwargs):
+    catalog_index.mark_stale()
@@ -0,0 +1,109 @@
+"""
+Category tree helpers on top of the materialized paths in ``Category.path``.
+
+A subtree is one range scan of the path index (``subtree_ids``); listings
+then filter products by those category ids, so a leaf category still gets
+its products in index order and a subtree sorts only its own rows. Subtree
+product counts for a level of the tree come from one grouped query.
+
+Saving a category keeps its path and its subtree's paths current. Imports
+that write categories with ``bulk_create`` or ``QuerySet.update()`` skip
+that, so they finish with ``rebuild_tree()`` (or ``manage.py
+rebuild_category_tree``), which recomputes every path from the parent links
+in one read and batched updates. The rows it rewrites get a new
+``updated_at`` and the promotion rules are recompiled, since neither the
+catalog index nor the promotion index hears about ``bulk_update``.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Subquery, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from .models import PATH_END, PATH_STEP, Category, Product
+from .promotions import promotions_changed
+
+
+class TreeError(Exception):
+    pass
+
+
+def rebuild_tree(batch_size=500):
+    """Recompute every category's ``path`` and ``depth``; returns how many rows changed."""
+    children = defaultdict(list)
+    current = {}
+    for pk, parent_id, path, depth in Category.objects.order_by().values_list('id', 'parent_id', 'path', 'depth'):
+        children[parent_id].append(pk)
+        current[pk] = (path, depth)
+
+    max_length = Category._meta.get_field('path').max_length
+    now = timezone.now()
+    changed = []
+    stack = [(pk, '', 0) for pk in children[None]]
+    while stack:
+        pk, parent_path, depth = stack.pop()
+        path = parent_path + f'{pk:0{PATH_STEP}d}'
+        if len(path) > max_length:
+            raise TreeError(f'Category {pk} is nested too deeply ({depth + 1} levels).')
+        if current.pop(pk) != (path, depth):
+            changed.append(Category(pk=pk, path=path, depth=depth, updated_at=now))
+        stack.extend((child, path, depth + 1) for child in children[pk])
+    if current:
+        # Whatever was not reached from a top-level category sits on a cycle.
+        raise TreeError(f'Categories {sorted(current)} form a parent cycle.')
+
+    if not changed:
+        return 0
+    with transaction.atomic():
+        Category.objects.bulk_update(changed, ['path', 'depth', 'updated_at'], batch_size=batch_size)
+    promotions_changed()
+    return len(changed)
+
+
+def subtree_ids(**lookup):
+    """Ids of the category matching ``lookup`` and of its subcategories, from one query."""
+    path = Subquery(Category.objects.filter(**lookup).order_by().values('path')[:1])
+    subtree = Category.objects.filter(path__gte=path, path__lt=Concat(path, Value(PATH_END)))
+    return list(subtree.order_by().values_list('pk', flat=True))
+
+
+def products_in(category_ids):
+    """Active products in any of ``category_ids`` (a subtree from ``subtree_ids``)."""
+    products = Product.objects.filter(is_active=True)
+    if len(category_ids) == 1:
+        # A leaf keeps the plain equality, so the (category, sort key) indexes
+        # return its products already in listing order.
+        return products.filter(category_id=category_ids[0])
+    # A subtree merges several categories' index ranges and sorts those rows:
+    # the sort is bounded by the subtree, not the catalog.
+    return products.filter(category_id__in=category_ids)
+
+
+def subtree_counts(category=None, category_ids=None):
+    """
+    ``[(child, active products in its subtree)]`` for the active children of
+    ``category``, or for the top-level categories when it is None. Pass the
+    category's ``subtree_ids`` if they are already at hand.
+    """
+    if category is None:
+        children = Category.objects.filter(parent=None, is_active=True)
+        products = Product.objects.filter(is_active=True)
+        prefix_length = PATH_STEP
+    else:
+        children = category.children.filter(is_active=True)
+        products = products_in(category_ids if category_ids is not None else subtree_ids(pk=category.pk))
+        prefix_length = len(category.path) + PATH_STEP
+    children = list(children)
+    if not children:
+        return []
+
+    # Count per category in one grouped query, then roll each category's
+    # count up into the child whose path it starts with.
+    per_category = products.order_by().values('category').annotate(count=Count('id')).values_list('category', 'count')
+    per_category = dict(per_category)
+    paths = Category.objects.filter(pk__in=per_category).order_by().values_list('pk', 'path')
+    totals = defaultdict(int)
+    for pk, path in paths:
+        totals[path[:prefix_length]] += per_category[pk]
+    return [(child, totals[child.path]) for child in children]
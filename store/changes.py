@@ -0,0 +1,77 @@
+"""
+Append-only catalog change log.
+
+Every save or delete of a ``Category``, ``Product`` or ``ProductImage`` appends
+a ``CatalogChange`` with a snapshot of the row's public fields, inside the
+transaction that made the change, so the log and the tables cannot disagree.
+Code that changes these rows with ``QuerySet.update()`` must call
+``record_changes()`` itself. Consumers keep the id of the last change they
+applied and read on from there, through ``/api/changes/`` or ``manage.py
+tail_changes``; SQLite commits one writer at a time, so ids become visible
+in order and a cursor never skips a change.
+"""
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CatalogChange, Category, Product, ProductImage
+
+# Fields carried in each snapshot; placeholders are derived and left out.
+SNAPSHOT_FIELDS = {
+    Category: ('name', 'slug', 'parent_id', 'description', 'image', 'is_active'),
+    Product: ('name', 'slug', 'category_id', 'description', 'price', 'image', 'stock', 'is_active', 'is_featured'),
+    ProductImage: ('product_id', 'image', 'alt_text', 'is_primary'),
+}
+MAX_PAGE = 1000
+
+
+def snapshot(instance):
+    data = {'id': instance.pk}
+    for name in SNAPSHOT_FIELDS[type(instance)]:
+        value = getattr(instance, name)
+        data[name] = (value.name or None) if isinstance(value, FieldFile) else value
+    return data
+
+
+def change_for(instance, action):
+    return CatalogChange(
+        model=instance._meta.model_name, object_id=instance.pk, action=action, data=snapshot(instance),
+    )
+
+
+def record_changes(model, pks):
+    """Log the current state of ``pks`` after they were changed with ``QuerySet.update()``."""
+    instances = model.objects.filter(pk__in=pks).only(*SNAPSHOT_FIELDS[model]).order_by('pk')
+    CatalogChange.objects.bulk_create([change_for(instance, 'upsert') for instance in instances])
+
+
+def changes_after(cursor, limit, models=()):
+    changes = CatalogChange.objects.filter(pk__gt=cursor)
+    if models:
+        changes = changes.filter(model__in=models)
+    return list(changes.order_by('pk')[:limit])
+
+
+def as_dict(change):
+    return {
+        'cursor': change.pk,
+        'model': change.model,
+        'id': change.object_id,
+        'action': change.action,
+        'data': change.data,
+        'changed_at': change.created_at,
+    }
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def log_save(sender, instance, **kwargs):
+    change_for(instance, 'upsert').save()
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def log_delete(sender, instance, **kwargs):
+    change_for(instance, 'delete').save()
@@ -0,0 +1,76 @@
+"""
+Batched removal of expired sessions and abandoned carts.
+
+With ``SESSION_SAVE_EVERY_REQUEST`` every visit writes a session row, and a
+cart stays behind for every shopper who never comes back. ``purge_stale_data``
+deletes both in small transactions, one batch at a time, so each holds the
+write lock only briefly and can run while the shop is busy. A cart is
+abandoned once its ``updated_at``, which moves with every change to its items
+or coupon, is older than ``CART_ABANDONED_AFTER_DAYS``.
+"""
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from ecommerce_app.db.writes import write_transaction
+
+from .models import Cart, CartItem
+
+
+def cart_cutoff():
+    return timezone.now() - timedelta(days=getattr(settings, 'CART_ABANDONED_AFTER_DAYS', 30))
+
+
+def session_model():
+    """The session model for database-backed session engines, else None."""
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if not hasattr(store, 'get_model_class'):
+        return None
+    return store.get_model_class()
+
+
+def stale_sessions(now=None):
+    return session_model().objects.filter(expire_date__lt=now or timezone.now())
+
+
+def purge_sessions_batch(now=None, batch_size=1000):
+    """Delete up to ``batch_size`` expired sessions; returns how many were deleted."""
+    sessions = stale_sessions(now)
+    with write_transaction():
+        keys = list(sessions.order_by().values_list('pk', flat=True)[:batch_size])
+        if not keys:
+            return 0
+        # Filtering on expiry again skips sessions renewed since the read.
+        deleted, _ = sessions.filter(pk__in=keys).delete()
+    return deleted
+
+
+def stale_carts(cutoff):
+    return Cart.objects.filter(updated_at__lt=cutoff)
+
+
+def purge_carts_batch(cutoff, batch_size=500):
+    """Delete up to ``batch_size`` carts idle since ``cutoff``; returns ``(carts, items)`` deleted."""
+    with write_transaction():
+        cart_ids = list(stale_carts(cutoff).order_by().values_list('pk', flat=True)[:batch_size])
+        if not cart_ids:
+            return 0, 0
+        # CartItem.delete() would load every item and send post_delete for
+        # each, and that receiver touches the cart being removed; one DELETE
+        # takes the items instead. It checks updated_at again, so a cart
+        # used since the read above keeps its items (and, below, itself).
+        items, carts = CartItem._meta.db_table, Cart._meta.db_table
+        placeholders = ', '.join(['%s'] * len(cart_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {items} WHERE cart_id IN '
+                f'(SELECT id FROM {carts} WHERE id IN ({placeholders}) AND updated_at < %s)',
+                [*cart_ids, connection.ops.adapt_datetimefield_value(cutoff)],
+            )
+            deleted_items = cursor.rowcount
+        # No items are left for the cascade to load or send signals for.
+        _, deleted = stale_carts(cutoff).filter(pk__in=cart_ids).delete()
+    return deleted.get(Cart._meta.label, 0), deleted_items
@@ -1,4 +1,5 @@
 from .models import Cart
+from .pricing import get_cart_pricing
 
 
 def cart_context(request):
@@ -10,9 +11,9 @@ def cart_context(request):
     
     if request.user.is_authenticated:
         try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items_count = cart.total_items
-            cart_total = cart.total_price
+            pricing = get_cart_pricing(Cart.objects.get(user=request.user))
+            cart_items_count = pricing.item_count
+            cart_total = pricing.subtotal
         except Cart.DoesNotExist:
             pass
     else:
@@ -0,0 +1,67 @@
+"""
+Bulk order status transitions.
+
+Staff move orders along ``ALLOWED_TRANSITIONS`` in bulk, from the admin
+actions or the ``transition_orders`` command. Each batch is one UPDATE whose
+WHERE clause only matches orders currently in a valid source status, so
+invalid or concurrent transitions are skipped rather than applied, without
+loading or saving the rows one by one.
+"""
+from dataclasses import dataclass, field
+
+from django.db.models import Count
+from django.utils import timezone
+
+from ecommerce_app.db.writes import write_transaction
+
+from .models import Order
+
+ALLOWED_TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+DEFAULT_BATCH_SIZE = 1000
+
+
+def source_statuses(target):
+    return sorted(status for status, targets in ALLOWED_TRANSITIONS.items() if target in targets)
+
+
+@dataclass
+class TransitionResult:
+    target: str
+    updated: int = 0
+    skipped: dict = field(default_factory=dict)
+
+    @property
+    def skipped_count(self):
+        return sum(self.skipped.values())
+
+
+def transition_orders(order_ids, target, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """Move the given orders to ``target`` where allowed; returns a ``TransitionResult``."""
+    if target not in ALLOWED_TRANSITIONS:
+        raise ValueError(f'Unknown order status: {target}')
+    sources = source_statuses(target)
+    result = TransitionResult(target)
+    order_ids = list(order_ids)
+
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+        with write_transaction():
+            matching = Order.objects.filter(pk__in=batch)
+            counts = dict(matching.order_by().values_list('status').annotate(count=Count('pk')))
+            for status, count in counts.items():
+                if status not in sources:
+                    result.skipped[status] = result.skipped.get(status, 0) + count
+            missing = len(set(batch)) - sum(counts.values())
+            if missing:
+                result.skipped['missing'] = result.skipped.get('missing', 0) + missing
+            if dry_run:
+                result.updated += sum(count for status, count in counts.items() if status in sources)
+            else:
+                result.updated += matching.filter(status__in=sources).update(status=target, updated_at=timezone.now())
+    return result
@@ -0,0 +1,59 @@
+"""
+Stock and cart quantity changes that stay correct under concurrency.
+
+Reading ``product.stock`` and saving it back loses updates as soon as two
+workers sell the same product: both read 5, both write 4. Here every change
+is a single conditional ``UPDATE`` (``stock = stock - n WHERE stock >= n``),
+so the database applies them one after another and a sale that would take
+stock below zero changes nothing instead. ``QuerySet.update()`` sends no
+signals, so the change feed, the stock cache and cart pricing are brought up
+to date explicitly.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .changes import record_changes
+from .models import CartItem, Product
+from .pricing import touch_carts
+from .stock import stock_lookup
+
+
+class OutOfStock(Exception):
+    def __init__(self, product):
+        super().__init__(f'Not enough stock for {product.name}')
+        self.product = product
+
+
+def reserve_stock(lines):
+    """
+    Take ``(product, quantity)`` pairs out of stock; call inside a transaction.
+
+    Raises ``OutOfStock`` for the first product that can't cover its
+    quantity, leaving the caller's transaction to roll the others back.
+    """
+    now = timezone.now()
+    # A fixed order keeps two checkouts from locking the same rows in
+    # opposite orders on databases with row locks.
+    lines = sorted(lines, key=lambda line: line[0].pk)
+    for product, quantity in lines:
+        taken = Product.objects.filter(pk=product.pk, stock__gte=quantity).update(
+            stock=F('stock') - quantity, updated_at=now,
+        )
+        if not taken:
+            raise OutOfStock(product)
+    record_changes(Product, [product.pk for product, _ in lines])
+    transaction.on_commit(lambda: [stock_lookup.invalidate(product) for product, _ in lines])
+
+
+def add_to_cart(cart, product, quantity):
+    """Add ``quantity`` of ``product`` to ``cart``; False if the line would then exceed stock."""
+    item, created = CartItem.objects.get_or_create(cart=cart, product=product, defaults={'quantity': quantity})
+    if created:
+        return True
+    added = CartItem.objects.filter(pk=item.pk, quantity__lte=product.stock - quantity).update(
+        quantity=F('quantity') + quantity, updated_at=timezone.now(),
+    )
+    if added:
+        touch_carts(pk=cart.pk)
+    return bool(added)
@@ -0,0 +1,40 @@
+from django.db.models import Q
+
+from .categories import products_in, subtree_ids
+from .models import Product
+
+SORT_ORDERS = {
+    'price_low': ('price',),
+    'price_high': ('-price',),
+    'newest': ('-created_at',),
+    'featured': ('-is_featured', 'name'),
+}
+
+
+def filter_products(params):
+    """Active products matching the storefront listing's search, category, price and sort parameters."""
+    products = Product.objects.filter(is_active=True)
+
+    # Category filter, including the category's subcategories
+    category_slug = params.get('category', '')
+    if category_slug:
+        products = products_in(subtree_ids(slug=category_slug))
+
+    # Search functionality
+    search_query = params.get('search', '')
+    if search_query:
+        products = products.filter(
+            Q(name__icontains=search_query) | 
+            Q(description__icontains=search_query) |
+            Q(category__name__icontains=search_query)
+        )
+
+    # Price filter
+    min_price = params.get('min_price', '')
+    max_price = params.get('max_price', '')
+    if min_price:
+        products = products.filter(price__gte=min_price)
+    if max_price:
+        products = products.filter(price__lte=max_price)
+
+    return products.order_by(*SORT_ORDERS.get(params.get('sort', 'name'), ('name',)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product, ProductImage
+from store.placeholders import update_placeholders
+
+
+class Command(BaseCommand):
+    help = 'Compute image placeholders for products and gallery images that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute existing placeholders too')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (Product, ProductImage):
+            queryset = model.objects.exclude(image='')
+            if not options['all']:
+                queryset = queryset.filter(placeholder_uri='')
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+
+            written = 0
+            for start in range(0, len(pks), batch_size):
+                written += update_placeholders(model, pks[start:start + batch_size])
+            skipped = len(pks) - written
+            message = f'{model._meta.verbose_name_plural}: {written} placeholder(s) written'
+            if skipped:
+                message += f', {skipped} unreadable image(s) skipped'
+            self.stdout.write(message)
+
+        self.stdout.write(self.style.SUCCESS('Placeholder backfill complete.'))
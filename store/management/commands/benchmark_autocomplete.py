@@ -0,0 +1,64 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.autocomplete import AutocompleteIndex
+
+WORDS = (
+    'wireless smart classic organic premium portable leather cotton steel vintage ultra mini pro '
+    'eco deluxe compact digital modern bamboo ceramic'
+).split()
+NOUNS = (
+    'headphones phone watch speaker lamp jacket backpack bottle chair desk keyboard mouse camera '
+    'blender kettle sneakers wallet notebook charger tent'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Measure autocomplete build time and lookup latency on a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=1_000_000, help='Synthetic product names to index')
+        parser.add_argument('--queries', type=int, default=20_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        names = [
+            f'{rng.choice(WORDS).title()} {rng.choice(NOUNS).title()} {rng.randrange(100000):05d}'
+            for _ in range(options['names'])
+        ]
+        # Heavy-tailed popularity, like real sales.
+        entries = [
+            ('product', pk, name, f'product-{pk}', int(rng.paretovariate(1.2)))
+            for pk, name in enumerate(names, start=1)
+        ]
+
+        index = AutocompleteIndex()
+        started = time.perf_counter()
+        index.build(entries)
+        self.stdout.write(f'Built index over {len(names)} names in {time.perf_counter() - started:.1f}s')
+
+        # Typed prefixes of real names: 1-8 characters, as a search box sends them.
+        queries = []
+        for _ in range(options['queries']):
+            name = rng.choice(names).casefold()
+            queries.append(name[:rng.randint(1, 8)])
+
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p))] * 1000
+
+        p99 = percentile(0.99)
+        self.stdout.write(
+            f'{len(timings)} lookups: p50 {percentile(0.50):.3f}ms, p99 {p99:.3f}ms, max {timings[-1] * 1000:.3f}ms'
+        )
+        style = self.style.SUCCESS if p99 < 1 else self.style.WARNING
+        self.stdout.write(style(f'p99 {"within" if p99 < 1 else "over"} the 1ms target.'))
@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce_app.db.sqlite3.base import DEFAULT_PRAGMAS
+from ecommerce_app.db.writes import WriteQueue
+
+
+class Command(BaseCommand):
+    help = 'Compare error rate and throughput of concurrent checkout-style writes on default vs tuned SQLite connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent writer threads')
+        parser.add_argument('--operations', type=int, default=100, help='Checkouts per thread')
+        parser.add_argument('--timeout', type=float, default=5.0, help='Lock timeout in seconds for both runs')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            for label, tuned in (('default', False), ('tuned', True)):
+                path = os.path.join(directory, f'{label}.sqlite3')
+                self.create_schema(path)
+                result = self.run(path, tuned, options)
+                self.stdout.write(
+                    f"{label:>8}: {result['ok']} ok, {result['errors']} errors "
+                    f"({result['error_rate']:.1%}), {result['throughput']:.0f} checkouts/s"
+                )
+        self.stdout.write(self.style.SUCCESS('Benchmark complete.'))
+
+    def create_schema(self, path):
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE product (id INTEGER PRIMARY KEY, stock INTEGER NOT NULL);
+            CREATE TABLE orders (id INTEGER PRIMARY KEY, product_id INTEGER, quantity INTEGER);
+            INSERT INTO product (id, stock) VALUES (1, 1000000), (2, 1000000), (3, 1000000);
+        """)
+        conn.commit()
+        conn.close()
+
+    def connect(self, path, tuned, timeout):
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        if tuned:
+            for name, value in {**DEFAULT_PRAGMAS, 'busy_timeout': int(timeout * 1000)}.items():
+                conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def checkout(self, conn, tuned, product_id):
+        conn.execute('BEGIN IMMEDIATE' if tuned else 'BEGIN')
+        try:
+            stock = conn.execute('SELECT stock FROM product WHERE id = ?', (product_id,)).fetchone()[0]
+            conn.execute('UPDATE product SET stock = ? WHERE id = ?', (stock - 1, product_id))
+            conn.execute('INSERT INTO orders (product_id, quantity) VALUES (?, 1)', (product_id,))
+            conn.execute('COMMIT')
+        except sqlite3.OperationalError:
+            conn.execute('ROLLBACK')
+            raise
+
+    def run(self, path, tuned, options):
+        counts = {'ok': 0, 'errors': 0}
+        counts_lock = threading.Lock()
+        queue = WriteQueue(max_depth=options['threads'] + 1)
+
+        def worker(index):
+            # Tuned workers keep one connection; default ones reconnect per request.
+            conn = self.connect(path, tuned, options['timeout']) if tuned else None
+            for n in range(options['operations']):
+                product_id = (index + n) % 3 + 1
+                try:
+                    if tuned:
+                        queue.acquire()
+                        try:
+                            self.checkout(conn, tuned, product_id)
+                        finally:
+                            queue.release()
+                    else:
+                        per_request = self.connect(path, tuned, options['timeout'])
+                        try:
+                            self.checkout(per_request, tuned, product_id)
+                        finally:
+                            per_request.close()
+                    outcome = 'ok'
+                except sqlite3.OperationalError:
+                    outcome = 'errors'
+                with counts_lock:
+                    counts[outcome] += 1
+            if conn is not None:
+                conn.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = counts['ok'] + counts['errors']
+        return {
+            'ok': counts['ok'],
+            'errors': counts['errors'],
+            'error_rate': counts['errors'] / total if total else 0,
+            'throughput': counts['ok'] / elapsed if elapsed else 0,
+        }
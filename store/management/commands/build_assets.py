@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from whitenoise.compress import Compressor, brotli_installed
+
+
+class Command(BaseCommand):
+    help = 'Fingerprint and precompress static files, and precompress compressible media files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-static', action='store_true', help='Only precompress media')
+
+    def handle(self, *args, **options):
+        if not brotli_installed:
+            self.stdout.write(self.style.WARNING('Brotli is not installed; only gzip variants will be written.'))
+
+        if not options['skip_static']:
+            # With the manifest storage (DEBUG off) this hashes every file name
+            # and writes .gz/.br siblings for WhiteNoise to serve.
+            call_command('collectstatic', interactive=False, verbosity=options['verbosity'])
+
+        written = self.compress_media(options['verbosity'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} precompressed media file(s).'))
+
+    def compress_media(self, verbosity):
+        # Already-compressed formats (JPEG, PNG, WebP...) are skipped, so in
+        # practice this covers SVGs and other text-based uploads.
+        compressor = Compressor(quiet=verbosity < 2, log=self.stdout.write)
+        written = 0
+        for root, _, files in os.walk(settings.MEDIA_ROOT):
+            for name in files:
+                path = os.path.join(root, name)
+                if not compressor.should_compress(name) or self.is_fresh(path):
+                    continue
+                written += len(compressor.compress(path))
+        return written
+
+    def is_fresh(self, path):
+        mtime = os.path.getmtime(path)
+        variants = [path + '.gz'] + ([path + '.br'] if brotli_installed else [])
+        return all(os.path.exists(variant) and os.path.getmtime(variant) >= mtime for variant in variants)
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.sitemaps import build_sitemaps, sitemap_root
+
+
+class Command(BaseCommand):
+    help = 'Write the product and category sitemaps into SITEMAP_ROOT, rewriting only chunks that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rewrite every file, ignoring the manifest')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written, removed, unchanged = build_sitemaps(full=options['full'])
+        for name in written:
+            self.stdout.write(f'Wrote {name}')
+        for name in removed:
+            self.stdout.write(f'Removed {name}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(written)} sitemap(s) written, {len(removed)} removed, {len(unchanged)} unchanged '
+            f'in {sitemap_root()} ({time.perf_counter() - started:.2f}s).'
+        ))
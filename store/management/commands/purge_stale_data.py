@@ -0,0 +1,64 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.cleanup import cart_cutoff, purge_carts_batch, purge_sessions_batch, session_model, stale_carts, stale_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions and carts idle for CART_ABANDONED_AFTER_DAYS in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Override CART_ABANDONED_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be deleted')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['days'] is not None:
+            cutoff = now - timedelta(days=options['days'])
+        else:
+            cutoff = cart_cutoff()
+        purge_sessions = session_model() is not None
+        if not purge_sessions:
+            self.stdout.write('Sessions are not stored in the database; skipping them.')
+
+        if options['dry_run']:
+            sessions = stale_sessions(now).count() if purge_sessions else 0
+            carts = stale_carts(cutoff).count()
+            self.stdout.write(
+                f'{sessions} expired session(s) and {carts} cart(s) idle since {cutoff:%Y-%m-%d} would be deleted.'
+            )
+            return
+
+        started = time.perf_counter()
+        sessions = 0
+        if purge_sessions:
+            sessions, = self.run_batches(
+                'session(s)', lambda: (purge_sessions_batch(now, options['batch_size']),), options['pause'],
+            )
+        carts, items = self.run_batches(
+            'cart(s)', lambda: purge_carts_batch(cutoff, options['batch_size']), options['pause'],
+        )
+        elapsed = time.perf_counter() - started
+        rows = sessions + carts + items
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {sessions} expired session(s) and {carts} cart(s) with {items} item(s) idle since '
+            f'{cutoff:%Y-%m-%d} in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s).'
+        ))
+
+    def run_batches(self, label, batch, pause):
+        """Call ``batch`` until its first count is 0; returns the summed counts."""
+        totals = None
+        while True:
+            counts = batch()
+            totals = counts if totals is None else tuple(map(sum, zip(totals, counts)))
+            if not counts[0]:
+                return totals
+            self.stdout.write(f'Deleted {totals[0]} {label} so far')
+            if pause:
+                # Gives live traffic a turn at the write lock between batches.
+                time.sleep(pause)
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.categories import TreeError, rebuild_tree
+
+
+class Command(BaseCommand):
+    help = 'Recompute every category path and depth from the parent links (run after bulk category imports)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Categories updated per query')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            changed = rebuild_tree(batch_size=options['batch_size'])
+        except TreeError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the category tree: {changed} categor{"y" if changed == 1 else "ies"} updated '
+            f'in {time.perf_counter() - started:.2f}s.'
+        ))
@@ -0,0 +1,50 @@
+import signal
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from store.task_queue import Worker, purge_finished
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (order emails, stock alerts, ...) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once no task is due')
+        parser.add_argument('--batch-size', type=int, default=10, help='Tasks claimed per round trip')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        worker = Worker(batch_size=options['batch_size'])
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        retention = timedelta(days=getattr(settings, 'TASK_RETENTION_DAYS', 7))
+        succeeded = failed = 0
+        last_purge = 0.0
+
+        self.stdout.write(f'Task worker {worker.token} started')
+        while not self.stopping:
+            close_old_connections()
+            ok, errors = worker.run_batch()
+            succeeded += ok
+            failed += errors
+            if ok or errors:
+                continue
+            if options['once']:
+                break
+            if time.monotonic() - last_purge > 60 * 60:
+                purge_finished(timezone.now() - retention)
+                last_purge = time.monotonic()
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Task worker stopped: {succeeded} succeeded, {failed} failed.'))
+
+    def stop(self, signum, frame):
+        # Finish the current batch, then exit; unfinished claims are retried
+        # by another worker once their lease expires.
+        self.stopping = True
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.stress import run_stress
+
+
+class Command(BaseCommand):
+    help = 'Hammer add-to-cart and checkout on a few hot products from many workers and check stock and order invariants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads per process')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes (each runs --threads workers)')
+        parser.add_argument('--iterations', type=int, default=20, help='Add-to-cart plus checkout rounds per worker')
+        parser.add_argument('--skus', type=int, default=3, help='Hot products shared by all workers')
+        parser.add_argument('--stock', type=int, default=50, help='Starting stock of each hot product')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='Leave the stress users, products and orders in place')
+
+    def handle(self, *args, **options):
+        result = run_stress(
+            threads=options['threads'], processes=options['processes'], iterations=options['iterations'],
+            skus=options['skus'], stock=options['stock'], seed=options['seed'], keep=options['keep'],
+        )
+        outcomes = result.outcomes
+        self.stdout.write(f'{result.requests} requests in {result.elapsed:.1f}s ({result.throughput:.0f}/s)')
+        self.stdout.write(f"{outcomes['ordered']} orders ({result.orders_per_second:.1f}/s), "
+                          f"{outcomes['added']} adds, {outcomes['out_of_stock']} out of stock, "
+                          f"{outcomes['checkout_failed']} failed checkouts")
+        self.stdout.write(f"{outcomes['busy']} turned away as busy, {outcomes['locked']} lock timeouts, "
+                          f"{outcomes['error']} errors")
+        if result.violations:
+            for violation in result.violations:
+                self.stderr.write(violation)
+            raise CommandError(f'{len(result.violations)} invariant violation(s).')
+        self.stdout.write(self.style.SUCCESS('Stock and order invariants hold.'))
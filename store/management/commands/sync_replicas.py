@@ -0,0 +1,35 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database onto the configured read replicas'
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('sync_replicas only supports SQLite databases; use native replication elsewhere.')
+
+        aliases = settings.DATABASE_REPLICA_ALIASES
+        if not aliases:
+            self.stdout.write(self.style.WARNING('No replicas configured (set DATABASE_REPLICAS).'))
+            return
+
+        source = sqlite3.connect(str(primary['NAME']))
+        try:
+            for alias in aliases:
+                target = sqlite3.connect(str(settings.DATABASES[alias]['NAME']))
+                try:
+                    # The online backup API gives a consistent snapshot without
+                    # blocking writers on the primary for the whole copy.
+                    source.backup(target, pages=1024)
+                finally:
+                    target.close()
+                self.stdout.write(f'Synced {alias}')
+        finally:
+            source.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Synced {len(aliases)} replica(s) from the primary database.'))
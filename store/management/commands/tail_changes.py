@@ -0,0 +1,45 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from store.changes import MAX_PAGE, as_dict, changes_after
+from store.models import CatalogChange
+
+
+class Command(BaseCommand):
+    help = 'Print catalog changes as JSON lines, optionally following new ones as they are logged'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--after', type=int, help='Cursor to start after (default: show the last --lines changes)')
+        parser.add_argument('--lines', type=int, default=10, help='Changes to show when no cursor is given')
+        parser.add_argument('--model', action='append', choices=[name for name, _ in CatalogChange.MODEL_CHOICES])
+        parser.add_argument('--follow', '-f', action='store_true', help='Keep polling for new changes')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls with --follow')
+
+    def handle(self, *args, **options):
+        models = options['model'] or ()
+        cursor = options['after']
+        if cursor is None:
+            if options['lines'] < 0:
+                raise CommandError('--lines must not be negative.')
+            latest = CatalogChange.objects.filter(model__in=models) if models else CatalogChange.objects.all()
+            ids = list(latest.order_by('-pk').values_list('pk', flat=True)[:options['lines'] + 1])
+            cursor = ids[-1] if len(ids) > options['lines'] else 0
+
+        try:
+            while True:
+                changes = changes_after(cursor, MAX_PAGE, models)
+                for change in changes:
+                    self.stdout.write(json.dumps(as_dict(change), cls=DjangoJSONEncoder))
+                if changes:
+                    cursor = changes[-1].pk
+                if len(changes) == MAX_PAGE:
+                    continue
+                if not options['follow']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stderr.write(self.style.SUCCESS(f'Stopped at cursor {cursor}.'))
@@ -0,0 +1,67 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.fulfillment import ALLOWED_TRANSITIONS, DEFAULT_BATCH_SIZE, source_statuses, transition_orders
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Move orders to a new status in batches, skipping any whose current status does not allow it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', choices=sorted(ALLOWED_TRANSITIONS), help='Target status')
+        selection = parser.add_mutually_exclusive_group(required=True)
+        selection.add_argument(
+            '--order-numbers', metavar='FILE',
+            help="File with one order number per line ('-' for stdin), e.g. a carrier's shipment export",
+        )
+        selection.add_argument(
+            '--all-from', metavar='STATUS', choices=sorted(ALLOWED_TRANSITIONS),
+            help='Every order currently in this status',
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        target = options['status']
+        if not source_statuses(target):
+            raise CommandError(f'No status can move to {target}.')
+
+        started = time.perf_counter()
+        if options['all_from']:
+            if target not in ALLOWED_TRANSITIONS[options['all_from']]:
+                raise CommandError(f"Orders cannot move from {options['all_from']} to {target}.")
+            order_ids = Order.objects.filter(status=options['all_from']).order_by('pk').values_list('pk', flat=True)
+            missing = 0
+        else:
+            numbers = self.read_order_numbers(options['order_numbers'])
+            order_ids, missing = self.resolve(numbers, options['batch_size'])
+
+        result = transition_orders(order_ids, target, options['batch_size'], dry_run=options['dry_run'])
+        if missing:
+            result.skipped['unknown order number'] = missing
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(
+            self.style.SUCCESS(f'{verb} {result.updated} order(s) to {target} in {time.perf_counter() - started:.2f}s.')
+        )
+        for status, count in sorted(result.skipped.items()):
+            self.stdout.write(self.style.WARNING(f'Skipped {count} order(s): {status}'))
+
+    def read_order_numbers(self, path):
+        stream = sys.stdin if path == '-' else open(path)
+        try:
+            return list(dict.fromkeys(line.strip() for line in stream if line.strip()))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    def resolve(self, numbers, batch_size):
+        """Map order numbers to ids in batches; returns ``(ids, unknown count)``."""
+        order_ids = []
+        for start in range(0, len(numbers), batch_size):
+            batch = numbers[start:start + batch_size]
+            order_ids.extend(Order.objects.filter(order_number__in=batch).values_list('pk', flat=True))
+        return order_ids, len(numbers) - len(order_ids)
@@ -0,0 +1,60 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+from store.warmup import warm_up
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = 'Pre-compile templates, prime URL caches and import heavy modules; optionally report worker import times'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--import-report', action='store_true',
+            help='Import the WSGI application in a fresh interpreter and list the slowest imports'
+        )
+        parser.add_argument('--top', type=int, default=20, help='Number of imports to list in the report')
+
+    def handle(self, *args, **options):
+        timings = warm_up()
+        for step, (count, seconds) in timings.items():
+            self.stdout.write(f'{step:>10}: {count:4d} in {seconds * 1000:8.1f} ms')
+        total = sum(seconds for _, seconds in timings.values())
+        self.stdout.write(self.style.SUCCESS(f'Warm-up finished in {total * 1000:.1f} ms'))
+
+        if options['import_report']:
+            self.import_report(options['top'])
+
+    def import_report(self, top):
+        """Run ``python -X importtime`` on the WSGI entry point and summarise it."""
+        env = {**os.environ, 'WARMUP_ON_STARTUP': 'False'}
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_app.settings')
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ecommerce_app.wsgi'],
+            capture_output=True, text=True, env=env,
+        )
+        if result.returncode != 0:
+            self.stderr.write(result.stderr)
+            return
+
+        imports = []
+        total = 0
+        for line in result.stderr.splitlines():
+            match = IMPORTTIME_LINE.match(line)
+            if not match:
+                continue
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((int(cumulative_us), int(self_us), module))
+            if len(indent) == 1:  # top-level import
+                total += int(cumulative_us)
+
+        self.stdout.write('')
+        self.stdout.write(f'Worker import time: {total / 1000:.1f} ms across {len(imports)} modules')
+        self.stdout.write(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for cumulative_us, self_us, module in sorted(imports, reverse=True)[:top]:
+            self.stdout.write(f'{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {module}')
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_order_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='placeholder_color',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='placeholder_uri',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='placeholder_color',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='placeholder_uri',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_root_paths(apps, schema_editor):
+    # Every existing category is top-level, so its path is just its own id.
+    Category = apps.get_model('store', 'Category')
+    categories = list(Category.objects.only('id'))
+    for category in categories:
+        category.path = f'{category.pk:08d}'
+    Category.objects.bulk_update(categories, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_catalog_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='store.category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['parent', 'name'], name='store_categ_parent__43022b_idx'),
+        ),
+        migrations.RunPython(set_root_paths, migrations.RunPython.noop),
+    ]
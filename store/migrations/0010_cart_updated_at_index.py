@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_promotions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated_at'], name='store_cart_updated_08faa2_idx'),
+        ),
+    ]
@@ -1,14 +1,31 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 # from PIL import Image
 import os
 
+# Categories form a tree stored as materialized paths: each category's path is
+# its ancestors' ids and its own, zero-padded to PATH_STEP digits. A subtree
+# is then one range of the path index, [path, path + PATH_END), and the
+# ancestors can be read straight off the path.
+PATH_STEP = 8
+PATH_END = '~'
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=100, unique=True)
+    # Deleting a category must not take its subtree, their products and
+    # those products' order lines with it: move or delete the children first.
+    parent = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True, related_name='children')
+    path = models.CharField(max_length=255, editable=False, db_index=True, default='')
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     is_active = models.BooleanField(default=True)
@@ -18,6 +35,9 @@ class Category(models.Model):
     class Meta:
         verbose_name_plural = 'Categories'
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['parent', 'name']),
+        ]
 
     def __str__(self):
         return self.name
@@ -25,6 +45,54 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('store:category_products', kwargs={'slug': self.slug})
 
+    def _parent_path(self):
+        if self.parent_id is None:
+            return ''
+        return Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+
+    def _is_own_subtree(self, parent_path):
+        return bool(self.path) and parent_path.startswith(self.path)
+
+    def clean(self):
+        if self.parent_id is not None and self._is_own_subtree(self._parent_path()):
+            raise ValidationError({'parent': 'A category cannot be moved under itself or one of its subcategories.'})
+
+    def save(self, *args, **kwargs):
+        parent_path = self._parent_path()
+        if self._is_own_subtree(parent_path):
+            raise ValueError('A category cannot be moved under itself or one of its subcategories.')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            path = parent_path + f'{self.pk:0{PATH_STEP}d}'
+            if path != self.path:
+                self._move_to(path)
+
+    def _move_to(self, path):
+        depth = len(path) // PATH_STEP - 1
+        Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        if self.path:
+            # Carry the subtree along: swap the old path prefix for the new one.
+            Category.objects.filter(path__gt=self.path, path__lt=self.path + PATH_END).update(
+                path=Concat(Value(path), Substr('path', len(self.path) + 1)),
+                depth=F('depth') + (depth - self.depth),
+            )
+        self.path, self.depth = path, depth
+
+    def get_descendants(self, include_self=False):
+        descendants = Category.objects.filter(path__gte=self.path, path__lt=self.path + PATH_END)
+        return descendants if include_self else descendants.exclude(pk=self.pk)
+
+    @property
+    def ancestor_ids(self):
+        return [int(self.path[i:i + PATH_STEP]) for i in range(0, len(self.path) - PATH_STEP, PATH_STEP)]
+
+    def get_ancestors(self):
+        """Ancestors from the top down, from one primary key lookup (none for a top-level category)."""
+        ids = self.ancestor_ids
+        if not ids:
+            return []
+        return sorted(Category.objects.filter(pk__in=ids), key=lambda category: category.depth)
+
 
 class Product(models.Model):
     name = models.CharField(max_length=200)
@@ -33,6 +101,8 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0.01)])
     image = models.ImageField(upload_to='products/')
+    placeholder_color = models.CharField(max_length=7, blank=True, editable=False)
+    placeholder_uri = models.TextField(blank=True, editable=False)
     stock = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
@@ -45,6 +115,15 @@ class Product(models.Model):
             models.Index(fields=['slug']),
             models.Index(fields=['category', 'is_active']),
             models.Index(fields=['is_featured', 'is_active']),
+            # Storefront listings only show active products, in one of these
+            # orders, optionally within one category.
+            models.Index(fields=['name'], condition=Q(is_active=True), name='product_active_name_idx'),
+            models.Index(fields=['price'], condition=Q(is_active=True), name='product_active_price_idx'),
+            models.Index(fields=['created_at'], condition=Q(is_active=True), name='product_active_created_idx'),
+            models.Index(fields=['-is_featured', 'name'], condition=Q(is_active=True), name='product_active_featured_idx'),
+            models.Index(fields=['category', 'name'], condition=Q(is_active=True), name='product_cat_name_idx'),
+            models.Index(fields=['category', 'price'], condition=Q(is_active=True), name='product_cat_price_idx'),
+            models.Index(fields=['category', 'created_at'], condition=Q(is_active=True), name='product_cat_created_idx'),
         ]
 
     def __str__(self):
@@ -53,6 +132,15 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('store:product_detail', kwargs={'slug': self.slug})
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so repricing can invalidate the carts holding this product.
+        instance._loaded_price = instance.__dict__.get('price')
+        # Remembered so a new upload gets a fresh placeholder.
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         # Temporarily disabled image processing
@@ -71,16 +159,27 @@ class Product(models.Model):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='additional_images')
     image = models.ImageField(upload_to='products/gallery/')
+    placeholder_color = models.CharField(max_length=7, blank=True, editable=False)
+    placeholder_uri = models.TextField(blank=True, editable=False)
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-is_primary', 'created_at']
+        indexes = [
+            models.Index(fields=['product', '-is_primary', 'created_at']),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - Image"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         # Temporarily disabled image processing
@@ -92,7 +191,8 @@ class ProductImage(models.Model):
         #         img.save(self.image.path)
 
 
-class Order(models.Model):
+class OrderBase(models.Model):
+    """Fields shared by live orders and their archived copies."""
     ORDER_STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('processing', 'Processing'),
@@ -101,7 +201,6 @@ class Order(models.Model):
         ('cancelled', 'Cancelled'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     order_number = models.CharField(max_length=20, unique=True)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
@@ -114,12 +213,14 @@ class Order(models.Model):
     postal_code = models.CharField(max_length=20)
     country = models.CharField(max_length=50)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    coupon_code = models.CharField(max_length=50, blank=True)
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default='pending')
     is_paid = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    confirmation_sent_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
+        abstract = True
         ordering = ['-created_at']
 
     def __str__(self):
@@ -129,12 +230,47 @@ class Order(models.Model):
         return reverse('store:order_detail', kwargs={'order_number': self.order_number})
 
 
-class OrderItem(models.Model):
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+class Order(OrderBase):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta(OrderBase.Meta):
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+
+class ArchivedOrder(OrderBase):
+    """An order moved out of the live tables by ``archive_orders``; keeps its original id and timestamps."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta(OrderBase.Meta):
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+
+class OrderNumberSequence(models.Model):
+    """Counter from which each worker process reserves blocks of order numbers."""
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} (next {self.next_value})"
+
+
+class OrderItemBase(models.Model):
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        abstract = True
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
 
@@ -143,11 +279,28 @@ class OrderItem(models.Model):
         return self.quantity * self.price
 
 
+class OrderItem(OrderItemBase):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+
+class ArchivedOrderItem(OrderItemBase):
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
+    coupon_code = models.CharField(max_length=50, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # purge_stale_data finds abandoned carts by last activity.
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+
     def __str__(self):
         return f"Cart for {self.user.username}"
 
@@ -176,3 +329,106 @@ class CartItem(models.Model):
     @property
     def total_price(self):
         return self.quantity * self.product.price
+
+
+class Promotion(models.Model):
+    """
+    A discount rule. It targets the listed products and the listed categories
+    (with their subcategories); with no targets it is taken off the whole
+    cart. A promotion with a ``code`` is a coupon and only applies once the
+    shopper enters that code.
+    """
+    KIND_CHOICES = [
+        ('percentage', 'Percentage off'),
+        ('fixed', 'Fixed amount off'),
+        ('buy_x_get_y', 'Buy X get Y'),
+    ]
+
+    name = models.CharField(max_length=100)
+    code = models.CharField(max_length=50, blank=True, db_index=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='percentage')
+    # Percent for percentage and buy-X-get-Y (100 makes the Y units free);
+    # an amount per unit, or per cart for cart-wide rules, for fixed.
+    value = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
+    buy_quantity = models.PositiveIntegerField(default=0)
+    get_quantity = models.PositiveIntegerField(default=0)
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    products = models.ManyToManyField(Product, blank=True, related_name='promotions')
+    categories = models.ManyToManyField(Category, blank=True, related_name='promotions')
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.code})" if self.code else self.name
+
+    def clean(self):
+        if self.kind == 'buy_x_get_y' and not (self.buy_quantity and self.get_quantity):
+            raise ValidationError('Buy X get Y promotions need both quantities.')
+        if self.kind != 'fixed' and self.value > 100:
+            raise ValidationError({'value': 'A percentage cannot be more than 100.'})
+
+
+class Task(models.Model):
+    """A queued background job, run by the ``run_tasks`` worker."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_at']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class CatalogChange(models.Model):
+    """One entry in the append-only catalog change log; the id is the feed cursor."""
+    ACTION_CHOICES = [
+        ('upsert', 'Created or updated'),
+        ('delete', 'Deleted'),
+    ]
+    MODEL_CHOICES = [
+        ('category', 'Category'),
+        ('product', 'Product'),
+        ('productimage', 'Product image'),
+    ]
+
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['model', 'id']),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.action} {self.model} {self.object_id}"
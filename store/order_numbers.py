@@ -0,0 +1,89 @@
+"""
+Order number allocation.
+
+Each worker process reserves a block of values from ``OrderNumberSequence``
+with a single UPDATE and hands numbers out of that block from memory, so
+numbers are unique across processes, increase within a process and cost one
+database write per ``ORDER_NUMBER_BLOCK_SIZE`` orders.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from ecommerce_app.db.writes import write_transaction
+
+from .models import OrderNumberSequence
+
+ORDER_NUMBER_PREFIX = 'ORD-'
+ORDER_NUMBER_DIGITS = 10
+DEFAULT_SEQUENCE = 'order'
+
+
+def format_order_number(value):
+    return f"{ORDER_NUMBER_PREFIX}{value:0{ORDER_NUMBER_DIGITS}d}"
+
+
+class OrderNumberAllocator:
+    def __init__(self, sequence=DEFAULT_SEQUENCE, block_size=None):
+        self.sequence = sequence
+        self.block_size = block_size
+        self.reset()
+
+    def reset(self):
+        """Forget the cached block (called in forked children, which must not share it)."""
+        self._lock = threading.Lock()
+        self._next = 0
+        self._limit = 0
+
+    def get_block_size(self):
+        return self.block_size or getattr(settings, 'ORDER_NUMBER_BLOCK_SIZE', 20)
+
+    def next_value(self):
+        with self._lock:
+            if self._next < self._limit:
+                value = self._next
+                self._next += 1
+                return value
+
+        in_transaction = transaction.get_connection().in_atomic_block
+        start, stop = self._reserve_block()
+        if in_transaction:
+            # The reservation only becomes durable when the caller's
+            # transaction commits; if it rolls back, another process may
+            # be handed the same block, so the rest of it is only cached
+            # once the commit has happened.
+            transaction.on_commit(lambda: self._publish(start + 1, stop))
+        else:
+            self._publish(start + 1, stop)
+        return start
+
+    def next_order_number(self):
+        return format_order_number(self.next_value())
+
+    def _reserve_block(self):
+        size = self.get_block_size()
+        with write_transaction():
+            OrderNumberSequence.objects.get_or_create(name=self.sequence)
+            sequence = OrderNumberSequence.objects.filter(name=self.sequence)
+            sequence.update(next_value=F('next_value') + size)
+            stop = sequence.values_list('next_value', flat=True).get()
+        return stop - size, stop
+
+    def _publish(self, start, stop):
+        with self._lock:
+            if self._next >= self._limit:
+                self._next = start
+                self._limit = stop
+
+
+allocator = OrderNumberAllocator()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=allocator.reset)
+
+
+def generate_order_number():
+    return allocator.next_order_number()
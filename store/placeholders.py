@@ -0,0 +1,147 @@
+"""
+Low-quality image placeholders.
+
+Every product image gets a dominant colour and a ~20px JPEG data URI, stored
+on the row so templates can paint something immediately and lazy-load the
+real file. Placeholders are computed after the upload's transaction commits,
+in batches on a single background thread, so saving a product never waits
+on image decoding; ``backfill_placeholders`` fills in existing rows.
+"""
+import base64
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_QUALITY = 50
+PALETTE_SIZE = 8
+
+
+def get_placeholder_size():
+    return getattr(settings, 'PLACEHOLDER_SIZE', 20)
+
+
+def compute_placeholder(file):
+    """Return ``(colour, data_uri)`` for an open image file."""
+    from PIL import Image, ImageOps
+
+    size = get_placeholder_size()
+    with Image.open(file) as img:
+        # Lets the JPEG decoder downscale while decoding instead of after.
+        img.draft('RGB', (size * 4, size * 4))
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        img.thumbnail((size, size))
+
+    # Dominant colour: the most common entry of a small adaptive palette,
+    # which survives busy backgrounds better than a plain average.
+    quantized = img.quantize(colors=PALETTE_SIZE)
+    _, index = max(quantized.getcolors())
+    palette = quantized.getpalette()
+    colour = '#{:02x}{:02x}{:02x}'.format(*palette[index * 3:index * 3 + 3])
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+    data_uri = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return colour, data_uri
+
+
+def update_placeholders(model, pks):
+    """Compute and store placeholders for ``pks``; returns how many were written."""
+    written = 0
+    for obj in model.objects.filter(pk__in=pks).only('pk', 'image'):
+        if not obj.image:
+            continue
+        try:
+            with obj.image.open('rb') as f:
+                colour, data_uri = compute_placeholder(f)
+        except (OSError, ValueError, SyntaxError) as exc:
+            # Pillow reports truncated/corrupt files with any of these.
+            logger.warning('Could not build a placeholder for %s %s: %s', model.__name__, obj.pk, exc)
+            continue
+        # A queryset update skips save() and the signals, so it cannot
+        # reschedule itself or bump updated_at.
+        model.objects.filter(pk=obj.pk, image=obj.image.name).update(
+            placeholder_color=colour, placeholder_uri=data_uri,
+        )
+        written += 1
+    return written
+
+
+class PlaceholderQueue:
+    """Rows whose image changed, drained in batches by one background worker."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Drop pending work and the executor (called in forked children, which must not share them)."""
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._draining = False
+        self._executor = None
+
+    def add(self, model, pk):
+        # Only committed rows are visible to the worker's own connection.
+        transaction.on_commit(lambda: self._enqueue(model, pk))
+
+    def _enqueue(self, model, pk):
+        with self._lock:
+            self._pending.setdefault(model, set()).add(pk)
+            if self._draining:
+                return
+            self._draining = True
+        if getattr(settings, 'PLACEHOLDER_BACKGROUND', True):
+            self._get_executor().submit(self._drain)
+        else:
+            self._drain(close_connections=False)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='placeholders')
+            return self._executor
+
+    def _drain(self, close_connections=True):
+        try:
+            while True:
+                with self._lock:
+                    batch, self._pending = self._pending, {}
+                    if not batch:
+                        self._draining = False
+                        return
+                for model, pks in batch.items():
+                    try:
+                        update_placeholders(model, pks)
+                    except Exception:
+                        logger.exception('Placeholder batch for %s failed', model.__name__)
+        finally:
+            if close_connections:
+                # The worker thread's connection would otherwise stay open for good.
+                connection.close()
+
+
+queue = PlaceholderQueue()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=queue.reset)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def schedule_placeholder(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    loaded_image = getattr(instance, '_loaded_image', None)
+    if instance.image and (created or loaded_image != instance.image.name):
+        queue.add(sender, instance.pk)
+    instance._loaded_image = instance.image.name
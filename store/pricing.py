@@ -0,0 +1,150 @@
+"""
+Cart and order pricing.
+
+Every amount is a Decimal rounded to the cent. A cart's breakdown is computed
+once per cart version and cached: the version is the cart's ``updated_at``,
+which moves whenever one of its items or its coupon changes or a product in
+it is repriced, plus the promotion index's ``cache_token()``. The cart page,
+checkout, the cart JSON endpoints and ``Order.total_amount`` all read the
+same breakdown. Promotions come off the subtotal before shipping and tax.
+"""
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+from .promotions import NO_DISCOUNT, Discount, promotion_index
+
+SHIPPING_COST = Decimal('9.99')
+FREE_SHIPPING_THRESHOLD = Decimal('50.00')
+TAX_RATE = Decimal('0.08')
+CENTS = Decimal('0.01')
+CACHE_TIMEOUT = 60 * 60
+
+
+def to_cents(amount):
+    return Decimal(amount).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+@dataclass(frozen=True)
+class PriceBreakdown:
+    item_count: int
+    subtotal: Decimal
+    shipping: Decimal
+    tax: Decimal
+    total: Decimal
+    discount: Decimal = Decimal('0.00')
+    promotions: tuple = ()
+
+    @property
+    def free_shipping(self):
+        return self.item_count > 0 and self.shipping == 0
+
+    @property
+    def amount_to_free_shipping(self):
+        return max(FREE_SHIPPING_THRESHOLD - (self.subtotal - self.discount), Decimal('0.00'))
+
+    def as_dict(self):
+        return {
+            'item_count': self.item_count,
+            'subtotal': str(self.subtotal),
+            'discount': str(self.discount),
+            'promotions': list(self.promotions),
+            'shipping': str(self.shipping),
+            'tax': str(self.tax),
+            'total': str(self.total),
+            'free_shipping': self.free_shipping,
+            'amount_to_free_shipping': str(self.amount_to_free_shipping),
+        }
+
+
+def calculate_breakdown(lines, discount=NO_DISCOUNT):
+    """
+    Price ``(quantity, unit_price)`` pairs less ``discount``: tax is charged
+    on the discounted subtotal, not on shipping.
+    """
+    item_count = 0
+    subtotal = Decimal('0.00')
+    for quantity, unit_price in lines:
+        item_count += quantity
+        subtotal += quantity * unit_price
+    subtotal = to_cents(subtotal)
+    discount_amount = min(to_cents(discount.amount), subtotal)
+    discounted = subtotal - discount_amount
+    if item_count == 0 or discounted >= FREE_SHIPPING_THRESHOLD:
+        shipping = Decimal('0.00')
+    else:
+        shipping = SHIPPING_COST
+    tax = to_cents(discounted * TAX_RATE)
+    return PriceBreakdown(
+        item_count, subtotal, shipping, tax, discounted + shipping + tax, discount_amount, discount.promotions,
+    )
+
+
+EMPTY_BREAKDOWN = calculate_breakdown([])
+
+
+def get_cart_pricing(cart):
+    """The breakdown for ``cart``, memoized on the instance and cached per cart version."""
+    if cart is None or cart.pk is None:
+        return EMPTY_BREAKDOWN
+    memo = getattr(cart, '_pricing', None)
+    if memo is not None:
+        return memo
+
+    # The stored updated_at is authoritative: item changes touch it with a
+    # queryset update, which the in-memory instance never sees.
+    version = Cart.objects.filter(pk=cart.pk).values_list('updated_at', 'coupon_code').first()
+    if version is None:
+        return EMPTY_BREAKDOWN
+    updated_at, coupon_code = version
+    key = f'cart-pricing:{cart.pk}:{updated_at.timestamp()}:{promotion_index.cache_token()}'
+    breakdown = cache.get(key)
+    if breakdown is None:
+        breakdown = price_cart(cart, coupon_code)
+        cache.set(key, breakdown, CACHE_TIMEOUT)
+    cart._pricing = breakdown
+    return breakdown
+
+
+def price_cart(cart, coupon_code):
+    """The breakdown for ``cart`` straight from the database, with promotions applied."""
+    lines = cart.items.values_list('quantity', 'product__price', 'product_id', 'product__category_id')
+    return price_lines(lines, coupon_code)
+
+
+def price_lines(lines, coupon_code):
+    """The breakdown for ``(quantity, unit_price, product_id, category_id)`` lines, with promotions applied."""
+    lines = list(lines)
+    discount = promotion_index.evaluate(lines, coupon_code)
+    return calculate_breakdown([(quantity, price) for quantity, price, _, _ in lines], discount)
+
+
+def get_order_pricing(order):
+    # The discount was fixed when the order was placed; today's promotions don't apply.
+    promotions = (order.coupon_code,) if order.coupon_code else ()
+    return calculate_breakdown(
+        order.items.values_list('quantity', 'price'), Discount(order.discount_amount, promotions),
+    )
+
+
+def touch_carts(**filters):
+    Cart.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def touch_cart_on_item_change(sender, instance, **kwargs):
+    touch_carts(pk=instance.cart_id)
+
+
+@receiver(post_save, sender=Product)
+def touch_carts_on_price_change(sender, instance, created, **kwargs):
+    loaded_price = getattr(instance, '_loaded_price', None)
+    if not created and loaded_price is not None and loaded_price != instance.price:
+        touch_carts(items__product=instance)
+    instance._loaded_price = instance.price
@@ -0,0 +1,246 @@
+"""
+Promotion engine.
+
+Live promotions are compiled into an in-process ``PromotionIndex``: rules
+keyed by product id and by category id (a category rule is filed under every
+category in its subtree), rules for every line, cart-wide rules, and coupons
+by code. Evaluating a cart is then a few dictionary lookups per line,
+however many promotions are running, and no queries.
+
+Stacking: each line gets its single best line promotion, then the best
+cart-wide promotion is taken off what is left. A coupon only competes once
+its code has been entered.
+
+Saving or deleting a promotion, or changing the category tree, marks this
+worker's index stale and bumps a version in the default cache that other
+workers check every ``PROMOTION_REFRESH_INTERVAL`` seconds. Start and end
+times need no refresh: they are checked on every evaluation, and
+``cache_token()`` changes as each one passes, so cached cart prices never
+outlive a promotion.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import PATH_STEP, Category, Promotion
+
+VERSION_KEY = 'promotions:version'
+ZERO = Decimal('0.00')
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+@dataclass(frozen=True)
+class Rule:
+    id: int
+    name: str
+    kind: str
+    value: Decimal
+    buy: int
+    get: int
+    min_subtotal: Decimal
+    code: str
+    starts_at: datetime = None
+    ends_at: datetime = None
+
+    def live(self, now, code, subtotal):
+        return (
+            (not self.code or self.code == code)
+            and (self.starts_at is None or self.starts_at <= now)
+            and (self.ends_at is None or now < self.ends_at)
+            and subtotal >= self.min_subtotal
+        )
+
+    def line_discount(self, quantity, unit_price):
+        if self.kind == 'percentage':
+            return quantity * unit_price * self.value / 100
+        if self.kind == 'fixed':
+            return min(self.value, unit_price) * quantity
+        free_units = quantity // (self.buy + self.get) * self.get
+        return free_units * unit_price * self.value / 100
+
+    def cart_discount(self, amount):
+        if self.kind == 'percentage':
+            return amount * self.value / 100
+        return min(self.value, amount)
+
+
+@dataclass(frozen=True)
+class Discount:
+    amount: Decimal
+    promotions: tuple
+
+
+NO_DISCOUNT = Discount(ZERO, ())
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    by_product: dict
+    by_category: dict
+    every_line: tuple
+    cart_wide: tuple
+    coupons: dict
+    boundaries: tuple
+
+
+def compile_rules(now=None):
+    now = now or timezone.now()
+    promotions = list(Promotion.objects.filter(is_active=True).exclude(ends_at__lte=now).order_by('pk'))
+    rules = {
+        promotion.pk: Rule(
+            promotion.pk, promotion.name, promotion.kind, promotion.value, promotion.buy_quantity,
+            promotion.get_quantity, promotion.min_subtotal, normalize_code(promotion.code),
+            promotion.starts_at, promotion.ends_at,
+        )
+        for promotion in promotions
+        # A buy-X-get-Y rule missing a quantity can't apply to anything.
+        if promotion.kind != 'buy_x_get_y' or (promotion.buy_quantity and promotion.get_quantity)
+    }
+    by_product, targeted_categories = defaultdict(list), defaultdict(list)
+    products = Promotion.products.through.objects.filter(promotion_id__in=rules)
+    for promotion_id, product_id in products.values_list('promotion_id', 'product_id'):
+        by_product[product_id].append(rules[promotion_id])
+    categories = Promotion.categories.through.objects.filter(promotion_id__in=rules)
+    for promotion_id, category_id in categories.values_list('promotion_id', 'category_id'):
+        targeted_categories[category_id].append(rules[promotion_id])
+
+    # File each category rule under the whole subtree: a category inherits
+    # the rules of every ancestor on its path.
+    by_category = {}
+    if targeted_categories:
+        for category_id, path in Category.objects.order_by().values_list('id', 'path'):
+            ancestry = [int(path[i:i + PATH_STEP]) for i in range(0, len(path), PATH_STEP)] or [category_id]
+            inherited = [rule for ancestor in ancestry for rule in targeted_categories.get(ancestor, ())]
+            if inherited:
+                by_category[category_id] = tuple(inherited)
+
+    targeted = {rule.id for rule in chain(*by_product.values(), *targeted_categories.values())}
+    untargeted = [rule for rule in rules.values() if rule.id not in targeted]
+    return CompiledRules(
+        by_product={product_id: tuple(found) for product_id, found in by_product.items()},
+        by_category=by_category,
+        every_line=tuple(rule for rule in untargeted if rule.kind == 'buy_x_get_y'),
+        cart_wide=tuple(rule for rule in untargeted if rule.kind != 'buy_x_get_y'),
+        coupons={rule.code: rule for rule in rules.values() if rule.code},
+        boundaries=tuple(sorted({moment for rule in rules.values() for moment in (rule.starts_at, rule.ends_at) if moment})),
+    )
+
+
+class PromotionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compiled = None
+        self._version = None
+        self._checked_at = 0.0
+        self._stale = True
+
+    def mark_stale(self):
+        self._stale = True
+
+    def current(self):
+        interval = getattr(settings, 'PROMOTION_REFRESH_INTERVAL', 5)
+        if not self._stale and time.monotonic() - self._checked_at < interval:
+            return self._compiled
+        with self._lock:
+            version = cache.get(VERSION_KEY, 0)
+            if self._stale or self._compiled is None or version != self._version:
+                # Cleared first so a change made while compiling marks it again.
+                self._stale = False
+                self._version = version
+                self._compiled = compile_rules()
+            self._checked_at = time.monotonic()
+        return self._compiled
+
+    def cache_token(self, now=None):
+        """Changes whenever the rules change or a promotion starts or ends."""
+        compiled = self.current()
+        return f'{self._version}.{bisect_right(compiled.boundaries, now or timezone.now())}'
+
+    def coupon(self, code, now=None):
+        """The live coupon rule for ``code``, else None (minimum spend is checked at evaluation)."""
+        code = normalize_code(code)
+        rule = self.current().coupons.get(code)
+        if rule is None or not rule.live(now or timezone.now(), code, rule.min_subtotal):
+            return None
+        return rule
+
+    def evaluate(self, lines, code='', now=None):
+        """
+        The discount for ``(quantity, unit_price, product_id, category_id)``
+        lines, with ``code`` as the entered coupon; amounts are unrounded.
+        """
+        compiled = self.current()
+        now = now or timezone.now()
+        code = normalize_code(code)
+        lines = list(lines)
+        subtotal = sum((quantity * unit_price for quantity, unit_price, _, _ in lines), ZERO)
+
+        total, applied = ZERO, {}
+        for quantity, unit_price, product_id, category_id in lines:
+            best, best_rule = ZERO, None
+            candidates = chain(
+                compiled.by_product.get(product_id, ()), compiled.by_category.get(category_id, ()), compiled.every_line,
+            )
+            for rule in candidates:
+                if rule.live(now, code, subtotal):
+                    amount = rule.line_discount(quantity, unit_price)
+                    if amount > best:
+                        best, best_rule = amount, rule
+            if best_rule is not None:
+                total += best
+                applied[best_rule.name] = None
+
+        remaining = subtotal - total
+        best, best_rule = ZERO, None
+        for rule in compiled.cart_wide:
+            if rule.live(now, code, subtotal):
+                amount = rule.cart_discount(remaining)
+                if amount > best:
+                    best, best_rule = amount, rule
+        if best_rule is not None:
+            total += best
+            applied[best_rule.name] = None
+        if not applied:
+            return NO_DISCOUNT
+        return Discount(min(total, subtotal), tuple(applied))
+
+
+promotion_index = PromotionIndex()
+
+
+def promotions_changed():
+    promotion_index.mark_stale()
+    if not cache.add(VERSION_KEY, 1, None):
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_promotions(sender, **kwargs):
+    promotions_changed()
+
+
+@receiver(m2m_changed, sender=Promotion.products.through)
+@receiver(m2m_changed, sender=Promotion.categories.through)
+def invalidate_promotion_targets(sender, action, **kwargs):
+    if action.startswith('post_'):
+        promotions_changed()
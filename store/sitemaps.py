@@ -0,0 +1,157 @@
+"""
+Precomputed XML sitemaps.
+
+``build_sitemaps`` writes static files into ``SITEMAP_ROOT``, which are
+served at ``/sitemap.xml`` (the index) and ``/sitemaps/<file>``:
+
+- one file for active categories;
+- one file per ``SITEMAP_CHUNK_SIZE`` block of product ids. Chunks are keyed
+  by id range, so a file never exceeds the 50,000-URL limit and a product
+  always stays in the same file.
+
+A manifest records each file's URL count and newest ``updated_at``. A run
+reads those figures for every chunk with one grouped query and rewrites only
+the chunks whose figures changed. Any edit, deactivation, insert or delete
+in a chunk changes one of them.
+"""
+import json
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, F, Max
+from django.urls import reverse
+
+from .models import Category, Product
+
+INDEX_NAME = 'sitemap.xml'
+MANIFEST_NAME = 'manifest.json'
+CATEGORIES_NAME = 'categories.xml'
+MAX_URLS = 50000
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def sitemap_root():
+    return str(getattr(settings, 'SITEMAP_ROOT', os.path.join(settings.BASE_DIR, 'sitemaps')))
+
+
+def chunk_size():
+    return min(getattr(settings, 'SITEMAP_CHUNK_SIZE', MAX_URLS), MAX_URLS)
+
+
+def absolute(path):
+    return getattr(settings, 'SITE_URL', '').rstrip('/') + path
+
+
+def w3c_date(value):
+    return value.isoformat(timespec='seconds')
+
+
+def write_atomic(path, content):
+    """Replace ``path`` in one step so crawlers never see a half-written file."""
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def urlset(entries):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<urlset xmlns="{XMLNS}">']
+    for location, lastmod in entries:
+        lines.append(f'<url><loc>{escape(absolute(location))}</loc><lastmod>{w3c_date(lastmod)}</lastmod></url>')
+    lines.append('</urlset>')
+    return '\n'.join(lines) + '\n'
+
+
+def sitemap_index(files):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<sitemapindex xmlns="{XMLNS}">']
+    for name, entry in sorted(files.items()):
+        location = escape(absolute(reverse('store:sitemap_file', args=[name])))
+        lines.append(f'<sitemap><loc>{location}</loc><lastmod>{entry["lastmod"]}</lastmod></sitemap>')
+    lines.append('</sitemapindex>')
+    return '\n'.join(lines) + '\n'
+
+
+def product_chunk_name(chunk):
+    return f'products-{chunk:05d}.xml'
+
+
+def product_chunk(chunk, size):
+    products = Product.objects.filter(is_active=True, pk__gt=chunk * size, pk__lte=(chunk + 1) * size)
+    rows = products.order_by('pk').values_list('slug', 'updated_at')
+    return urlset((reverse('store:product_detail', kwargs={'slug': slug}), updated) for slug, updated in rows)
+
+
+def category_file():
+    rows = Category.objects.filter(is_active=True).order_by('pk').values_list('slug', 'updated_at')
+    return urlset((reverse('store:category_products', kwargs={'slug': slug}), updated) for slug, updated in rows)
+
+
+def current_state(size):
+    """``{file name: {'count', 'lastmod'}}`` for every non-empty sitemap file, from two queries."""
+    state = {}
+    chunks = (
+        Product.objects.filter(is_active=True).order_by()
+        .annotate(chunk=(F('id') - 1) / size).values('chunk')
+        .annotate(count=Count('id'), lastmod=Max('updated_at'))
+    )
+    for row in chunks:
+        state[product_chunk_name(row['chunk'])] = {
+            'chunk': row['chunk'], 'count': row['count'], 'lastmod': row['lastmod'].isoformat(),
+        }
+    categories = Category.objects.filter(is_active=True).aggregate(count=Count('id'), lastmod=Max('updated_at'))
+    if categories['count']:
+        state[CATEGORIES_NAME] = {'count': categories['count'], 'lastmod': categories['lastmod'].isoformat()}
+    return state
+
+
+def load_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # A changed chunk size moves every product to a different file.
+    return manifest['files'] if manifest.get('chunk_size') == chunk_size() else {}
+
+
+def build_sitemaps(full=False):
+    """Bring ``SITEMAP_ROOT`` up to date; returns ``(written, removed, unchanged)`` file names."""
+    root = sitemap_root()
+    os.makedirs(root, exist_ok=True)
+    size = chunk_size()
+    previous = {} if full else load_manifest(root)
+    state = current_state(size)
+
+    written, unchanged = [], []
+    for name, entry in sorted(state.items()):
+        old = previous.get(name)
+        if (
+            old and (old['count'], old['lastmod']) == (entry['count'], entry['lastmod'])
+            and os.path.exists(os.path.join(root, name))
+        ):
+            unchanged.append(name)
+            continue
+        content = category_file() if name == CATEGORIES_NAME else product_chunk(entry['chunk'], size)
+        write_atomic(os.path.join(root, name), content)
+        written.append(name)
+
+    # Chunks that emptied out, or every chunk after a change of chunk size.
+    removed = sorted(
+        name for name in os.listdir(root)
+        if name not in state and (name == CATEGORIES_NAME or name.startswith('products-'))
+    )
+    for name in removed:
+        os.remove(os.path.join(root, name))
+
+    if written or removed or not os.path.exists(os.path.join(root, INDEX_NAME)):
+        write_atomic(os.path.join(root, INDEX_NAME), sitemap_index(state))
+    write_atomic(os.path.join(root, MANIFEST_NAME), json.dumps({'chunk_size': size, 'files': state}, indent=1))
+    return written, removed, unchanged
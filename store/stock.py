@@ -0,0 +1,117 @@
+"""
+Bulk stock lookups for polling widgets.
+
+``StockLookup.get()`` answers for many product ids and slugs at once. Rows
+are cached per id and per slug for ``STOCK_CACHE_TTL`` seconds, and misses
+are fetched with a single query on the primary key and slug indexes. Misses
+are coalesced: while one thread is reading a key from the database, other
+threads asking for it wait for that read instead of issuing their own, so a
+hot product costs each worker one query per TTL window however many
+clients poll it. Saving a product drops its entries straight away.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product
+
+MAX_LOOKUP = 100
+# Every id this long fits in SQLite's 64-bit INTEGER.
+MAX_ID_DIGITS = 18
+# Cached for ids and slugs that match no active product, so unknown keys are
+# not re-queried on every poll either.
+NOT_FOUND = 0
+
+
+def cache_key(kind, value):
+    return f'stock:{kind}:{value}'
+
+
+def parse_ids(values):
+    """``values`` as distinct ints, or None unless each is a plain ASCII decimal id."""
+    # str.isdigit() alone also accepts digits like '²' that int() rejects.
+    if not all(value.isascii() and value.isdigit() and len(value) <= MAX_ID_DIGITS for value in values):
+        return None
+    return list(dict.fromkeys(int(value) for value in values))
+
+
+class StockLookup:
+    def __init__(self, cache_alias='default'):
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'STOCK_CACHE_TTL', 2)
+
+    def get(self, ids=(), slugs=()):
+        """Map ``cache_key(kind, value)`` to ``{'id', 'slug', 'stock'}``, or None if unknown."""
+        keys = [cache_key('id', pk) for pk in ids] + [cache_key('slug', slug) for slug in slugs]
+        found = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            found.update(self._load(missing))
+        return {key: found.get(key) or None for key in keys}
+
+    def _load(self, keys):
+        with self._lock:
+            mine = [key for key in keys if key not in self._inflight]
+            waiting = {key: self._inflight[key] for key in keys if key not in mine}
+            for key in mine:
+                self._inflight[key] = threading.Event()
+        loaded = {}
+        if mine:
+            try:
+                loaded = self._fetch(mine)
+                self.cache.set_many(loaded, self.ttl)
+            finally:
+                with self._lock:
+                    for key in mine:
+                        self._inflight.pop(key).set()
+        if waiting:
+            for event in waiting.values():
+                event.wait(timeout=5)
+            loaded.update(self.cache.get_many(list(waiting)))
+            # The leader failed or the entry was evicted already; read it ourselves.
+            leftover = [key for key in waiting if key not in loaded]
+            if leftover:
+                loaded.update(self._fetch(leftover))
+        return loaded
+
+    def _fetch(self, keys):
+        ids, slugs = set(), set()
+        for key in keys:
+            _, kind, value = key.split(':', 2)
+            if kind == 'id':
+                ids.add(int(value))
+            else:
+                slugs.add(value)
+        rows = Product.objects.filter(Q(pk__in=ids) | Q(slug__in=slugs), is_active=True).order_by()
+        rows = rows.values('id', 'slug', 'stock')
+        loaded = dict.fromkeys(keys, NOT_FOUND)
+        for row in rows:
+            # Cache under both names so a later lookup by the other one hits.
+            loaded[cache_key('id', row['id'])] = row
+            loaded[cache_key('slug', row['slug'])] = row
+        return loaded
+
+    def invalidate(self, product):
+        self.cache.delete_many([cache_key('id', product.pk), cache_key('slug', product.slug)])
+
+
+stock_lookup = StockLookup()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_stock(sender, instance, **kwargs):
+    stock_lookup.invalidate(instance)
@@ -0,0 +1,198 @@
+"""
+Concurrency stress run for cart and checkout.
+
+``run_stress`` creates a few hot products with little stock and one shopper
+per worker, then has every worker add hot products to its cart and check out
+as fast as it can. Requests go through the real views with the test client,
+so middleware, the write queue and the checkout limiter all take part; with
+``processes`` above one, workers also contend across processes, where only
+the database itself orders their writes.
+
+Afterwards the database must show:
+
+- no product with negative stock;
+- for each product, units in order items equal to the stock taken out;
+- no order number used twice.
+
+Run it with ``manage.py stress_checkout``; the tests run a small version.
+"""
+import multiprocessing
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import OperationalError, connections
+from django.db.models import Count, Sum
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from .models import Category, Order, OrderItem, Product
+
+PREFIX = 'stress'
+CHECKOUT_FORM = {
+    'first_name': 'Stress', 'last_name': 'Test', 'email': 'stress@example.com', 'phone': '555-0100',
+    'address_line_1': '1 Load Street', 'city': 'Testville', 'state': 'TS', 'postal_code': '00000', 'country': 'US',
+}
+BUSY_STATUSES = (429, 503)
+
+
+@dataclass
+class StressResult:
+    outcomes: Counter
+    elapsed: float
+    violations: list = field(default_factory=list)
+
+    @property
+    def requests(self):
+        return sum(self.outcomes.values())
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0
+
+    @property
+    def orders_per_second(self):
+        return self.outcomes['ordered'] / self.elapsed if self.elapsed else 0
+
+
+def create_fixtures(workers, skus, stock):
+    category = Category.objects.create(name='Stress test', slug=f'{PREFIX}-category')
+    products = [
+        Product.objects.create(
+            name=f'Stress SKU {n}', slug=f'{PREFIX}-sku-{n}', category=category,
+            description='Stress test product', price='10.00', stock=stock,
+        )
+        for n in range(skus)
+    ]
+    users = [User.objects.create_user(username=f'{PREFIX}-{n}') for n in range(workers)]
+    return products, users
+
+
+def remove_fixtures():
+    # Orders, carts and their items cascade from the users and products.
+    User.objects.filter(username__startswith=f'{PREFIX}-').delete()
+    Product.objects.filter(slug__startswith=f'{PREFIX}-sku-').delete()
+    Category.objects.filter(slug=f'{PREFIX}-category').delete()
+
+
+def classify_add(response):
+    if response.status_code in BUSY_STATUSES:
+        return 'busy'
+    data = response.json()
+    if data['success']:
+        return 'added'
+    message = data.get('message', '')
+    if 'stock' in message:
+        return 'out_of_stock'
+    if 'busy' in message:
+        return 'busy'
+    return 'error'
+
+
+def worker(user, product_ids, iterations, seed, outcomes, lock):
+    client = Client()
+    client.force_login(user)
+    rng = random.Random(seed)
+    add_url, checkout_url = reverse('store:add_to_cart'), reverse('store:checkout')
+    confirmation_prefix = reverse('store:order_confirmation', args=['x'])[:-2]
+    local = Counter()
+    for _ in range(iterations):
+        body = {'product_id': rng.choice(product_ids), 'quantity': rng.randint(1, 2)}
+        try:
+            local[classify_add(client.post(add_url, body, content_type='application/json'))] += 1
+            response = client.post(checkout_url, CHECKOUT_FORM)
+            if response.status_code == 302 and response['Location'].startswith(confirmation_prefix):
+                local['ordered'] += 1
+            elif response.status_code == 302:
+                local['checkout_failed'] += 1
+            elif response.status_code in BUSY_STATUSES:
+                local['busy'] += 1
+            else:
+                local['error'] += 1
+        except OperationalError:
+            # SQLite gave up waiting for the write lock.
+            local['locked'] += 1
+    connections.close_all()
+    with lock:
+        outcomes.update(local)
+
+
+def run_threads(users, product_ids, iterations, seed):
+    outcomes, lock = Counter(), threading.Lock()
+    threads = [
+        threading.Thread(target=worker, args=(user, product_ids, iterations, seed + n, outcomes, lock))
+        for n, user in enumerate(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def run_process(users, product_ids, iterations, seed, results):
+    results.put(dict(run_threads(users, product_ids, iterations, seed)))
+
+
+def check_invariants(products, stock):
+    violations = []
+    sold = dict(
+        OrderItem.objects.filter(product__in=products).order_by().values('product')
+        .annotate(units=Sum('quantity')).values_list('product', 'units')
+    )
+    for product in Product.objects.filter(pk__in=[product.pk for product in products]):
+        if product.stock < 0:
+            violations.append(f'{product.slug}: negative stock {product.stock}')
+        units = sold.get(product.pk, 0)
+        if stock - product.stock != units:
+            violations.append(f'{product.slug}: stock fell by {stock - product.stock} but {units} units were sold')
+    duplicates = Order.objects.values('order_number').annotate(n=Count('id')).filter(n__gt=1)
+    for row in duplicates:
+        violations.append(f"order number {row['order_number']} used {row['n']} times")
+    return violations
+
+
+def run_stress(threads=8, processes=1, iterations=20, skus=3, stock=50, seed=0, keep=False):
+    """Run the stress workload and return a ``StressResult``; fixtures are removed unless ``keep``."""
+    remove_fixtures()
+    products, users = create_fixtures(threads * processes, skus, stock)
+    product_ids = [product.pk for product in products]
+    overrides = override_settings(
+        RATELIMIT_ENABLED=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+    )
+    overrides.enable()
+    try:
+        started = time.perf_counter()
+        if processes == 1:
+            outcomes = run_threads(users, product_ids, iterations, seed)
+        else:
+            # Children must open their own database connections.
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            children = [
+                context.Process(
+                    target=run_process,
+                    args=(users[n * threads:(n + 1) * threads], product_ids, iterations, seed + n * threads, results),
+                )
+                for n in range(processes)
+            ]
+            for child in children:
+                child.start()
+            outcomes = Counter()
+            for _ in children:
+                outcomes.update(results.get())
+            for child in children:
+                child.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        overrides.disable()
+
+    result = StressResult(outcomes, elapsed, check_invariants(products, stock))
+    if not keep:
+        remove_fixtures()
+    return result
@@ -0,0 +1,119 @@
+"""
+Database-backed task queue.
+
+``enqueue()`` writes a ``Task`` row; called inside a transaction (as checkout
+does) the job is committed atomically with the data it refers to, so it can
+neither be lost nor run against rows that were rolled back. The
+``run_tasks`` worker claims due tasks in batches by stamping them with its
+token and a lease. A task whose worker dies is claimed again once the lease
+expires, so delivery is at-least-once: jobs must tolerate running twice.
+Failures are retried with exponential backoff up to ``max_attempts``.
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+def task(func):
+    """Mark ``func`` as runnable by the worker; arguments must be JSON-serializable."""
+    func.is_task = True
+    return func
+
+
+def task_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, args=(), kwargs=None, delay=None, max_attempts=None):
+    if not getattr(func, 'is_task', False):
+        raise ValueError(f'{task_name(func)} is not decorated with @task')
+    return Task.objects.create(
+        name=task_name(func),
+        args=list(args),
+        kwargs=kwargs or {},
+        run_at=timezone.now() + (delay or timedelta()),
+        max_attempts=max_attempts or getattr(settings, 'TASK_MAX_ATTEMPTS', 5),
+    )
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'TASK_RETRY_BASE_DELAY', 10)
+    ceiling = getattr(settings, 'TASK_RETRY_MAX_DELAY', 60 * 60)
+    # Full jitter keeps retries of a failed batch from arriving together.
+    return timedelta(seconds=random.uniform(0.5, 1) * min(ceiling, base * 2 ** (attempts - 1)))
+
+
+class Worker:
+    def __init__(self, batch_size=10, lease_seconds=None):
+        self.batch_size = batch_size
+        self.lease = timedelta(seconds=lease_seconds or getattr(settings, 'TASK_LEASE_SECONDS', 300))
+        self.token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def claim(self):
+        now = timezone.now()
+        due = Q(status='pending', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+        candidates = list(Task.objects.filter(due).order_by('run_at').values_list('pk', flat=True)[:self.batch_size])
+        if not candidates:
+            return []
+        # The due condition is repeated in the UPDATE, so a task another
+        # worker claimed in the meantime is left alone.
+        Task.objects.filter(due, pk__in=candidates).update(
+            status='running', locked_by=self.token, locked_until=now + self.lease,
+            attempts=F('attempts') + 1, updated_at=now,
+        )
+        return list(Task.objects.filter(pk__in=candidates, status='running', locked_by=self.token))
+
+    def run(self, task_row):
+        """Run one claimed task and record the outcome; returns True on success."""
+        try:
+            func = import_string(task_row.name)
+            if not getattr(func, 'is_task', False):
+                raise ImportError(f'{task_row.name} is not a task')
+            func(*task_row.args, **task_row.kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            now = timezone.now()
+            mine = Task.objects.filter(pk=task_row.pk, locked_by=self.token)
+            if task_row.attempts >= task_row.max_attempts:
+                logger.error('Task %s (%s) failed permanently:\n%s', task_row.pk, task_row.name, error)
+                mine.update(status='failed', locked_until=None, last_error=error, updated_at=now)
+            else:
+                logger.warning('Task %s (%s) failed, will retry:\n%s', task_row.pk, task_row.name, error)
+                mine.update(
+                    status='pending', locked_until=None, last_error=error, updated_at=now,
+                    run_at=now + retry_delay(task_row.attempts),
+                )
+            return False
+        Task.objects.filter(pk=task_row.pk, locked_by=self.token).update(
+            status='done', locked_until=None, updated_at=timezone.now(),
+        )
+        return True
+
+    def run_batch(self):
+        """Claim and run one batch; returns ``(succeeded, failed)``."""
+        succeeded = failed = 0
+        for task_row in self.claim():
+            if self.run(task_row):
+                succeeded += 1
+            else:
+                failed += 1
+        return succeeded, failed
+
+
+def purge_finished(older_than):
+    """Delete completed tasks last touched before ``older_than``."""
+    deleted, _ = Task.objects.filter(status='done', updated_at__lt=older_than).delete()
+    return deleted
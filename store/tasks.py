@@ -0,0 +1,45 @@
+"""
+Background jobs enqueued by the store, run by ``manage.py run_tasks``.
+
+Delivery is at-least-once, so every job checks whether its work is already
+done before doing it.
+"""
+import logging
+
+from django.conf import settings
+from django.core.mail import mail_admins, send_mail
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Order, Product
+from .pricing import get_order_pricing
+from .task_queue import task
+
+logger = logging.getLogger(__name__)
+
+
+@task
+def send_order_confirmation(order_id):
+    order = Order.objects.filter(pk=order_id, confirmation_sent_at__isnull=True).first()
+    if order is None:
+        return
+    context = {
+        'order': order,
+        'items': order.items.select_related('product'),
+        'pricing': get_order_pricing(order),
+    }
+    subject = render_to_string('store/emails/order_confirmation_subject.txt', context).strip()
+    body = render_to_string('store/emails/order_confirmation.txt', context)
+    send_mail(subject, body, None, [order.email])
+    Order.objects.filter(pk=order_id).update(confirmation_sent_at=timezone.now())
+
+
+@task
+def check_low_stock(product_ids):
+    threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', 5)
+    low = list(Product.objects.filter(pk__in=product_ids, stock__lte=threshold).order_by('stock'))
+    if not low:
+        return
+    lines = [f'{product.name} ({product.slug}): {product.stock} left' for product in low]
+    logger.warning('Low stock: %s', '; '.join(lines))
+    mail_admins(f'Low stock on {len(low)} product(s)', '\n'.join(lines))
@@ -35,3 +35,14 @@ def mul(value, arg):
         return float(value) * float(arg)
     except (ValueError, TypeError):
         return value
+
+
+@register.filter
+def placeholder_style(obj):
+    """Inline style painting an image's placeholder until the real file loads"""
+    if not getattr(obj, 'placeholder_color', ''):
+        return ''
+    style = f'background-color: {obj.placeholder_color};'
+    if obj.placeholder_uri:
+        style += f" background-image: url('{obj.placeholder_uri}'); background-size: cover;"
+    return style
@@ -1,9 +1,68 @@
-from django.test import TestCase, Client
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
+from unittest import skipUnless
 from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.contrib.sessions.models import Session
 from django.urls import reverse
+from django.http import Http404
 from django.utils.text import slugify
 from decimal import Decimal
-from .models import Category, Product, Cart, CartItem, Order, OrderItem
+from unittest import mock
+import functools
+import importlib.util
+import json
+import io
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from django.core.cache import caches
+from django.core import mail
+from django.utils import timezone
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import F, ProtectedError
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from ecommerce_app.media import serve_media
+from ecommerce_app.db.writes import DatabaseBusy, WriteQueue, serialized_write, write_transaction
+from ecommerce_app.db.query_plans import QueryPlan, capture_plans, plan_problems
+from ecommerce_app.throttling import (
+    OVERLOADED_MESSAGE, RATE_LIMITED_MESSAGE, ConcurrencyLimiter, TokenBucket, checkout_limiter,
+)
+from ecommerce_app.db.routers import PIN_COOKIE_NAME, PrimaryReplicaRouter, _pinned
+from ecommerce_app import profiling
+from .models import ArchivedOrder, CatalogChange, Category, Product, Cart, CartItem, Order, OrderItem, Promotion, Task
+from . import api
+from .autocomplete import RANK_SCAN_LIMIT, AutocompleteIndex, autocomplete_index
+from . import catalog_index
+from .catalog_index import CatalogIndex
+from .categories import TreeError, rebuild_tree, subtree_counts, subtree_ids
+from .changes import record_changes
+from .fulfillment import transition_orders
+from .inventory import OutOfStock, add_to_cart, reserve_stock
+from .listing import filter_products
+from .templatetags.custom_filters import placeholder_style
+from .warmup import template_names, warm_up
+from .pricing import calculate_breakdown, get_cart_pricing, get_order_pricing
+from .promotions import promotion_index
+from .sitemaps import build_sitemaps, product_chunk_name
+from .stock import StockLookup, cache_key
+from .order_numbers import OrderNumberAllocator, generate_order_number
+from .task_queue import Worker, enqueue, task
+from .tasks import send_order_confirmation
+
+
+@task
+def failing_task(message):
+    raise RuntimeError(message)
 
 
 class CategoryModelTest(TestCase):
@@ -139,6 +198,16 @@ class ProductViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Test Product')
 
+    def test_pagination_links_keep_the_search_intact(self):
+        for number in range(13):
+            Product.objects.create(
+                name=f'Rock & Roll {number}', slug=f'rock-roll-{number}', category=self.category,
+                description='A record', price=Decimal('9.99'), stock=1,
+            )
+        for url in (reverse('store:product_list'), reverse('store:category_products', args=[self.category.slug])):
+            response = self.client.get(url, {'search': 'Rock & Roll'})
+            self.assertContains(response, '?search=Rock%20%26%20Roll&')
+
 
 class CartViewTest(TestCase):
     def setUp(self):
@@ -181,6 +250,1640 @@ class CartViewTest(TestCase):
         self.assertFalse(data['success'])
 
 
+class OrderNumberTest(TestCase):
+    def test_generated_numbers_are_unique_and_increasing(self):
+        numbers = [generate_order_number() for _ in range(5)]
+        self.assertEqual(numbers, sorted(set(numbers)))
+        self.assertTrue(all(n.startswith('ORD-') and len(n) <= 20 for n in numbers))
+
+    def test_checkout_uses_sequence(self):
+        user = User.objects.create_user(username='buyer', password='testpass123')
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        product = Product.objects.create(
+            name='Test Product',
+            slug='test-product',
+            category=category,
+            description='Test product description',
+            price=Decimal('29.99'),
+            stock=10
+        )
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=product, quantity=1)
+        self.client.login(username='buyer', password='testpass123')
+        self.client.post(reverse('store:checkout'), {
+            'first_name': 'Test', 'last_name': 'Buyer', 'email': 'buyer@example.com',
+            'phone': '123', 'address_line_1': '1 Street', 'city': 'City',
+            'state': 'State', 'postal_code': '12345', 'country': 'US',
+        })
+        order = Order.objects.get(user=user)
+        self.assertRegex(order.order_number, r'^ORD-\d{10}$')
+
+
+class OrderNumberAllocatorTest(TransactionTestCase):
+    def test_workers_get_disjoint_blocks(self):
+        first = OrderNumberAllocator(block_size=3)
+        second = OrderNumberAllocator(block_size=3)
+        values = [first.next_value(), second.next_value(), first.next_value(), second.next_value()]
+        self.assertEqual(values, [1, 4, 2, 5])
+        # A third allocator starts after both reserved blocks.
+        self.assertEqual(OrderNumberAllocator(block_size=3).next_value(), 7)
+
+
+@override_settings(DATABASE_REPLICA_ALIASES=['replica_1', 'replica_2'])
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.token = _pinned.set(False)
+
+    def tearDown(self):
+        _pinned.reset(self.token)
+
+    def test_catalog_reads_go_to_replicas(self):
+        self.assertIn(self.router.db_for_read(Product), ['replica_1', 'replica_2'])
+        self.assertIn(self.router.db_for_read(Category), ['replica_1', 'replica_2'])
+
+    def test_cart_and_order_reads_stay_on_primary(self):
+        self.assertEqual(self.router.db_for_read(Cart), 'default')
+        self.assertEqual(self.router.db_for_read(Order), 'default')
+
+    def test_reads_after_a_write_stay_on_primary(self):
+        self.assertEqual(self.router.db_for_write(CartItem), 'default')
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_replicas_are_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica_1', 'store'))
+        self.assertIsNone(self.router.allow_migrate('default', 'store'))
+
+
+# The test database doubles as the only "replica" so requests can run end to end.
+@override_settings(DATABASE_REPLICA_ALIASES=['default'])
+class ReplicaPinningMiddlewareTest(TestCase):
+    def test_cart_mutation_sets_pin_cookie(self):
+        User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.post(
+            reverse('store:update_cart_item'),
+            data={'item_id': 0, 'quantity': 1},
+            content_type='application/json'
+        )
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+
+    def test_catalog_browsing_does_not_pin(self):
+        response = self.client.get(reverse('store:product_list'))
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+
+
+class SQLiteConnectionTest(TestCase):
+    def test_pragmas_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_busy_database_degrades_gracefully(self):
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        category = Category.objects.create(name='Test Category', slug='test-category')
+        product = Product.objects.create(
+            name='Test Product', slug='test-product', category=category,
+            description='Test product description', price=Decimal('29.99'), stock=10
+        )
+        self.client.login(username='testuser', password='testpass123')
+        with mock.patch('store.views.serialized_write', side_effect=DatabaseBusy):
+            response = self.client.post(
+                reverse('store:add_to_cart'),
+                data={'product_id': product.id, 'quantity': 1},
+                content_type='application/json'
+            )
+        data = response.json()
+        self.assertFalse(data['success'])
+        self.assertIn('busy', data['message'])
+        self.assertFalse(CartItem.objects.exists())
+
+
+class SQLiteTransactionModeTest(TransactionTestCase):
+    def begins(self, block):
+        with CaptureQueriesContext(connection) as queries:
+            with block():
+                list(Category.objects.all())
+        return [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+
+    def test_only_write_transactions_take_the_lock_up_front(self):
+        # Read-only atomic blocks don't queue behind writers for the lock.
+        self.assertEqual(self.begins(transaction.atomic), ['BEGIN DEFERRED'])
+        self.assertEqual(self.begins(write_transaction), ['BEGIN IMMEDIATE'])
+        self.assertEqual(self.begins(serialized_write), ['BEGIN IMMEDIATE'])
+        self.assertEqual(self.begins(transaction.atomic), ['BEGIN DEFERRED'])
+
+
+class WriteQueueTest(TestCase):
+    def test_waiters_are_served_in_order(self):
+        queue = WriteQueue()
+        self.assertTrue(queue.acquire())
+        served = []
+
+        def writer(name):
+            queue.acquire()
+            served.append(name)
+            queue.release()
+
+        threads = []
+        for name in ('first', 'second', 'third'):
+            thread = threading.Thread(target=writer, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while queue.depth < len(threads) + 1:
+                pass
+        queue.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(served, ['first', 'second', 'third'])
+
+    def test_full_queue_and_timeouts_turn_writers_away(self):
+        queue = WriteQueue(max_depth=2)
+        self.assertTrue(queue.acquire())
+        self.assertFalse(queue.acquire(timeout=0.01))
+        # The abandoned ticket is skipped, so the queue drains normally.
+        queue.release()
+        self.assertTrue(queue.acquire(timeout=0.01))
+        self.assertFalse(queue.acquire(timeout=0))
+        queue.release()
+        self.assertEqual(queue.depth, 0)
+
+
+@skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+@override_settings(CATALOG_INDEX_ENABLED=True, CATALOG_INDEX_REFRESH_INTERVAL=0)
+class CatalogIndexTest(TestCase):
+    def setUp(self):
+        self.books = Category.objects.create(name='Books', slug='books')
+        self.games = Category.objects.create(name='Games', slug='games')
+        for index, (name, price, category, featured) in enumerate([
+            ('Chess', '15.00', self.games, False),
+            ('Atlas', '40.00', self.books, True),
+            ('Bridge', '9.99', self.games, True),
+            ('Dune', '12.50', self.books, False),
+        ]):
+            Product.objects.create(
+                name=name, slug=name.lower(), category=category, description=name,
+                price=Decimal(price), stock=index, is_featured=featured
+            )
+        Product.objects.create(
+            name='Hidden', slug='hidden', category=self.books, description='Hidden',
+            price=Decimal('1.00'), is_active=False
+        )
+        self.index = CatalogIndex()
+
+    def names(self, ids):
+        products = Product.objects.in_bulk(list(map(int, ids)))
+        return [products[int(product_id)].name for product_id in ids]
+
+    def test_sorting_matches_database(self):
+        active = Product.objects.filter(is_active=True)
+        for sort_by, ordering in [
+            ('name', ['name']), ('price_low', ['price']), ('price_high', ['-price']),
+            ('newest', ['-created_at']), ('featured', ['-is_featured', 'name']),
+        ]:
+            expected = list(active.order_by(*ordering).values_list('name', flat=True))
+            self.assertEqual(self.names(self.index.query(sort_by=sort_by)), expected, sort_by)
+
+    def test_filters(self):
+        self.assertEqual(self.names(self.index.query(category_slug='books')), ['Atlas', 'Dune'])
+        comics = Category.objects.create(name='Comics', slug='comics', parent=self.books)
+        Product.objects.create(name='Beano', slug='beano', category=comics, description='Beano', price=Decimal('2.00'))
+        self.index.refresh(force=True)
+        self.assertEqual(self.names(self.index.query(category_slug='books')), ['Atlas', 'Beano', 'Dune'])
+        self.assertEqual(self.names(self.index.query(category_slug='comics')), ['Beano'])
+        self.assertEqual(self.names(self.index.query(min_price='10', max_price='20')), ['Chess', 'Dune'])
+        self.assertEqual(len(self.index.query(category_slug='missing')), 0)
+        self.assertIsNone(self.index.query(min_price='cheap'))
+
+    def test_incremental_refresh_and_deletes(self):
+        self.index.query()
+        dune = Product.objects.get(slug='dune')
+        dune.price = Decimal('99.00')
+        dune.save()
+        Product.objects.create(
+            name='Emma', slug='emma', category=self.books, description='Emma', price=Decimal('5.00')
+        )
+        self.assertEqual(self.names(self.index.query(sort_by='price_high'))[:1], ['Dune'])
+        self.assertIn('Emma', self.names(self.index.query()))
+        with mock.patch('store.catalog_index.catalog_index', self.index):
+            Product.objects.filter(slug='emma').delete()
+        self.assertNotIn('Emma', self.names(self.index.query()))
+
+    @override_settings(CATALOG_INDEX_REFRESH_INTERVAL=60)
+    def test_queries_during_a_rebuild_keep_the_category_map(self):
+        self.index.query()
+        seen = []
+
+        def subtree_ids(rows):
+            # Another request listing a category while the rebuild still
+            # reads the tree.
+            seen.append(self.names(self.index.query(category_slug='books')))
+            return build(rows)
+
+        build = catalog_index._subtree_ids
+        self.index.mark_stale()
+        with mock.patch('store.catalog_index._subtree_ids', subtree_ids):
+            self.index.query()
+        self.assertEqual(seen, [['Atlas', 'Dune']])
+        self.assertEqual(self.names(self.index.query(category_slug='books')), ['Atlas', 'Dune'])
+
+    def test_listing_view_loads_only_the_visible_page(self):
+        with mock.patch('store.views.get_catalog_index', return_value=self.index):
+            self.index.query()
+            response = self.client.get(reverse('store:product_list'), {'sort': 'price_low'})
+        products = list(response.context['page_obj'].object_list)
+        self.assertEqual([product.name for product in products], ['Bridge', 'Dune', 'Chess', 'Atlas'])
+        self.assertEqual(response.context['page_obj'].paginator.count, 4)
+
+
+class WarmupTest(TestCase):
+    def test_warm_up_compiles_templates_and_primes_urls(self):
+        timings = warm_up(connect=False)
+        self.assertIn('store/product_list.html', list(template_names()))
+        self.assertGreaterEqual(timings['templates'][0], 10)
+        self.assertGreater(timings['urls'][0], 0)
+        self.assertNotIn('database', timings)
+
+
+class PricingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Test Category', slug='test-category')
+        self.product = Product.objects.create(
+            name='Test Product', slug='test-product', category=self.category,
+            description='Test product description', price=Decimal('19.99'), stock=10
+        )
+        self.cart = Cart.objects.create(user=self.user)
+        self.item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+
+    def test_breakdown(self):
+        breakdown = calculate_breakdown([(2, Decimal('19.99'))])
+        self.assertEqual(breakdown.subtotal, Decimal('39.98'))
+        self.assertEqual(breakdown.shipping, Decimal('9.99'))
+        self.assertEqual(breakdown.tax, Decimal('3.20'))
+        self.assertEqual(breakdown.total, Decimal('53.17'))
+        free = calculate_breakdown([(3, Decimal('19.99'))])
+        self.assertTrue(free.free_shipping)
+        self.assertEqual(free.total, Decimal('59.97') + Decimal('4.80'))
+        self.assertEqual(calculate_breakdown([]).total, Decimal('0.00'))
+
+    def test_breakdown_is_memoized_per_cart_version(self):
+        get_cart_pricing(Cart.objects.get(pk=self.cart.pk))
+        cart = Cart.objects.get(pk=self.cart.pk)
+        with self.assertNumQueries(1):  # version check only
+            self.assertEqual(get_cart_pricing(cart).subtotal, Decimal('39.98'))
+        with self.assertNumQueries(0):
+            get_cart_pricing(cart)
+
+    def test_item_and_price_changes_invalidate(self):
+        get_cart_pricing(Cart.objects.get(pk=self.cart.pk))
+        self.item.quantity = 3
+        self.item.save()
+        self.assertEqual(get_cart_pricing(Cart.objects.get(pk=self.cart.pk)).subtotal, Decimal('59.97'))
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = Decimal('10.00')
+        product.save()
+        self.assertEqual(get_cart_pricing(Cart.objects.get(pk=self.cart.pk)).subtotal, Decimal('30.00'))
+
+    def test_cart_json_and_order_total_share_the_breakdown(self):
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.post(
+            reverse('store:update_cart_item'),
+            data={'item_id': self.item.id, 'quantity': 1},
+            content_type='application/json'
+        )
+        self.assertEqual(response.json()['pricing']['total'], '31.58')
+        response = self.client.post(reverse('store:checkout'), {
+            'first_name': 'Test', 'last_name': 'User', 'email': 'test@example.com',
+            'phone': '123', 'address_line_1': '1 Street', 'city': 'City',
+            'state': 'State', 'postal_code': '12345', 'country': 'US',
+        }, follow=True)
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.total_amount, Decimal('31.58'))
+        self.assertContains(response, '$1.60')
+
+
+class ThrottlingTest(TestCase):
+    def setUp(self):
+        caches['ratelimit'].clear()
+        self.user = User.objects.create_user(username='shopper', password='testpass123')
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.product = Product.objects.create(
+            name='Cable', slug='cable', category=category, description='A cable',
+            price=Decimal('5.00'), stock=100,
+        )
+
+    def test_token_bucket_refills_over_time(self):
+        bucket = TokenBucket(capacity=2, period=60, cache_alias='ratelimit')
+        self.assertTrue(bucket.consume('key', now=1000)[0])
+        self.assertTrue(bucket.consume('key', now=1000)[0])
+        allowed, wait = bucket.consume('key', now=1000)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 30)
+        self.assertTrue(bucket.consume('key', now=1030)[0])
+
+    @override_settings(RATE_LIMITS={'cart': {'user': '2/m', 'ip': '100/m'}})
+    def test_cart_requests_over_the_user_limit_get_429(self):
+        self.client.login(username='shopper', password='testpass123')
+        url = reverse('store:add_to_cart')
+        for _ in range(2):
+            response = self.client.post(url, {'product_id': self.product.id}, content_type='application/json')
+            self.assertTrue(response.json()['success'])
+        response = self.client.post(url, {'product_id': self.product.id}, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 2)
+
+    @override_settings(RATE_LIMITS={'cart': {'ip': '1/h'}})
+    def test_anonymous_requests_are_limited_per_ip(self):
+        url = reverse('store:add_to_cart')
+        self.client.post(url, {'product_id': self.product.id}, content_type='application/json')
+        response = self.client.post(url, {'product_id': self.product.id}, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+
+    def test_concurrency_limiter_queues_then_sheds(self):
+        limiter = ConcurrencyLimiter(limit=1, max_waiting=1)
+        self.assertTrue(limiter.acquire(timeout=0))
+        started = time.monotonic()
+        self.assertFalse(limiter.acquire(timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        threading.Timer(0.05, limiter.release).start()
+        self.assertTrue(limiter.acquire(timeout=5))
+
+        full = ConcurrencyLimiter(limit=1, max_waiting=0)
+        full.acquire(timeout=0)
+        started = time.monotonic()
+        self.assertFalse(full.acquire(timeout=5))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_checkout_is_shed_when_saturated(self):
+        self.client.login(username='shopper', password='testpass123')
+        with mock.patch.object(checkout_limiter, 'acquire', return_value=False):
+            response = self.client.post(reverse('store:checkout'), {}, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response)
+            self.assertEqual(self.client.get(reverse('store:checkout')).status_code, 302)
+
+            # The checkout form gets the busy message and its page back.
+            response = self.client.post(reverse('store:checkout'), {})
+            self.assertRedirects(response, reverse('store:checkout'), fetch_redirect_response=False)
+            messages = [str(message) for message in get_messages(response.wsgi_request)]
+            self.assertIn(OVERLOADED_MESSAGE, messages)
+
+    @override_settings(RATE_LIMITS={'cart': {'user': '1/h'}})
+    def test_form_posts_over_the_limit_are_redirected_with_a_message(self):
+        self.client.login(username='shopper', password='testpass123')
+        self.client.post(reverse('store:apply_coupon'), {'coupon_code': ''})
+        response = self.client.post(reverse('store:apply_coupon'), {'coupon_code': ''}, follow=True)
+        self.assertRedirects(response, reverse('store:cart'))
+        self.assertContains(response, RATE_LIMITED_MESSAGE)
+
+
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        category = Category.objects.create(name='Electronics', slug='electronics')
+        self.product = Product.objects.create(
+            name='Laptop', slug='laptop', category=category, description='A laptop',
+            price=Decimal('20.00'), stock=6,
+        )
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+
+    def checkout(self):
+        self.client.login(username='buyer', password='testpass123')
+        return self.client.post(reverse('store:checkout'), {
+            'first_name': 'Test', 'last_name': 'User', 'email': 'buyer@example.com',
+            'phone': '123', 'address_line_1': '1 Street', 'city': 'City',
+            'state': 'State', 'postal_code': '12345', 'country': 'US',
+        })
+
+    @override_settings(ADMINS=[('Ops', 'ops@example.com')], LOW_STOCK_THRESHOLD=5)
+    def test_checkout_enqueues_follow_up_work(self):
+        self.checkout()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(Task.objects.values_list('name', flat=True)),
+            ['store.tasks.check_low_stock', 'store.tasks.send_order_confirmation'],
+        )
+        self.assertEqual(Worker().run_batch(), (2, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['buyer@example.com', 'ops@example.com'])
+        order = Order.objects.get(user=self.user)
+        self.assertIn(order.order_number, mail.outbox[0].subject + mail.outbox[1].subject)
+        self.assertFalse(Task.objects.exclude(status='done').exists())
+
+        # At-least-once delivery: running the email job again sends nothing.
+        send_order_confirmation(order.pk)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        with self.assertRaises(ValueError):
+            enqueue(len)
+        queued = enqueue(failing_task, args=['boom'], max_attempts=2)
+        with self.assertLogs('store.task_queue', 'WARNING'):
+            self.assertEqual(Worker().run_batch(), (0, 1))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('pending', 1))
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertIn('RuntimeError: boom', queued.last_error)
+        self.assertEqual(Worker().run_batch(), (0, 0))
+
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        with self.assertLogs('store.task_queue', 'ERROR'):
+            Worker().run_batch()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('failed', 2))
+
+    def test_expired_leases_are_claimed_again(self):
+        queued = enqueue(send_order_confirmation, args=[0])
+        first = Worker()
+        self.assertEqual([row.pk for row in first.claim()], [queued.pk])
+        self.assertEqual(Worker().claim(), [])
+        Task.objects.filter(pk=queued.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        second = Worker()
+        self.assertEqual([row.pk for row in second.claim()], [queued.pk])
+        self.assertEqual(Task.objects.get(pk=queued.pk).locked_by, second.token)
+
+
+class FulfillmentTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.orders = {}
+        for index, status in enumerate(['processing', 'processing', 'processing', 'pending', 'delivered']):
+            self.orders[index] = Order.objects.create(
+                user=self.user, order_number=f'ORD-F-{index}', first_name='A', last_name='B',
+                email='a@example.com', phone='1', address_line_1='1 Street', city='City', state='State',
+                postal_code='1', country='US', total_amount=Decimal('10.00'), status=status,
+            )
+
+    def statuses(self):
+        return list(Order.objects.order_by('order_number').values_list('status', flat=True))
+
+    def test_only_allowed_transitions_are_applied(self):
+        result = transition_orders([order.pk for order in self.orders.values()] + [0], 'shipped', batch_size=2)
+        self.assertEqual(result.updated, 3)
+        self.assertEqual(result.skipped, {'pending': 1, 'delivered': 1, 'missing': 1})
+        self.assertEqual(self.statuses(), ['shipped', 'shipped', 'shipped', 'pending', 'delivered'])
+        with self.assertRaises(ValueError):
+            transition_orders([self.orders[0].pk], 'lost')
+
+    def test_admin_action(self):
+        User.objects.create_superuser(username='admin', password='adminpass123', email='admin@example.com')
+        self.client.login(username='admin', password='adminpass123')
+        response = self.client.post(reverse('admin:store_order_changelist'), {
+            'action': 'mark_cancelled',
+            '_selected_action': [self.orders[3].pk, self.orders[4].pk],
+        }, follow=True)
+        self.assertContains(response, '1 order(s) marked as cancelled.')
+        self.assertContains(response, '1 delivered')
+        self.assertEqual(self.statuses()[3:], ['cancelled', 'delivered'])
+
+    def test_command_reads_order_numbers(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('ORD-F-0\nORD-F-1\nORD-F-3\nORD-NOPE\n')
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command('transition_orders', 'shipped', '--order-numbers', f.name, '--dry-run', stdout=out)
+        self.assertIn('Would move 2 order(s)', out.getvalue())
+        self.assertEqual(self.statuses()[0], 'processing')
+
+        out = io.StringIO()
+        call_command('transition_orders', 'shipped', '--order-numbers', f.name, stdout=out)
+        self.assertIn('Moved 2 order(s) to shipped', out.getvalue())
+        self.assertIn('Skipped 1 order(s): unknown order number', out.getvalue())
+        self.assertEqual(self.statuses(), ['shipped', 'shipped', 'processing', 'pending', 'delivered'])
+
+        call_command('transition_orders', 'delivered', '--all-from', 'shipped', stdout=io.StringIO())
+        self.assertEqual(self.statuses()[:3], ['delivered', 'delivered', 'processing'])
+
+
+class OrderArchiveTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            name='Novel', slug='novel', category=category, description='A novel',
+            price=Decimal('12.00'), stock=10,
+        )
+        old = timezone.now() - timedelta(days=400)
+        self.old_delivered = self.create_order('ORD-OLD-1', 'delivered', old)
+        self.old_processing = self.create_order('ORD-OLD-2', 'processing', old + timedelta(days=10))
+        self.recent = self.create_order('ORD-NEW-1', 'delivered', timezone.now())
+
+    def create_order(self, number, status, created_at):
+        order = Order.objects.create(
+            user=self.user, order_number=number, first_name='A', last_name='B', email='a@example.com',
+            phone='1', address_line_1='1 Street', city='City', state='State', postal_code='1',
+            country='US', total_amount=Decimal('24.00'), status=status,
+        )
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, price=Decimal('12.00'))
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        return Order.objects.get(pk=order.pk)
+
+    def test_finished_old_orders_move_to_the_archive(self):
+        out = io.StringIO()
+        call_command('archive_orders', '--batch-size', '1', stdout=out)
+        self.assertIn('Archived 1 order(s) and 1 item(s)', out.getvalue())
+        self.assertEqual(
+            sorted(Order.objects.values_list('order_number', flat=True)), ['ORD-NEW-1', 'ORD-OLD-2'],
+        )
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual(
+            (archived.pk, archived.order_number, archived.created_at, archived.status),
+            (self.old_delivered.pk, 'ORD-OLD-1', self.old_delivered.created_at, 'delivered'),
+        )
+        self.assertEqual(list(archived.items.values_list('quantity', 'price')), [(2, Decimal('12.00'))])
+        self.assertFalse(OrderItem.objects.filter(order_id=self.old_delivered.pk).exists())
+
+    def test_views_fall_back_to_the_archive(self):
+        call_command('archive_orders', stdout=io.StringIO())
+        self.client.login(username='buyer', password='testpass123')
+        response = self.client.get(reverse('store:order_confirmation', args=['ORD-OLD-1']))
+        self.assertContains(response, 'ORD-OLD-1')
+        self.assertContains(response, 'Novel')
+        response = self.client.get(reverse('accounts:order_history'))
+        self.assertEqual(
+            [order.order_number for order in response.context['orders']], ['ORD-NEW-1', 'ORD-OLD-2', 'ORD-OLD-1'],
+        )
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_login(other)
+        response = self.client.get(reverse('store:order_confirmation', args=['ORD-OLD-1']))
+        self.assertEqual(response.status_code, 404)
+
+
+class PurgeStaleDataTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Books', slug='books')
+        product = Product.objects.create(
+            name='Novel', slug='novel', category=category, description='A novel', price=Decimal('12.00'), stock=10,
+        )
+        old = timezone.now() - timedelta(days=40)
+        self.carts = {}
+        for name, updated_at in (('gone', old), ('gone-too', old), ('recent', timezone.now())):
+            cart = Cart.objects.create(user=User.objects.create_user(username=name, password='testpass123'))
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            Cart.objects.filter(pk=cart.pk).update(updated_at=updated_at)
+            self.carts[name] = cart
+        for key, expire_date in (('expired1', old), ('expired2', old), ('live', timezone.now() + timedelta(days=1))):
+            Session.objects.create(session_key=key, session_data='', expire_date=expire_date)
+
+    def test_dry_run_only_counts(self):
+        out = io.StringIO()
+        call_command('purge_stale_data', '--dry-run', stdout=out)
+        self.assertIn('2 expired session(s) and 2 cart(s)', out.getvalue())
+        self.assertEqual(Cart.objects.count(), 3)
+
+    def test_stale_rows_are_deleted_in_batches(self):
+        out = io.StringIO()
+        with capture_plans() as plans:
+            call_command('purge_stale_data', '--batch-size', '1', stdout=out)
+        self.assertIn('Deleted 2 expired session(s) and 2 cart(s) with 2 item(s)', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(out.getvalue().count('so far'), 4)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [self.carts['recent'].pk])
+        self.assertEqual(list(CartItem.objects.values_list('cart_id', flat=True)), [self.carts['recent'].pk])
+        self.assertFalse([problem for plan in plans for problem in plan_problems(plan)])
+
+        call_command('purge_stale_data', '--days', '0', stdout=io.StringIO())
+        self.assertFalse(Cart.objects.exists())
+
+
+class StockLookupTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        category = Category.objects.create(name='Toys', slug='toys')
+        self.ball = Product.objects.create(
+            name='Ball', slug='ball', category=category, description='A ball', price=Decimal('5.00'), stock=3,
+        )
+        self.kite = Product.objects.create(
+            name='Kite', slug='kite', category=category, description='A kite', price=Decimal('9.00'), stock=0,
+        )
+
+    def test_bulk_lookup_by_id_and_slug(self):
+        url = reverse('store:stock') + f'?ids={self.ball.pk},999&slugs=kite,nope'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json(), {
+            'products': [
+                {'id': self.ball.pk, 'slug': 'ball', 'stock': 3, 'is_in_stock': True},
+                {'id': self.kite.pk, 'slug': 'kite', 'stock': 0, 'is_in_stock': False},
+            ],
+            'missing': ['999', 'nope'],
+        })
+        # Hits, including the unknown keys, are served from the cache
+        with self.assertNumQueries(0):
+            self.client.get(url)
+            self.client.get(reverse('store:stock') + '?slugs=ball')
+
+    def test_saving_a_product_invalidates_its_entry(self):
+        url = reverse('store:stock') + '?slugs=ball'
+        self.client.get(url)
+        self.ball.stock = 0
+        self.ball.save()
+        self.assertFalse(self.client.get(url).json()['products'][0]['is_in_stock'])
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.client.get(reverse('store:stock') + '?ids=1,x').status_code, 400)
+        self.assertEqual(self.client.get(reverse('store:stock'), {'ids': '\u00b2'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('store:stock'), {'ids': '9' * 30}).status_code, 400)
+        too_many = ','.join(str(pk) for pk in range(101))
+        self.assertEqual(self.client.get(reverse('store:stock') + f'?ids={too_many}').status_code, 400)
+
+    def test_concurrent_misses_are_coalesced(self):
+        lookup = StockLookup()
+        calls = []
+        started = threading.Event()
+
+        def slow_fetch(keys):
+            calls.append(keys)
+            started.set()
+            time.sleep(0.2)
+            return {key: {'id': 1, 'slug': 'ball', 'stock': 3} for key in keys}
+
+        results = []
+        with mock.patch.object(lookup, '_fetch', side_effect=slow_fetch):
+            leader = threading.Thread(target=lambda: results.append(lookup.get(ids=['1'])))
+            leader.start()
+            started.wait()
+            followers = [threading.Thread(target=lambda: results.append(lookup.get(ids=['1']))) for _ in range(20)]
+            for thread in followers:
+                thread.start()
+            for thread in [leader] + followers:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 21)
+        self.assertTrue(all(result[cache_key('id', '1')]['stock'] == 3 for result in results))
+
+
+class ProductApiTest(TestCase):
+    def setUp(self):
+        self.toys = Category.objects.create(name='Toys', slug='toys')
+        self.books = Category.objects.create(name='Books', slug='books')
+        for i in range(6):
+            product = Product.objects.create(
+                name=f'Toy {i}', slug=f'toy-{i}', category=self.toys, description='A toy',
+                price=Decimal('5.00') + i, stock=i, image='products/toy.jpg',
+            )
+            product.additional_images.create(image=f'products/gallery/toy-{i}.jpg', alt_text=f'Toy {i}')
+        Product.objects.create(
+            name='Novel', slug='novel', category=self.books, description='A novel', price=Decimal('12.00'), stock=1,
+        )
+
+    def get(self, **params):
+        response = self.client.get(reverse('store:products_api'), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_lookup_by_ids_and_slugs(self):
+        toy = Product.objects.get(slug='toy-1')
+        data = self.get(ids=f'{toy.pk},9999', slugs='novel,nope')
+        data['products'].sort(key=lambda product: product['id'])
+        self.assertEqual([product['slug'] for product in data['products']], ['toy-1', 'novel'])
+        self.assertEqual(data['missing'], ['9999', 'nope'])
+        self.assertEqual(data['products'][0], {
+            'id': toy.pk, 'name': 'Toy 1', 'slug': 'toy-1', 'url': '/product/toy-1/', 'price': '6.00',
+            'is_in_stock': True, 'image': '/media/products/toy.jpg',
+            'category': {'id': self.toys.pk, 'name': 'Toys', 'slug': 'toys'},
+        })
+
+    def test_only_requested_columns_are_loaded(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get(fields='name,price', category='books')
+        self.assertEqual(data['products'], [{'name': 'Novel', 'price': '12.00'}])
+        # The category's subtree, then the products.
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('description', queries[1]['sql'])
+        self.assertNotIn('image', queries[1]['sql'])
+
+    def test_related_lookups_are_batched_per_chunk(self):
+        with self.assertNumQueries(1 + 3):
+            data = self.get(fields='slug,category,images', category='toys', sort='price_high')
+        self.assertEqual([product['slug'] for product in data['products']], [f'toy-{i}' for i in range(5, -1, -1)])
+        self.assertEqual(data['products'][0]['images'], [
+            {'url': '/media/products/gallery/toy-5.jpg', 'alt_text': 'Toy 5', 'is_primary': False},
+        ])
+        # Three chunks: categories are only fetched the first time they appear
+        with override_settings(API_CHUNK_SIZE=2), self.assertNumQueries(1 + 1 + 1 + 3):
+            data = self.get(fields='slug,category,images', category='toys', offset=0, limit=6)
+        self.assertEqual(len(data['products']), 6)
+
+    def test_json_fallback_matches_orjson(self):
+        expected = self.get(fields='id,price,created_at', limit=3)
+        with mock.patch.object(api, 'orjson', False):
+            self.assertEqual(self.get(fields='id,price,created_at', limit=3)['products'][0]['price'],
+                             expected['products'][0]['price'])
+
+    def test_rejects_bad_requests(self):
+        url = reverse('store:products_api')
+        self.assertEqual(self.client.get(url, {'fields': 'name,secret'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': 'a'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': '\u00b2'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': '9' * 30}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'min_price': 'cheap'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': '-1'}).status_code, 400)
+
+
+class QueryPlanTest(TestCase):
+    """Every view's queries must use an index: no full scans of large tables, no temporary sorts."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.toys = Category.objects.create(name='Toys', slug='toys')
+        self.ball = Product.objects.create(
+            name='Ball', slug='ball', category=self.toys, description='A ball', price=Decimal('5.00'), stock=5,
+            image='products/ball.jpg',
+        )
+        self.ball.additional_images.create(image='products/gallery/ball.jpg')
+        outdoor = Category.objects.create(name='Outdoor toys', slug='outdoor-toys', parent=self.toys)
+        Product.objects.create(
+            name='Kite', slug='kite', category=outdoor, description='A kite', price=Decimal('9.00'), stock=5,
+        )
+        cart = Cart.objects.create(user=self.user)
+        self.item = CartItem.objects.create(cart=cart, product=self.ball, quantity=1)
+        for number, status in (('ORD-PLAN-1', 'pending'), ('ORD-PLAN-2', 'delivered')):
+            order = Order.objects.create(
+                user=self.user, order_number=number, first_name='A', last_name='B', email='a@example.com',
+                phone='1', address_line_1='1 Street', city='City', state='State', postal_code='1',
+                country='US', total_amount=Decimal('5.00'), status=status,
+            )
+            OrderItem.objects.create(order=order, product=self.ball, quantity=1, price=Decimal('5.00'))
+        call_command('archive_orders', '--days', '-1', stdout=io.StringIO())
+        self.client.force_login(self.user)
+
+    def assertIndexedPlans(self, method, url, data=None, allow_sort=False):
+        with capture_plans() as plans:
+            response = getattr(self.client, method)(url, data or {})
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        self.assertTrue(plans, url)
+        problems = [
+            f'{plan}\n  -> {problem}' for plan in plans for problem in plan_problems(plan, allow_sort=allow_sort)
+        ]
+        self.assertFalse(problems, '\n'.join(problems))
+
+    def test_catalog_views(self):
+        for sort in ('name', 'price_low', 'price_high', 'newest', 'featured'):
+            with self.subTest(sort=sort):
+                self.assertIndexedPlans('get', reverse('store:product_list'), {'sort': sort})
+        for sort in ('name', 'price_low', 'newest'):
+            with self.subTest(category_sort=sort):
+                self.assertIndexedPlans('get', reverse('store:product_list'), {'category': 'outdoor-toys', 'sort': sort})
+                self.assertIndexedPlans('get', reverse('store:category_products', args=['outdoor-toys']), {'sort': sort})
+                # Toys has a subcategory: its listing sorts the subtree's rows, but must not scan.
+                self.assertIndexedPlans('get', reverse('store:category_products', args=['toys']), {'sort': sort}, True)
+        self.assertIndexedPlans('get', reverse('store:product_detail', args=['ball']))
+        self.assertIndexedPlans('get', reverse('store:product_detail', args=['kite']))
+        self.assertIndexedPlans('get', reverse('store:stock'), {'ids': self.ball.pk, 'slugs': 'kite'})
+        self.assertIndexedPlans('get', reverse('store:products_api'), {'category': 'outdoor-toys', 'fields': 'id,images'})
+        self.assertIndexedPlans('get', reverse('store:products_api'), {'category': 'toys', 'fields': 'id'}, True)
+        self.assertIndexedPlans('get', reverse('store:products_api'), {'ids': self.ball.pk, 'slugs': 'kite'})
+        self.assertIndexedPlans('get', reverse('store:changes_api'), {'after': 1})
+        self.assertIndexedPlans('get', reverse('store:changes_api'), {'after': 1, 'model': 'product'})
+
+    def test_cart_views(self):
+        self.assertIndexedPlans('get', reverse('store:cart'))
+        self.assertIndexedPlans('post', reverse('store:add_to_cart'), {'product_id': self.ball.pk, 'quantity': 1})
+        self.assertIndexedPlans('post', reverse('store:update_cart_item'), {'item_id': self.item.pk, 'quantity': 3})
+        self.assertIndexedPlans('get', reverse('store:checkout'))
+        self.assertIndexedPlans('post', reverse('store:apply_coupon'), {'coupon_code': ''})
+        self.assertIndexedPlans('post', reverse('store:remove_from_cart'), {'item_id': self.item.pk})
+
+    def test_order_views(self):
+        self.assertIndexedPlans('get', reverse('accounts:order_history'))
+        self.assertIndexedPlans('get', reverse('accounts:profile'))
+        self.assertIndexedPlans('get', reverse('store:order_confirmation', args=['ORD-PLAN-1']))
+        self.assertIndexedPlans('get', reverse('store:order_confirmation', args=['ORD-PLAN-2']))
+
+    def test_detects_scans_and_sorts(self):
+        plan = QueryPlan('SELECT * FROM "store_order" U0 ORDER BY "U0"."email"', [], [
+            'SCAN U0', 'USE TEMP B-TREE FOR ORDER BY',
+        ])
+        self.assertEqual(plan_problems(plan), [
+            'full scan of store_order: SCAN U0', 'temporary sort: USE TEMP B-TREE FOR ORDER BY',
+        ])
+        with capture_plans() as plans:
+            list(Order.objects.order_by('email'))
+        self.assertEqual(len(plan_problems(plans[0])), 2)
+
+
+class SitemapTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(
+            SITEMAP_ROOT=self.root, SITEMAP_CHUNK_SIZE=2, SITE_URL='https://shop.example.com',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.toys = Category.objects.create(name='Toys', slug='toys')
+        self.products = [
+            Product.objects.create(
+                name=f'Toy {i}', slug=f'toy-{i}', category=self.toys, description='A toy', price=Decimal('5.00'),
+            )
+            for i in range(5)
+        ]
+
+    def chunk_of(self, product):
+        return product_chunk_name((product.pk - 1) // 2)
+
+    def read(self, name):
+        with open(os.path.join(self.root, name)) as f:
+            return f.read()
+
+    def test_builds_chunks_and_index(self):
+        out = io.StringIO()
+        call_command('build_sitemaps', stdout=out)
+        chunks = sorted({self.chunk_of(product) for product in self.products})
+        self.assertIn(f'{len(chunks) + 1} sitemap(s) written', out.getvalue())
+        index = self.read('sitemap.xml')
+        for name in chunks + ['categories.xml']:
+            self.assertIn(f'<loc>https://shop.example.com/sitemaps/{name}</loc>', index)
+        product = self.products[0]
+        self.assertIn(
+            f'<url><loc>https://shop.example.com/product/toy-0/</loc>'
+            f'<lastmod>{product.updated_at.isoformat(timespec="seconds")}</lastmod></url>',
+            self.read(self.chunk_of(product)),
+        )
+        self.assertIn('https://shop.example.com/category/toys/', self.read('categories.xml'))
+        self.assertTrue(all(self.read(name).count('<url>') <= 2 for name in chunks))
+
+    def test_only_changed_chunks_are_rewritten(self):
+        build_sitemaps()
+        self.assertEqual(build_sitemaps()[:2], ([], []))
+
+        product = self.products[2]
+        product.name = 'Renamed'
+        product.save()
+        written, removed, _ = build_sitemaps()
+        self.assertEqual((written, removed), ([self.chunk_of(product)], []))
+
+        # Deactivating every product in the last chunk drops its file from the index
+        last = self.products[-1]
+        for product in self.products:
+            if self.chunk_of(product) == self.chunk_of(last):
+                product.is_active = False
+                product.save()
+        written, removed, _ = build_sitemaps()
+        self.assertEqual((written, removed), ([], [self.chunk_of(last)]))
+        self.assertNotIn(self.chunk_of(last), self.read('sitemap.xml'))
+
+    def test_served_from_disk(self):
+        build_sitemaps()
+        response = self.client.get(reverse('store:sitemap'))
+        self.assertEqual(response['Content-Type'], 'application/xml')
+        self.assertIn(b'<sitemapindex', b''.join(response.streaming_content))
+        name = self.chunk_of(self.products[0])
+        self.assertEqual(self.client.get(reverse('store:sitemap_file', args=[name])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('store:sitemap_file', args=['manifest.json'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('store:sitemap_file', args=['missing.xml'])).status_code, 404)
+
+
+class CatalogChangeTest(TestCase):
+    def setUp(self):
+        self.toys = Category.objects.create(name='Toys', slug='toys')
+        self.ball = Product.objects.create(
+            name='Ball', slug='ball', category=self.toys, description='A ball', price=Decimal('5.00'), stock=5,
+        )
+        self.image = self.ball.additional_images.create(image='products/gallery/ball.jpg', alt_text='Ball')
+
+    def feed(self, **params):
+        response = self.client.get(reverse('store:changes_api'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_saves_and_deletes_are_logged(self):
+        self.ball.stock = 4
+        self.ball.price = Decimal('6.00')
+        self.ball.save()
+        image_pk = self.image.pk
+        self.image.delete()
+        changes = list(CatalogChange.objects.values_list('model', 'object_id', 'action'))
+        self.assertEqual(changes, [
+            ('category', self.toys.pk, 'upsert'),
+            ('product', self.ball.pk, 'upsert'),
+            ('productimage', image_pk, 'upsert'),
+            ('product', self.ball.pk, 'upsert'),
+            ('productimage', image_pk, 'delete'),
+        ])
+        latest = CatalogChange.objects.filter(model='product').last().data
+        self.assertEqual((latest['stock'], latest['price'], latest['image']), (4, '6.00', None))
+
+    def test_queryset_updates_are_recorded_explicitly(self):
+        Product.objects.filter(pk=self.ball.pk).update(stock=0)
+        record_changes(Product, [self.ball.pk])
+        self.assertEqual(CatalogChange.objects.last().data['stock'], 0)
+
+    def test_feed_pages_through_the_log(self):
+        first = self.feed(limit=2)
+        self.assertEqual([change['model'] for change in first['changes']], ['category', 'product'])
+        self.assertTrue(first['has_more'])
+        rest = self.feed(after=first['next'])
+        self.assertEqual([change['model'] for change in rest['changes']], ['productimage'])
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(self.feed(after=rest['next']), {'changes': [], 'next': rest['next'], 'has_more': False})
+
+        ball_pk = self.ball.pk
+        self.ball.delete()
+        deleted = self.feed(after=rest['next'], model='product')['changes']
+        self.assertEqual([(change['id'], change['action']) for change in deleted], [(ball_pk, 'delete')])
+        self.assertEqual(deleted[0]['data']['slug'], 'ball')
+        self.assertEqual(self.client.get(reverse('store:changes_api'), {'model': 'order'}).status_code, 400)
+
+    def test_tail_command(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('tail_changes', '--lines', '2', stdout=out, stderr=err)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([line['model'] for line in lines], ['product', 'productimage'])
+        self.assertIn(f"Stopped at cursor {lines[-1]['cursor']}", err.getvalue())
+        out = io.StringIO()
+        call_command('tail_changes', '--after', '0', '--model', 'category', stdout=out, stderr=io.StringIO())
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+
+
+class ProductDetailQueryTest(TestCase):
+    def setUp(self):
+        self.toys = Category.objects.create(name='Toys', slug='toys')
+
+    def create_product(self, slug, images, image='products/toy.jpg'):
+        product = Product.objects.create(
+            name=slug.title(), slug=slug, category=self.toys, description='A toy', price=Decimal('5.00'),
+            stock=3, image=image,
+        )
+        for i in range(images):
+            product.additional_images.create(image=f'products/gallery/{slug}-{i}.jpg', is_primary=i == 0)
+        return product
+
+    def detail_queries(self, product):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('store:product_detail', args=[product.slug]))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_does_not_grow_with_gallery(self):
+        small = self.create_product('small', images=1)
+        large = self.create_product('large', images=8)
+        for i in range(4):
+            self.create_product(f'related-{i}', images=3, image='' if i % 2 else 'products/toy.jpg')
+
+        small_count, _ = self.detail_queries(small)
+        large_count, response = self.detail_queries(large)
+        self.assertEqual(small_count, large_count)
+        self.assertLessEqual(large_count, 4)
+        self.assertEqual(len(response.context['gallery_images']), 8)
+        self.assertTrue(response.context['gallery_images'][0].is_primary)
+        self.assertContains(response, 'products/gallery/large-7.jpg')
+        # Related products without a main image fall back to their primary gallery image
+        self.assertContains(response, 'products/gallery/related-1-0.jpg')
+        self.assertNotContains(response, 'products/gallery/related-1-1.jpg')
+
+    def test_gallery_without_main_image(self):
+        product = self.create_product('bare', images=2, image='')
+        _, response = self.detail_queries(product)
+        self.assertContains(response, 'products/gallery/bare-1.jpg')
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(PROFILING_ROOT=self.root, PROFILING_KEEP=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = Category.objects.create(name='Tools', slug='tools')
+        Product.objects.create(
+            name='Hammer', slug='hammer', category=self.category, description='Hits nails', price=Decimal('9.00'),
+        )
+        self.staff = User.objects.create_user(username='staff', password='pw', is_staff=True)
+        self.shopper = User.objects.create_user(username='shopper', password='pw')
+
+    def test_plain_requests_are_not_profiled(self):
+        response = self.client.get(reverse('store:product_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(profiling.capture_ids(), [])
+
+    def test_query_param_needs_staff(self):
+        self.client.get(reverse('store:product_list'), {'_profile': '1'})
+        self.client.force_login(self.shopper)
+        response = self.client.get(reverse('store:product_list'), {'_profile': '1'})
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(profiling.capture_ids(), [])
+
+    def test_staff_capture_records_profile_and_sql(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('store:product_list'), {'_profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        capture_id = response['X-Profile-Id']
+        self.assertEqual(profiling.capture_ids(), [capture_id])
+        self.assertTrue(os.path.exists(os.path.join(self.root, capture_id, 'profile.pstats')))
+        summary = profiling.load_summary(capture_id)
+        self.assertEqual((summary['mode'], summary['status'], summary['user']), ('cprofile', 200, 'staff'))
+        self.assertTrue(any('store_product' in query['sql'] for query in summary['sql']))
+        self.assertEqual(summary['sql_count'], len(summary['sql']))
+        self.assertTrue(summary['top'])
+
+        page = self.client.get(reverse('profiling_capture', args=[capture_id]))
+        self.assertContains(page, 'SQL timeline')
+        download = self.client.get(reverse('profiling_download', args=[capture_id, 'profile.pstats']))
+        self.assertEqual(download.status_code, 200)
+        download.close()
+        missing = self.client.get(reverse('profiling_download', args=[capture_id, '..%2Fsettings.py']))
+        self.assertEqual(missing.status_code, 404)
+
+    def test_signed_header_and_sampling(self):
+        headers = {'HTTP_X_PROFILE': profiling.make_token(), 'HTTP_X_PROFILE_MODE': 'sample'}
+        with override_settings(PROFILING_SAMPLE_INTERVAL=0.0005):
+            response = self.client.get(reverse('store:product_list'), **headers)
+        capture_id = response['X-Profile-Id']
+        self.assertEqual(profiling.load_summary(capture_id)['mode'], 'sample')
+        self.assertTrue(os.path.exists(os.path.join(self.root, capture_id, 'stacks.folded')))
+
+        forged = self.client.get(reverse('store:product_list'), HTTP_X_PROFILE='profile:forged:signature')
+        self.assertNotIn('X-Profile-Id', forged)
+
+    def test_expired_token_is_ignored(self):
+        token = profiling.make_token()
+        with override_settings(PROFILING_TOKEN_MAX_AGE=-1):
+            response = self.client.get(reverse('store:product_list'), HTTP_X_PROFILE=token)
+        self.assertNotIn('X-Profile-Id', response)
+
+    def test_only_recent_captures_are_kept(self):
+        self.client.force_login(self.staff)
+        ids = [self.client.get(reverse('store:product_list'), {'_profile': '1'})['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(len(profiling.capture_ids()), 2)
+        self.assertIn(ids[-1], profiling.capture_ids())
+
+    def test_capture_pages_are_staff_only(self):
+        self.client.force_login(self.shopper)
+        response = self.client.get(reverse('profiling_captures'))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('profiling_captures'))
+        self.assertContains(response, 'X-Profile: ')
+
+    def test_disabled(self):
+        self.client.force_login(self.staff)
+        with override_settings(PROFILING_ENABLED=False):
+            response = self.client.get(reverse('store:product_list'), {'_profile': '1'})
+        self.assertNotIn('X-Profile-Id', response)
+
+
+class InventoryTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Tools', slug='tools')
+        self.hammer = Product.objects.create(
+            name='Hammer', slug='hammer', category=self.category, description='Hits nails', price=Decimal('9.00'), stock=3,
+        )
+        self.user = User.objects.create_user(username='buyer', password='pw')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def test_reserve_takes_stock_from_stale_instances(self):
+        stale = Product.objects.get(pk=self.hammer.pk)
+        reserve_stock([(self.hammer, 2)])
+        # A second checkout holding the old stock figure can't oversell.
+        with self.assertRaises(OutOfStock):
+            reserve_stock([(stale, 2)])
+        self.hammer.refresh_from_db()
+        self.assertEqual(self.hammer.stock, 1)
+        self.assertEqual(CatalogChange.objects.filter(model='product', object_id=self.hammer.pk).last().data['stock'], 1)
+
+    def test_add_to_cart_is_an_increment(self):
+        self.assertTrue(add_to_cart(self.cart, self.hammer, 1))
+        self.assertTrue(add_to_cart(self.cart, self.hammer, 2))
+        self.assertFalse(add_to_cart(self.cart, self.hammer, 1))
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 3)
+        self.assertEqual(get_cart_pricing(Cart.objects.get(pk=self.cart.pk)).item_count, 3)
+
+    def test_checkout_rolls_back_when_stock_ran_out(self):
+        CartItem.objects.create(cart=self.cart, product=self.hammer, quantity=2)
+        Product.objects.filter(pk=self.hammer.pk).update(stock=1)
+        self.client.force_login(self.user)
+        with override_settings(RATELIMIT_ENABLED=False):
+            response = self.client.post(reverse('store:checkout'), {'first_name': 'A', 'email': 'a@example.com'})
+        self.assertRedirects(response, reverse('store:cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 2)
+
+    def test_checkout_prices_items_and_totals_from_one_read(self):
+        CartItem.objects.create(cart=self.cart, product=self.hammer, quantity=2)
+        self.client.force_login(self.user)
+
+        def reprice_then_write():
+            # The hammer is repriced after the checkout read the cart but
+            # before its transaction took the write lock.
+            Product.objects.filter(pk=self.hammer.pk).update(price=Decimal('12.00'))
+            return serialized_write()
+
+        with override_settings(RATELIMIT_ENABLED=False):
+            with mock.patch('store.views.serialized_write', reprice_then_write):
+                self.client.post(reverse('store:checkout'), {
+                    'first_name': 'Test', 'last_name': 'Buyer', 'email': 'buyer@example.com',
+                    'phone': '123', 'address_line_1': '1 Street', 'city': 'City',
+                    'state': 'State', 'postal_code': '12345', 'country': 'US',
+                })
+        order = Order.objects.get()
+        self.assertEqual(order.items.get().price, Decimal('12.00'))
+        self.assertEqual(order.total_amount, get_order_pricing(order).total)
+        self.assertEqual(get_order_pricing(order).subtotal, Decimal('24.00'))
+
+
+class StressTest(SimpleTestCase):
+    """Runs ``stress_checkout`` in a subprocess against a file-backed database, as workers would."""
+
+    def test_concurrent_checkouts_keep_invariants(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        env = {
+            **os.environ, 'DJANGO_SETTINGS_MODULE': 'ecommerce_app.settings',
+            'DATABASE_NAME': os.path.join(directory, 'stress.sqlite3'), 'DATABASE_REPLICAS': '',
+        }
+        run = functools.partial(subprocess.run, env=env, capture_output=True, text=True, timeout=300)
+        migrate = run([sys.executable, '-m', 'django', 'migrate', '--no-input'])
+        self.assertEqual(migrate.returncode, 0, migrate.stderr)
+        result = run([
+            sys.executable, '-m', 'django', 'stress_checkout',
+            '--processes', '2', '--threads', '4', '--iterations', '6', '--skus', '2', '--stock', '8',
+        ])
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn('invariants hold', result.stdout)
+        # 48 rounds buying 1-2 units each can't all fit in 16 units of stock.
+        self.assertRegex(result.stdout, r'[1-9]\d* out of stock|[1-9]\d* failed checkouts')
+
+
+class CategoryTreeTest(TestCase):
+    def setUp(self):
+        self.electronics = Category.objects.create(name='Electronics', slug='electronics')
+        self.audio = Category.objects.create(name='Audio', slug='audio', parent=self.electronics)
+        self.headphones = Category.objects.create(name='Headphones', slug='headphones', parent=self.audio)
+        self.speakers = Category.objects.create(name='Speakers', slug='speakers', parent=self.audio)
+        self.garden = Category.objects.create(name='Garden', slug='garden')
+        for name, category in [
+            ('Radio', self.electronics), ('Earbuds', self.headphones), ('Cans', self.headphones),
+            ('Boombox', self.speakers), ('Rake', self.garden),
+        ]:
+            Product.objects.create(
+                name=name, slug=name.lower(), category=category, description=name, price=Decimal('10.00'),
+                image='products/item.jpg',
+            )
+
+    def test_paths_and_depths(self):
+        self.headphones.refresh_from_db()
+        self.assertEqual(self.headphones.path, ''.join(f'{c.pk:08d}' for c in (self.electronics, self.audio, self.headphones)))
+        self.assertEqual(self.headphones.depth, 2)
+        self.assertEqual(self.headphones.ancestor_ids, [self.electronics.pk, self.audio.pk])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.headphones.get_ancestors(), [self.electronics, self.audio])
+        self.assertEqual(set(self.audio.get_descendants()), {self.headphones, self.speakers})
+
+    def test_subtree_listing_and_counts(self):
+        self.assertEqual(sorted(subtree_ids(slug='audio')), sorted([self.audio.pk, self.headphones.pk, self.speakers.pk]))
+        names = filter_products({'category': 'electronics'}).values_list('name', flat=True)
+        self.assertEqual(list(names), ['Boombox', 'Cans', 'Earbuds', 'Radio'])
+        self.assertFalse(filter_products({'category': 'missing'}).exists())
+        category_ids = subtree_ids(pk=self.electronics.pk)
+        with self.assertNumQueries(3):
+            counts = subtree_counts(self.electronics, category_ids)
+        self.assertEqual(counts, [(self.audio, 3)])
+        self.assertEqual(subtree_counts(), [(self.electronics, 4), (self.garden, 1)])
+
+        response = self.client.get(reverse('store:category_products', args=['audio']))
+        self.assertEqual(response.context['breadcrumbs'], [self.electronics])
+        self.assertEqual(response.context['subcategories'], [(self.headphones, 2), (self.speakers, 1)])
+        self.assertEqual(response.context['page_obj'].paginator.count, 3)
+
+    def test_product_breadcrumbs(self):
+        response = self.client.get(reverse('store:product_detail', args=['earbuds']))
+        self.assertEqual(response.context['breadcrumbs'], [self.electronics, self.audio, self.headphones])
+        self.assertContains(response, reverse('store:category_products', args=['audio']))
+
+    def test_moving_a_subtree(self):
+        self.audio.parent = self.garden
+        self.audio.save()
+        self.headphones.refresh_from_db()
+        self.assertEqual(self.headphones.ancestor_ids, [self.garden.pk, self.audio.pk])
+        self.assertEqual(self.headphones.depth, 2)
+        self.assertEqual(subtree_counts(), [(self.electronics, 1), (self.garden, 4)])
+        change = CatalogChange.objects.filter(model='category', object_id=self.audio.pk).last()
+        self.assertEqual(change.data['parent_id'], self.garden.pk)
+
+    def test_cannot_move_under_own_subtree(self):
+        self.electronics.parent = self.headphones
+        with self.assertRaises(ValidationError):
+            self.electronics.full_clean()
+        with self.assertRaises(ValueError):
+            self.electronics.save()
+
+    def test_rebuild_after_bulk_import(self):
+        imported = Category.objects.bulk_create([Category(name='Tools', slug='tools')])[0]
+        Category.objects.bulk_create([Category(name='Saws', slug='saws', parent=imported)])
+        Category.objects.filter(pk=self.speakers.pk).update(path='', depth=0)
+        out = io.StringIO()
+        call_command('rebuild_category_tree', stdout=out)
+        self.assertIn('3 categories updated', out.getvalue())
+        saws = Category.objects.get(slug='saws')
+        self.assertEqual((saws.path, saws.depth), (f'{imported.pk:08d}{saws.pk:08d}', 1))
+        self.assertEqual(rebuild_tree(), 0)
+
+        Category.objects.filter(pk=self.electronics.pk).update(parent=self.headphones)
+        with self.assertRaises(TreeError):
+            rebuild_tree()
+
+    def test_deleting_a_parent_keeps_its_subtree(self):
+        with self.assertRaises(ProtectedError):
+            self.audio.delete()
+        self.assertEqual(Product.objects.filter(category__path__startswith=self.audio.path).count(), 3)
+        self.speakers.delete()
+        self.assertEqual(list(self.audio.children.all()), [self.headphones])
+
+    def test_rebuild_refreshes_the_catalog_and_promotion_indexes(self):
+        self.addCleanup(promotion_index.mark_stale)
+        Promotion.objects.create(name='electronics sale', kind='percentage', value=Decimal('10')).categories.set(
+            [self.electronics]
+        )
+        index = CatalogIndex()
+        index.refresh(force=True)
+        earbuds = Product.objects.get(slug='earbuds')
+        line = [(1, earbuds.price, earbuds.pk, earbuds.category_id)]
+        self.assertIn(earbuds.pk, index.query(category_slug='electronics'))
+        self.assertEqual(promotion_index.evaluate(line).amount, Decimal('1.00'))
+
+        Category.objects.filter(pk=self.audio.pk).update(parent=self.garden)
+        self.assertEqual(rebuild_tree(), 3)
+        index.refresh(force=True)
+        self.assertNotIn(earbuds.pk, index.query(category_slug='electronics'))
+        self.assertIn(earbuds.pk, index.query(category_slug='garden'))
+        self.assertEqual(promotion_index.evaluate(line).amount, 0)
+
+        Category.objects.filter(pk=self.audio.pk).update(parent=self.electronics)
+        rebuild_tree()
+        index.refresh(force=True)
+        self.assertIn(earbuds.pk, index.query(category_slug='electronics'))
+        self.assertEqual(promotion_index.evaluate(line).amount, Decimal('1.00'))
+
+
+class PromotionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.toys = Category.objects.create(name='Toys', slug='toys')
+        self.outdoor = Category.objects.create(name='Outdoor toys', slug='outdoor-toys', parent=self.toys)
+        self.ball = Product.objects.create(
+            name='Ball', slug='ball', category=self.toys, description='A ball', price=Decimal('10.00'), stock=20,
+        )
+        self.kite = Product.objects.create(
+            name='Kite', slug='kite', category=self.outdoor, description='A kite', price=Decimal('20.00'), stock=20,
+        )
+        self.cart = Cart.objects.create(user=self.user)
+        # Test transactions roll back without signals, so the next test's
+        # index must not keep this test's promotions.
+        self.addCleanup(promotion_index.mark_stale)
+
+    def promote(self, products=(), categories=(), **fields):
+        fields.setdefault('name', fields.get('kind', 'percentage'))
+        promotion = Promotion.objects.create(**fields)
+        promotion.products.set(products)
+        promotion.categories.set(categories)
+        return promotion
+
+    def evaluate(self, *lines, code=''):
+        return promotion_index.evaluate(
+            [(quantity, product.price, product.pk, product.category_id) for product, quantity in lines], code,
+        )
+
+    def test_line_promotions_take_the_best_rule_per_line(self):
+        self.promote(products=[self.ball], kind='percentage', value=Decimal('10'))
+        self.promote(products=[self.ball], kind='fixed', value=Decimal('3'), name='three off')
+        self.promote(products=[self.kite], kind='buy_x_get_y', buy_quantity=2, get_quantity=1, value=Decimal('100'))
+        discount = self.evaluate((self.ball, 2), (self.kite, 3))
+        self.assertEqual(discount.amount, Decimal('26.00'))
+        self.assertEqual(discount.promotions, ('three off', 'buy_x_get_y'))
+
+    def test_category_promotions_cover_subcategories(self):
+        self.promote(categories=[self.toys], kind='percentage', value=Decimal('25'))
+        self.assertEqual(self.evaluate((self.kite, 1)).amount, Decimal('5.00'))
+        # Moving the kite's category out of the tree re-files the rule.
+        self.outdoor.parent = None
+        self.outdoor.save()
+        self.assertEqual(self.evaluate((self.kite, 1)).amount, 0)
+
+    def test_cart_wide_rules_apply_after_line_discounts(self):
+        self.promote(products=[self.kite], kind='fixed', value=Decimal('5'))
+        self.promote(kind='percentage', value=Decimal('10'), min_subtotal=Decimal('30'))
+        self.assertEqual(self.evaluate((self.ball, 1), (self.kite, 1)).amount, Decimal('7.50'))
+        self.assertEqual(self.evaluate((self.kite, 1)).amount, Decimal('5'))
+
+    def test_coupons_and_time_windows(self):
+        now = timezone.now()
+        self.promote(kind='fixed', value=Decimal('4'), code='save4', name='Save 4')
+        self.promote(kind='percentage', value=Decimal('50'), starts_at=now + timedelta(hours=1))
+        self.promote(kind='percentage', value=Decimal('50'), ends_at=now - timedelta(hours=1))
+        self.assertEqual(self.evaluate((self.ball, 1)).amount, 0)
+        self.assertEqual(self.evaluate((self.ball, 1), code=' Save4 ').amount, Decimal('4'))
+        self.assertIsNotNone(promotion_index.coupon('SAVE4'))
+        self.assertIsNone(promotion_index.coupon('nope'))
+        later = promotion_index.evaluate([(1, self.ball.price, self.ball.pk, self.toys.pk)], now=now + timedelta(hours=2))
+        self.assertEqual(later.amount, Decimal('5.00'))
+
+    def test_evaluation_runs_no_queries(self):
+        for number in range(50):
+            self.promote(products=[self.ball], kind='percentage', value=Decimal(number % 40))
+        self.promote(categories=[self.toys], kind='percentage', value=Decimal('45'))
+        self.evaluate((self.ball, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.evaluate((self.ball, 2), (self.kite, 1)).amount, Decimal('18.00'))
+
+    def test_cart_pricing_and_checkout_apply_the_discount(self):
+        CartItem.objects.create(cart=self.cart, product=self.kite, quantity=2)
+        self.assertEqual(get_cart_pricing(Cart.objects.get(pk=self.cart.pk)).discount, 0)
+        promotion = self.promote(kind='percentage', value=Decimal('50'), code='HALF', name='Half off')
+        self.client.login(username='buyer', password='testpass123')
+        self.client.post(reverse('store:apply_coupon'), {'coupon_code': 'bogus'})
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).coupon_code, '')
+        self.client.post(reverse('store:apply_coupon'), {'coupon_code': 'half'})
+        pricing = get_cart_pricing(Cart.objects.get(pk=self.cart.pk))
+        self.assertEqual((pricing.discount, pricing.promotions), (Decimal('20.00'), ('Half off',)))
+        self.assertEqual(pricing.total, Decimal('20.00') + Decimal('9.99') + Decimal('1.60'))
+        response = self.client.get(reverse('store:cart'))
+        self.assertContains(response, 'Half off')
+
+        # Cached prices follow promotion edits.
+        promotion.value = Decimal('25')
+        promotion.save()
+        self.assertEqual(get_cart_pricing(Cart.objects.get(pk=self.cart.pk)).discount, Decimal('10.00'))
+
+        self.client.post(reverse('store:checkout'), {
+            'first_name': 'Test', 'last_name': 'User', 'email': 'buyer@example.com',
+            'phone': '123', 'address_line_1': '1 Street', 'city': 'City',
+            'state': 'State', 'postal_code': '12345', 'country': 'US',
+        })
+        order = Order.objects.get(user=self.user)
+        self.assertEqual((order.discount_amount, order.coupon_code), (Decimal('10.00'), 'HALF'))
+        self.assertEqual(order.total_amount, Decimal('30.00') + Decimal('9.99') + Decimal('2.40'))
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).coupon_code, '')
+        response = self.client.get(reverse('store:order_confirmation', args=[order.order_number]))
+        self.assertEqual(response.context['pricing'].total, order.total_amount)
+
+    def test_clean_rejects_incomplete_rules(self):
+        with self.assertRaises(ValidationError):
+            Promotion(name='x', kind='buy_x_get_y', value=Decimal('100'), buy_quantity=2).clean()
+        with self.assertRaises(ValidationError):
+            Promotion(name='x', kind='percentage', value=Decimal('150')).clean()
+
+
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.audio = Category.objects.create(name='Audio', slug='audio')
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        self.headphones = self.create_product('Wireless Headphones', self.audio)
+        self.speaker = self.create_product('Smart Speaker', self.audio)
+        self.phone = self.create_product('Smart Phone', self.phones)
+        self.create_product('Smart Watch (discontinued)', self.phones, is_active=False)
+        order = Order.objects.create(
+            user=self.user, order_number='ORD-AC-1', first_name='A', last_name='B', email='a@example.com',
+            phone='1', address_line_1='1 Street', city='City', state='State', postal_code='1',
+            country='US', total_amount=Decimal('10.00'),
+        )
+        OrderItem.objects.create(order=order, product=self.phone, quantity=5, price=Decimal('10.00'))
+        OrderItem.objects.create(order=order, product=self.speaker, quantity=2, price=Decimal('10.00'))
+        autocomplete_index.rebuild_from_database()
+
+    def create_product(self, name, category, is_active=True):
+        return Product.objects.create(
+            name=name, slug=slugify(name), category=category, description=name,
+            price=Decimal('10.00'), stock=5, is_active=is_active,
+        )
+
+    def names(self, query, index=autocomplete_index):
+        return [result['name'] for result in index.search(query)]
+
+    def test_prefix_matches_word_starts_ranked_by_popularity(self):
+        self.assertEqual(self.names('sma'), ['Smart Phone', 'Smart Speaker'])
+        self.assertEqual(self.names('PHONE'), ['Smart Phone', 'Phones'])
+        self.assertEqual(self.names('head'), ['Wireless Headphones'])
+        self.assertEqual(self.names('xyz'), [])
+
+    def test_product_changes_update_the_index(self):
+        self.headphones.name = 'Studio Headphones'
+        self.headphones.save()
+        self.assertEqual(self.names('studio'), ['Studio Headphones'])
+        self.assertEqual(self.names('wireless'), [])
+        self.speaker.delete()
+        self.assertEqual(self.names('smart'), ['Smart Phone'])
+        self.phone.is_active = False
+        self.phone.save()
+        self.assertEqual(self.names('smart'), [])
+
+    def test_short_prefixes_use_precomputed_top_results(self):
+        index = AutocompleteIndex()
+        count = RANK_SCAN_LIMIT * 2
+        index.build(('product', pk, f'Item {pk}', f'item-{pk}', pk) for pk in range(count))
+        self.assertIn('i', index._top)
+        self.assertEqual(self.names('it', index)[:2], [f'Item {count - 1}', f'Item {count - 2}'])
+        index.upsert('product', 1, 'Item 1', 'item-1', score=count * 10)
+        self.assertEqual(self.names('it', index)[0], 'Item 1')
+
+    def test_edits_patch_the_precomputed_top_results(self):
+        count = RANK_SCAN_LIMIT * 2
+        items = {pk: (f'Item {pk}', pk) for pk in range(count)}
+        index = AutocompleteIndex()
+        index.build(('product', pk, label, f'item-{pk}', score) for pk, (label, score) in items.items())
+        keys = list(index._keys)
+        index.upsert('product', 5, 'Item 5', 'item-5')
+        self.assertEqual(index._keys, keys)
+
+        index.upsert('product', 7, 'Item seven', 'item-7', score=count * 10)
+        index.remove('product', count - 1)
+        index.upsert('product', count - 2, 'Other', 'item-other')
+        items[7] = ('Item seven', count * 10)
+        del items[count - 1]
+        items[count - 2] = ('Other', count - 2)
+        # Still answered from the patched lists, and the same as a fresh build.
+        self.assertIn('i', index._top)
+        fresh = AutocompleteIndex()
+        fresh.build(('product', pk, label, f'item-{pk}', score) for pk, (label, score) in items.items())
+        for prefix in ('i', 'it', 'item', 'item s', 'o'):
+            self.assertEqual(self.names(prefix, index), self.names(prefix, fresh), prefix)
+
+    def test_refresh_applies_each_change_once(self):
+        Product.objects.filter(pk=self.phone.pk).update(stock=F('stock') - 1, updated_at=timezone.now())
+        with mock.patch('store.autocomplete.index_instance') as index_instance:
+            autocomplete_index.refresh_from_database()
+            self.assertEqual([call.args[0].pk for call in index_instance.call_args_list], [self.phone.pk])
+            autocomplete_index.refresh_from_database()
+            self.assertEqual(index_instance.call_count, 1)
+        # A sale doesn't change what the index holds, so nothing is rewritten.
+        with mock.patch.object(autocomplete_index, '_add_to_top') as add_to_top:
+            autocomplete_index.refresh_from_database()
+            Product.objects.get(pk=self.phone.pk).save()
+        add_to_top.assert_not_called()
+
+    def test_rebuilds_run_in_the_background(self):
+        index = AutocompleteIndex()
+        started, release = threading.Event(), threading.Event()
+
+        def slow_rebuild():
+            started.set()
+            release.wait(5)
+            index.build([('product', 1, 'Smart Phone', 'smart-phone', 0)])
+
+        with mock.patch.object(index, 'rebuild_from_database', side_effect=slow_rebuild):
+            index.ensure_current()
+            self.assertTrue(started.wait(5))
+            # The request that triggered the build, and those after it, get
+            # an empty answer instead of waiting for it.
+            self.assertEqual(self.names('smart', index), [])
+            index.ensure_current()
+            release.set()
+            with index._refresh_lock:
+                self.assertEqual(self.names('smart', index), ['Smart Phone'])
+
+    def test_autocomplete_view(self):
+        response = self.client.get(reverse('store:autocomplete'), {'q': 'smart p', 'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [{
+            'type': 'product', 'id': self.phone.pk, 'name': 'Smart Phone', 'slug': 'smart-phone',
+            'url': self.phone.get_absolute_url(),
+        }])
+        self.assertEqual(self.client.get(reverse('store:autocomplete')).json()['results'], [])
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+        with mock.patch('store.views.get_autocomplete_index', return_value=AutocompleteIndex()):
+            response = self.client.get(reverse('store:autocomplete'), {'q': 'smart'})
+        self.assertEqual(response.json()['results'], [])
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+
+class MediaServingTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.media_root, 'products'))
+        self.path = os.path.join(self.media_root, 'products', 'logo.svg')
+        self.body = b'<svg>' + b'x' * 1000 + b'</svg>'
+        with open(self.path, 'wb') as f:
+            f.write(self.body)
+        self.factory = RequestFactory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_full_response_is_cached_for_a_bounded_time_and_revalidates(self):
+        response = serve_media(self.factory.get('/media/products/logo.svg'), 'products/logo.svg')
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={24 * 60 * 60}')
+        request = self.factory.get('/media/products/logo.svg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(serve_media(request, 'products/logo.svg').status_code, 304)
+        for header, status in (
+            (f'"other", W/{response["ETag"]}', 304), ('*', 304),
+            # A tag the real one merely contains, or the other way round, is no match.
+            (response['ETag'][:-2] + '"', 200), (response['ETag'][:-1] + '0"', 200),
+        ):
+            request = self.factory.get('/media/products/logo.svg', HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(serve_media(request, 'products/logo.svg').status_code, status, header)
+
+        # A new upload reusing the name within the same second, at the same
+        # size, still fails revalidation.
+        stat_result = os.stat(self.path)
+        os.remove(self.path)
+        with open(self.path, 'wb') as f:
+            f.write(self.body.upper())
+        os.utime(self.path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1000))
+        request = self.factory.get('/media/products/logo.svg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(serve_media(request, 'products/logo.svg').status_code, 200)
+
+    def test_byte_ranges(self):
+        request = self.factory.get('/media/products/logo.svg', HTTP_RANGE='bytes=0-4')
+        response = serve_media(request, 'products/logo.svg')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'<svg>')
+        self.assertEqual(response['Content-Range'], f'bytes 0-4/{len(self.body)}')
+        request = self.factory.get('/media/products/logo.svg', HTTP_RANGE='bytes=5000-')
+        self.assertEqual(serve_media(request, 'products/logo.svg').status_code, 416)
+
+    def test_precompressed_variant(self):
+        with open(self.path + '.gz', 'wb') as f:
+            f.write(gzip.compress(self.body))
+        request = self.factory.get('/media/products/logo.svg', HTTP_ACCEPT_ENCODING='gzip')
+        response = serve_media(request, 'products/logo.svg')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.body)
+        with open(self.path + '.br', 'wb') as f:
+            f.write(b'brotli')
+        for header, encoding in (('br;q=0, gzip', 'gzip'), ('*', 'br'), ('*, br;q=0', 'gzip'), ('gzip;q=0', None)):
+            request = self.factory.get('/media/products/logo.svg', HTTP_ACCEPT_ENCODING=header)
+            response = serve_media(request, 'products/logo.svg')
+            self.assertEqual(response.get('Content-Encoding'), encoding, header)
+
+    def test_paths_outside_media_root_are_not_served(self):
+        with self.assertRaises(Http404):
+            serve_media(self.factory.get('/media/../settings.py'), '../settings.py')
+
+
+class PlaceholderTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, PLACEHOLDER_BACKGROUND=False)
+        self.settings_override.enable()
+        self.category = Category.objects.create(name='Posters', slug='posters')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def make_image(self, name='red.jpg', colour=(200, 20, 20)):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), colour).save(buffer, format='JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def create_product(self, image):
+        return Product.objects.create(
+            name='Poster', slug='poster', category=self.category, description='A poster',
+            price=Decimal('10.00'), image=image, stock=1,
+        )
+
+    def test_placeholder_is_computed_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product(self.make_image())
+        product.refresh_from_db()
+        red, green, blue = (int(product.placeholder_color[i:i + 2], 16) for i in (1, 3, 5))
+        self.assertGreater(red, 180)
+        self.assertLess(green + blue, 80)
+        self.assertTrue(product.placeholder_uri.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(product.placeholder_uri), 2000)
+        self.assertIn(product.placeholder_color, placeholder_style(product))
+
+    def test_only_new_uploads_are_scheduled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product(self.make_image())
+        product = Product.objects.get(pk=product.pk)
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.stock = 5
+            product.save()
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.image = self.make_image('blue.jpg', (20, 20, 200))
+            product.save()
+        self.assertEqual(len(callbacks), 1)
+
+    def test_backfill_skips_unreadable_images(self):
+        product = self.create_product(SimpleUploadedFile('broken.jpg', b'not an image'))
+        out = io.StringIO()
+        call_command('backfill_placeholders', stdout=out)
+        self.assertIn('1 unreadable image(s) skipped', out.getvalue())
+        product.refresh_from_db()
+        self.assertEqual(product.placeholder_uri, '')
+        self.assertEqual(placeholder_style(product), '')
+
+
 class AuthenticationViewTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'store'
 
@@ -7,10 +7,17 @@ urlpatterns = [
     path('', views.product_list_view, name='product_list'),
     path('product/<slug:slug>/', views.product_detail_view, name='product_detail'),
     path('category/<slug:slug>/', views.category_products_view, name='category_products'),
+    path('autocomplete/', views.autocomplete_view, name='autocomplete'),
+    path('stock/', views.stock_view, name='stock'),
+    path('api/products/', api.products_api_view, name='products_api'),
+    path('api/changes/', api.changes_api_view, name='changes_api'),
+    path('sitemap.xml', views.sitemap_view, name='sitemap'),
+    path('sitemaps/<str:name>', views.sitemap_view, name='sitemap_file'),
     path('cart/', views.cart_view, name='cart'),
     path('add-to-cart/', views.add_to_cart_view, name='add_to_cart'),
     path('update-cart-item/', views.update_cart_item_view, name='update_cart_item'),
     path('remove-from-cart/', views.remove_from_cart_view, name='remove_from_cart'),
+    path('cart/coupon/', views.apply_coupon_view, name='apply_coupon'),
     path('checkout/', views.checkout_view, name='checkout'),
     path('order-confirmation/<str:order_number>/', views.order_confirmation_view, name='order_confirmation'),
     path('order/<str:order_number>/', views.order_detail_view, name='order_detail'),
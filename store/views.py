@@ -2,58 +2,60 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Q
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.db.models import Prefetch, Q
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils._os import safe_join
+from django.views.decorators.http import require_GET, require_POST, require_safe
 from django.views.decorators.csrf import csrf_exempt
 import json
-import uuid
-from .models import Product, Category, Cart, CartItem, Order, OrderItem
+import re
+from ecommerce_app.db.writes import DatabaseBusy, serialized_write
+from ecommerce_app.throttling import checkout_limiter, limit_concurrency, rate_limit
+from .archive import get_order_for_user
+from .autocomplete import MAX_RESULTS, get_autocomplete_index
+from .catalog_index import get_catalog_index
+from .categories import products_in, subtree_counts, subtree_ids
+from .inventory import OutOfStock, add_to_cart, reserve_stock
+from .listing import filter_products
+from .models import Product, ProductImage, Category, Cart, CartItem, Order, OrderItem
+from .order_numbers import generate_order_number
+from .pricing import get_cart_pricing, get_order_pricing, price_lines
+from .promotions import normalize_code, promotion_index
+from .sitemaps import INDEX_NAME, sitemap_root
+from .stock import MAX_LOOKUP, cache_key, parse_ids, stock_lookup
+from .task_queue import enqueue
+from .tasks import check_low_stock, send_order_confirmation
+
+BUSY_MESSAGE = 'The store is very busy right now. Please try again in a moment.'
+SITEMAP_FILE_RE = re.compile(r'^[\w-]+\.xml$')
 
 
 def product_list_view(request):
-    products = Product.objects.filter(is_active=True).select_related('category')
+    products = filter_products(request.GET).select_related('category')
     categories = Category.objects.filter(is_active=True)
-    
-    # Search functionality
     search_query = request.GET.get('search', '')
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(category__name__icontains=search_query)
-        )
-    
-    # Category filter
     category_slug = request.GET.get('category', '')
-    if category_slug:
-        products = products.filter(category__slug=category_slug)
-    
-    # Price filter
     min_price = request.GET.get('min_price', '')
     max_price = request.GET.get('max_price', '')
-    if min_price:
-        products = products.filter(price__gte=min_price)
-    if max_price:
-        products = products.filter(price__lte=max_price)
-    
-    # Sorting
     sort_by = request.GET.get('sort', 'name')
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'newest':
-        products = products.order_by('-created_at')
-    elif sort_by == 'featured':
-        products = products.order_by('-is_featured', 'name')
-    else:
-        products = products.order_by('name')
     
     # Pagination
-    paginator = Paginator(products, 12)  # Show 12 products per page
     page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = None
+    catalog_index = get_catalog_index()
+    if catalog_index is not None and not search_query:
+        product_ids = catalog_index.query(category_slug, min_price, max_price, sort_by)
+        if product_ids is not None:
+            page_obj = Paginator(product_ids, 12).get_page(page_number)
+            page_ids = [int(product_id) for product_id in page_obj.object_list]
+            page_products = Product.objects.select_related('category').in_bulk(page_ids)
+            page_obj.object_list = [page_products[product_id] for product_id in page_ids if product_id in page_products]
+    if page_obj is None:
+        paginator = Paginator(products, 12)  # Show 12 products per page
+        page_obj = paginator.get_page(page_number)
     
     context = {
         'page_obj': page_obj,
@@ -68,14 +70,27 @@ def product_list_view(request):
 
 
 def product_detail_view(request, slug):
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    related_products = Product.objects.filter(
-        category=product.category, 
-        is_active=True
-    ).exclude(id=product.id)[:4]
+    # A fixed four queries however large the gallery: product with category,
+    # gallery, related products, and the related products' primary images.
+    product = get_object_or_404(
+        Product.objects.select_related('category').prefetch_related('additional_images'),
+        slug=slug, is_active=True,
+    )
+    related_products = list(
+        Product.objects.filter(category_id=product.category_id, is_active=True)
+        .exclude(id=product.id)
+        .prefetch_related(Prefetch(
+            'additional_images',
+            queryset=ProductImage.objects.filter(is_primary=True).order_by('product_id', '-is_primary', 'created_at'),
+            to_attr='primary_images',
+        ))[:4]
+    )
     
     context = {
         'product': product,
+        # One more query, for subcategories only.
+        'breadcrumbs': product.category.get_ancestors() + [product.category],
+        'gallery_images': list(product.additional_images.all()),
         'related_products': related_products,
     }
     return render(request, 'store/product_detail.html', context)
@@ -83,7 +98,8 @@ def product_detail_view(request, slug):
 
 def category_products_view(request, slug):
     category = get_object_or_404(Category, slug=slug, is_active=True)
-    products = Product.objects.filter(category=category, is_active=True)
+    category_ids = subtree_ids(pk=category.pk)
+    products = products_in(category_ids)
     
     # Apply same filtering and sorting as product_list_view
     search_query = request.GET.get('search', '')
@@ -109,6 +125,8 @@ def category_products_view(request, slug):
     
     context = {
         'category': category,
+        'breadcrumbs': category.get_ancestors(),
+        'subcategories': subtree_counts(category, category_ids),
         'page_obj': page_obj,
         'search_query': search_query,
         'current_sort': sort_by,
@@ -116,7 +134,72 @@ def category_products_view(request, slug):
     return render(request, 'store/category_products.html', context)
 
 
+@require_GET
+def autocomplete_view(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 8)), MAX_RESULTS)
+    except ValueError:
+        limit = 8
+
+    index = get_autocomplete_index()
+    results = index.search(query, limit) if query else []
+    for result in results:
+        url_name = 'store:product_detail' if result['type'] == 'product' else 'store:category_products'
+        result['url'] = reverse(url_name, kwargs={'slug': result['slug']})
+
+    response = JsonResponse({'query': query, 'results': results})
+    # Until the first build lands every answer is empty; don't let browsers
+    # or a CDN keep that for a minute after each deploy.
+    response['Cache-Control'] = 'public, max-age=60' if index.is_built else 'no-store'
+    return response
+
+
+@require_GET
+def stock_view(request):
+    """Stock for up to MAX_LOOKUP products: ``?ids=1,2&slugs=a,b`` (or repeated params)."""
+    def values(name):
+        return list(dict.fromkeys(v.strip() for param in request.GET.getlist(name) for v in param.split(',') if v.strip()))
+
+    ids, slugs = parse_ids(values('ids')), values('slugs')
+    if ids is None:
+        return JsonResponse({'error': 'ids must be integers'}, status=400)
+    ids = [str(pk) for pk in ids]
+    if len(ids) + len(slugs) > MAX_LOOKUP:
+        return JsonResponse({'error': f'At most {MAX_LOOKUP} products per request'}, status=400)
+
+    rows = stock_lookup.get(ids, slugs)
+    products, missing = {}, []
+    for kind, requested in (('id', ids), ('slug', slugs)):
+        for value in requested:
+            row = rows[cache_key(kind, value)]
+            if row is None:
+                missing.append(value)
+            else:
+                products[row['id']] = {
+                    'id': row['id'], 'slug': row['slug'], 'stock': row['stock'], 'is_in_stock': row['stock'] > 0,
+                }
+
+    response = JsonResponse({'products': list(products.values()), 'missing': missing})
+    response['Cache-Control'] = f'public, max-age={stock_lookup.ttl}'
+    return response
+
+
+@require_safe
+def sitemap_view(request, name=INDEX_NAME):
+    if not SITEMAP_FILE_RE.match(name):
+        raise Http404('No such sitemap.')
+    try:
+        path = safe_join(sitemap_root(), name)
+        response = FileResponse(open(path, 'rb'), content_type='application/xml')
+    except (SuspiciousFileOperation, FileNotFoundError):
+        raise Http404('No such sitemap.')
+    response['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+
 @require_POST
+@rate_limit('cart')
 def add_to_cart_view(request):
     if not request.user.is_authenticated:
         return JsonResponse({'success': False, 'message': 'Please log in to add items to cart'})
@@ -131,26 +214,23 @@ def add_to_cart_view(request):
         if quantity > product.stock:
             return JsonResponse({'success': False, 'message': 'Not enough stock available'})
         
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            if cart_item.quantity > product.stock:
+        with serialized_write():
+            cart, created = Cart.objects.get_or_create(user=request.user)
+            # One conditional UPDATE, so concurrent adds can't lose each other.
+            if not add_to_cart(cart, product, quantity):
                 return JsonResponse({'success': False, 'message': 'Not enough stock available'})
-            cart_item.save()
         
+        pricing = get_cart_pricing(cart)
         return JsonResponse({
             'success': True,
             'message': f'{product.name} added to cart',
-            'cart_items_count': cart.total_items,
-            'cart_total': float(cart.total_price)
+            'cart_items_count': pricing.item_count,
+            'cart_total': float(pricing.subtotal),
+            'pricing': pricing.as_dict(),
         })
         
+    except DatabaseBusy:
+        return JsonResponse({'success': False, 'message': BUSY_MESSAGE})
     except Exception as e:
         return JsonResponse({'success': False, 'message': 'An error occurred'})
 
@@ -167,12 +247,14 @@ def cart_view(request):
     context = {
         'cart_items': cart_items,
         'cart': cart,
+        'pricing': get_cart_pricing(cart),
     }
     return render(request, 'store/cart.html', context)
 
 
 @login_required
 @require_POST
+@rate_limit('cart')
 def update_cart_item_view(request):
     try:
         data = json.loads(request.body)
@@ -182,53 +264,92 @@ def update_cart_item_view(request):
         cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
         
         if quantity <= 0:
-            cart_item.delete()
+            with serialized_write():
+                cart_item.delete()
             message = 'Item removed from cart'
         else:
             if quantity > cart_item.product.stock:
                 return JsonResponse({'success': False, 'message': 'Not enough stock available'})
             cart_item.quantity = quantity
-            cart_item.save()
+            with serialized_write():
+                cart_item.save()
             message = 'Cart updated'
         
         cart = cart_item.cart if quantity > 0 else Cart.objects.get(user=request.user)
+        pricing = get_cart_pricing(cart)
         
         return JsonResponse({
             'success': True,
             'message': message,
-            'cart_items_count': cart.total_items,
-            'cart_total': float(cart.total_price),
-            'item_total': float(cart_item.total_price) if quantity > 0 else 0
+            'cart_items_count': pricing.item_count,
+            'cart_total': float(pricing.subtotal),
+            'item_total': float(cart_item.total_price) if quantity > 0 else 0,
+            'pricing': pricing.as_dict(),
         })
         
+    except DatabaseBusy:
+        return JsonResponse({'success': False, 'message': BUSY_MESSAGE})
     except Exception as e:
         return JsonResponse({'success': False, 'message': 'An error occurred'})
 
 
 @login_required
 @require_POST
+@rate_limit('cart')
 def remove_from_cart_view(request):
     try:
         data = json.loads(request.body)
         item_id = data.get('item_id')
 
         cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-        cart_item.delete()
+        with serialized_write():
+            cart_item.delete()
 
         cart = Cart.objects.get(user=request.user)
+        pricing = get_cart_pricing(cart)
 
         return JsonResponse({
             'success': True,
             'message': 'Item removed from cart',
-            'cart_items_count': cart.total_items,
-            'cart_total': float(cart.total_price)
+            'cart_items_count': pricing.item_count,
+            'cart_total': float(pricing.subtotal),
+            'pricing': pricing.as_dict(),
         })
 
+    except DatabaseBusy:
+        return JsonResponse({'success': False, 'message': BUSY_MESSAGE})
     except Exception as e:
         return JsonResponse({'success': False, 'message': 'An error occurred'})
 
 
 @login_required
+@require_POST
+@rate_limit('cart', redirect_to='store:cart')
+def apply_coupon_view(request):
+    code = normalize_code(request.POST.get('coupon_code'))
+    if code and promotion_index.coupon(code) is None:
+        messages.error(request, f'The coupon {code} is not valid.')
+        return redirect('store:cart')
+
+    try:
+        with serialized_write():
+            cart, created = Cart.objects.get_or_create(user=request.user)
+            # Moving updated_at gives the cart a new pricing version.
+            Cart.objects.filter(pk=cart.pk).update(coupon_code=code, updated_at=timezone.now())
+    except DatabaseBusy:
+        messages.error(request, BUSY_MESSAGE)
+        return redirect('store:cart')
+
+    if code:
+        messages.success(request, f'Coupon {code} applied.')
+    else:
+        messages.info(request, 'Coupon removed.')
+    return redirect('store:cart')
+
+
+@login_required
+@rate_limit('checkout')
+@limit_concurrency(checkout_limiter)
 def checkout_view(request):
     try:
         cart = Cart.objects.get(user=request.user)
@@ -249,37 +370,71 @@ def checkout_view(request):
         return redirect('store:cart')
 
     if request.method == 'POST':
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            order_number=f"ORD-{uuid.uuid4().hex[:8].upper()}",
-            first_name=request.POST.get('first_name'),
-            last_name=request.POST.get('last_name'),
-            email=request.POST.get('email'),
-            phone=request.POST.get('phone'),
-            address_line_1=request.POST.get('address_line_1'),
-            address_line_2=request.POST.get('address_line_2', ''),
-            city=request.POST.get('city'),
-            state=request.POST.get('state'),
-            postal_code=request.POST.get('postal_code'),
-            country=request.POST.get('country'),
-            total_amount=cart.total_price
-        )
-
-        # Create order items and update stock
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.price
-            )
-            # Update product stock
-            item.product.stock -= item.quantity
-            item.product.save()
-
-        # Clear cart
-        cart.items.all().delete()
+        try:
+            with serialized_write():
+                # Read the cart again inside the transaction: the stock taken,
+                # the order lines and the totals all come from this one read,
+                # so a repricing since the page loaded can't split them.
+                cart_items = list(cart.items.select_related('product'))
+                if not cart_items:
+                    messages.warning(request, 'Your cart is empty.')
+                    return redirect('store:cart')
+
+                # Take the stock first: the conditional decrement is what
+                # stops two checkouts selling the same last unit.
+                reserve_stock([(item.product, item.quantity) for item in cart_items])
+
+                # Priced afresh rather than from the cache, so a promotion
+                # that just ended can't be charged.
+                lines = [
+                    (item.quantity, item.product.price, item.product_id, item.product.category_id)
+                    for item in cart_items
+                ]
+                pricing = price_lines(lines, cart.coupon_code)
+                coupon = promotion_index.coupon(cart.coupon_code)
+
+                # Create order
+                order = Order.objects.create(
+                    user=request.user,
+                    order_number=generate_order_number(),
+                    first_name=request.POST.get('first_name'),
+                    last_name=request.POST.get('last_name'),
+                    email=request.POST.get('email'),
+                    phone=request.POST.get('phone'),
+                    address_line_1=request.POST.get('address_line_1'),
+                    address_line_2=request.POST.get('address_line_2', ''),
+                    city=request.POST.get('city'),
+                    state=request.POST.get('state'),
+                    postal_code=request.POST.get('postal_code'),
+                    country=request.POST.get('country'),
+                    total_amount=pricing.total,
+                    discount_amount=pricing.discount,
+                    coupon_code=coupon.code if coupon and coupon.name in pricing.promotions else '',
+                )
+
+                # Create order items
+                for item in cart_items:
+                    OrderItem.objects.create(
+                        order=order,
+                        product=item.product,
+                        quantity=item.quantity,
+                        price=item.product.price
+                    )
+
+                # Clear cart
+                cart.items.all().delete()
+                Cart.objects.filter(pk=cart.pk).update(coupon_code='')
+
+                # Follow-up work runs in the task worker; queued in this
+                # transaction so it exists exactly when the order does.
+                enqueue(send_order_confirmation, args=[order.pk])
+                enqueue(check_low_stock, args=[[item.product_id for item in cart_items]])
+        except OutOfStock as error:
+            messages.error(request, str(error))
+            return redirect('store:cart')
+        except DatabaseBusy:
+            messages.error(request, BUSY_MESSAGE)
+            return redirect('store:checkout')
 
         messages.success(request, f'Order {order.order_number} placed successfully!')
         return redirect('store:order_confirmation', order_number=order.order_number)
@@ -287,22 +442,24 @@ def checkout_view(request):
     context = {
         'cart_items': cart_items,
         'cart': cart,
+        'pricing': get_cart_pricing(cart),
     }
     return render(request, 'store/checkout.html', context)
 
 
 @login_required
 def order_confirmation_view(request, order_number):
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
+    order = get_order_for_user(request.user, order_number)
     context = {
         'order': order,
+        'pricing': get_order_pricing(order),
     }
     return render(request, 'store/order_confirmation.html', context)
 
 
 @login_required
 def order_detail_view(request, order_number):
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
+    order = get_order_for_user(request.user, order_number)
     context = {
         'order': order,
     }
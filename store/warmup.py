@@ -0,0 +1,124 @@
+"""
+Worker warm-up.
+
+Django loads templates, URL resolvers, template tag libraries and model
+metadata lazily, so without warm-up the first requests after a deploy or a
+worker recycle pay for all of it. ``warm_up()`` does that work at boot; it is
+called from the WSGI/ASGI entry points when ``WARMUP_ON_STARTUP`` is set and
+by the ``warmup`` management command.
+"""
+import importlib
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.urls import NoReverseMatch, URLPattern, URLResolver, get_resolver, reverse
+
+WARMUP_MODULES = [
+    'store.views',
+    'accounts.views',
+    'store.admin',
+    'accounts.admin',
+    'store.templatetags.custom_filters',
+    'crispy_forms.templatetags.crispy_forms_tags',
+    'crispy_forms.templatetags.crispy_forms_filters',
+    'crispy_tailwind.templatetags.tailwind_field',
+    'crispy_tailwind.templatetags.tailwind_filters',
+    'django.contrib.admin.templatetags.admin_list',
+    'django.contrib.admin.templatetags.admin_modify',
+]
+
+
+def import_modules():
+    imported = 0
+    for module in getattr(settings, 'WARMUP_MODULES', WARMUP_MODULES):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+        imported += 1
+    return imported
+
+
+def template_names():
+    """Every template under the project's template directories and the crispy Tailwind pack."""
+    directories = [Path(directory) for engine in settings.TEMPLATES for directory in engine.get('DIRS', [])]
+    try:
+        import crispy_tailwind
+        directories.append(Path(crispy_tailwind.__file__).parent / 'templates')
+    except ImportError:
+        pass
+    for directory in directories:
+        for path in sorted(directory.rglob('*.html')):
+            yield path.relative_to(directory).as_posix()
+
+
+def compile_templates():
+    compiled = 0
+    for name in template_names():
+        try:
+            get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError):
+            continue
+        compiled += 1
+    return compiled
+
+
+def _url_names(patterns, namespace=None):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            child_namespace = namespace
+            if pattern.namespace:
+                child_namespace = f'{namespace}:{pattern.namespace}' if namespace else pattern.namespace
+            yield from _url_names(pattern.url_patterns, child_namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield f'{namespace}:{pattern.name}' if namespace else pattern.name
+
+
+def prime_urls():
+    resolver = get_resolver()
+    resolver.reverse_dict  # builds the resolver's lookup tables
+    primed = 0
+    for name in _url_names(resolver.url_patterns):
+        try:
+            reverse(name)
+        except NoReverseMatch:
+            # Patterns with arguments still had their regexes compiled above.
+            continue
+        primed += 1
+    return primed
+
+
+def load_models():
+    models = apps.get_models()
+    for model in models:
+        model._meta.get_fields()
+    return len(models)
+
+
+def connect_database():
+    connection.ensure_connection()
+    return 1
+
+
+def warm_up(connect=True):
+    """Run every warm-up step and return ``{step: (count, seconds)}``."""
+    steps = [
+        ('modules', import_modules),
+        ('models', load_models),
+        ('urls', prime_urls),
+        ('templates', compile_templates),
+    ]
+    if connect:
+        steps.append(('database', connect_database))
+
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        count = step()
+        timings[name] = (count, time.perf_counter() - started)
+    return timings